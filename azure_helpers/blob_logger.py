@@ -1,31 +1,168 @@
 import logging
+import queue
+import threading
+import time
 from datetime import datetime
+
+from azure.core.exceptions import ResourceExistsError
 from azure.storage.blob import BlobServiceClient
 
+# Append blocks are capped at 4 MiB by the storage service.
+MAX_BLOCK_BYTES = 4 * 1024 * 1024
+
+
 class AzureBlobLogHandler(logging.Handler):
-    def __init__(self, conn_str: str, container_name: str, blob_prefix: str):
+    """
+    Logging handler writing records to daily append blobs.
+
+    Records are formatted on the calling thread and pushed to a bounded
+    in-memory queue; a background thread groups them into batched
+    `append_block` calls, flushed when `batch_size` records are pending or
+    every `flush_interval` seconds. When the queue is full, records are
+    dropped and counted instead of blocking the caller.
+    """
+
+    def __init__(self, conn_str: str, container_name: str, blob_prefix: str,
+                 queue_size: int = 10000, batch_size: int = 500, flush_interval: float = 2.0):
         super().__init__()
         self.client = BlobServiceClient.from_connection_string(conn_str)
         self.container = self.client.get_container_client(container_name)
         self.blob_prefix = blob_prefix
-        # ensure container exists
-        try:
-            self.container.create_container()
-        except Exception:
-            pass
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.05, flush_interval)
+
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._drop_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._known_blobs = set()
+        self._container_ready = False
+        self._closed = False
+
+        self._worker = threading.Thread(target=self._run, name="blob-log-writer", daemon=True)
+        self._worker.start()
+
+    # -------------------------------------------------------------------------
+    # Producer side (request threads)
+    # -------------------------------------------------------------------------
 
     def emit(self, record):
         try:
             log_entry = self.format(record) + "\n"
-            blob_name = f"{self.blob_prefix}/{datetime.now():%Y-%m-%d}.log"
-            blob_client = self.container.get_blob_client(blob_name)
+            blob_name = f"{self.blob_prefix}/{datetime.fromtimestamp(record.created):%Y-%m-%d}.log"
+        except Exception:
+            self.handleError(record)
+            return
+
+        try:
+            self._queue.put_nowait((blob_name, log_entry))
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def flush(self, timeout: float = 5.0):
+        """
+        Block until every record queued before this call has been written,
+        or until `timeout` seconds have elapsed.
+        """
+        if self._closed or not self._worker.is_alive():
+            return
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def close(self):
+        if not self._closed:
+            self.flush()
+            self._closed = True
+            try:
+                self._queue.put(None, timeout=1.0)
+            except queue.Full:
+                pass
+            self._worker.join(timeout=5.0)
+        super().close()
+
+    # -------------------------------------------------------------------------
+    # Consumer side (background writer)
+    # -------------------------------------------------------------------------
+
+    def _run(self):
+        pending = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False  # flush interval elapsed
+
+            if item is None:
+                self._write(pending)
+                return
+
+            if isinstance(item, threading.Event):
+                self._write(pending)
+                pending = []
+                item.set()
+            elif item:
+                pending.append(item)
+
+            if item is False or len(pending) >= self.batch_size:
+                self._write(pending)
+                pending = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, entries):
+        dropped = self.dropped - self._reported_dropped
+        if dropped > 0 and entries:
+            self._reported_dropped += dropped
+            entries = entries + [(entries[-1][0], f"{datetime.now():%Y-%m-%d %H:%M:%S} | WARNING | "
+                                                  f"Blob log queue full, dropped {dropped} records.\n")]
+        if not entries:
+            return
+
+        by_blob = {}
+        for blob_name, log_entry in entries:
+            by_blob.setdefault(blob_name, []).append(log_entry.encode("utf-8"))
+
+        for blob_name, lines in by_blob.items():
+            try:
+                blob_client = self._get_append_blob(blob_name)
+                for block in self._chunk(lines):
+                    blob_client.append_block(block)
+            except Exception as e:
+                self._known_blobs.discard(blob_name)
+                print(f"Blob log write failed: {e}", flush=True)
+
+    def _get_append_blob(self, blob_name):
+        if not self._container_ready:
+            try:
+                self.container.create_container()
+            except ResourceExistsError:
+                pass
+            self._container_ready = True
 
+        blob_client = self.container.get_blob_client(blob_name)
+        if blob_name not in self._known_blobs:
             # Ensure the blob exists, or create it as an append blob
             if not blob_client.exists():
-                from azure.storage.blob import BlobType
-                blob_client.create_append_blob()
+                try:
+                    blob_client.create_append_blob()
+                except ResourceExistsError:
+                    pass
+            self._known_blobs.add(blob_name)
+        return blob_client
 
-            # Append the new log line
-            blob_client.append_block(log_entry.encode("utf-8"))
-        except Exception as e:
-            print(f"Blob log write failed: {e}", flush=True)
+    @staticmethod
+    def _chunk(lines):
+        block, size = [], 0
+        for line in lines:
+            if block and size + len(line) > MAX_BLOCK_BYTES:
+                yield b"".join(block)
+                block, size = [], 0
+            block.append(line[:MAX_BLOCK_BYTES])
+            size += len(block[-1])
+        if block:
+            yield b"".join(block)
@@ -77,4 +77,18 @@ def load_model_from_blob_storage(
 
     except Exception as e:
         logging.exception("Failed to load model '%s' from blob storage: %s", blob_name, e)
-        raise
\ No newline at end of file
+        raise
+
+def get_blob_etag(blob_name: str, container_name: str = "azure-bookrec-models-blob") -> str:
+    """
+    Return the current ETag of a blob (metadata request only, no download).
+    Used to version caches derived from model artifacts.
+    """
+    try:
+        blob_service = get_blob_service_client()
+        blob_client = blob_service.get_blob_client(container=container_name, blob=blob_name)
+        return blob_client.get_blob_properties().etag
+
+    except Exception as e:
+        logging.exception("Failed to read properties of blob %s/%s: %s", container_name, blob_name, e)
+        raise
@@ -6,6 +6,8 @@ import numpy as np
 import pandas as pd
 from azure.cosmos import CosmosClient, exceptions
 
+from function_app_tracing import traced
+
 # ---- Configuration ----
 COSMOS_CONNECTION_STRING = os.getenv("CosmosDbConnectionString")
 DATABASE_NAME = "bookrec"
@@ -41,6 +43,7 @@ def get_container():
         raise
 
 
+@traced("cosmos.articles.get_all_articles")
 def get_all_articles() -> pd.DataFrame:
     """
     Retrieve all article metadata from Cosmos DB as a pandas DataFrame.
@@ -62,6 +65,7 @@ def get_all_articles() -> pd.DataFrame:
         raise
 
 
+@traced("cosmos.articles.get_n_newest")
 def get_n_newest(n: int) -> List[dict]:
     """
     Retrieve the N newest articles from Cosmos DB, computing a freshness score
@@ -15,6 +15,7 @@ _client = None
 _container = None
 
 from function_app_logging import get_logger
+from function_app_tracing import traced
 logger = get_logger("clicks_repo")
 
 def get_container():
@@ -45,6 +46,7 @@ def get_container():
 
 
 # ---- Query Functions ----
+@traced("cosmos.clicks.get_all_clicks")
 def get_all_clicks() -> pd.DataFrame:
     """
     Retrieve all click records as a pandas DataFrame.
@@ -77,6 +79,7 @@ def get_all_clicks() -> pd.DataFrame:
         raise
 
 
+@traced("cosmos.clicks.get_clicked_articles_by_user")
 def get_clicked_articles_by_user(user_id: int) -> List[int]:
     """
     Retrieve all clicked article IDs for a given user.
@@ -101,6 +104,33 @@ def get_clicked_articles_by_user(user_id: int) -> List[int]:
         raise
 
 
+@traced("cosmos.clicks.get_user_click_history")
+def get_user_click_history(user_id: int) -> List[int]:
+    """
+    Retrieve the clicked article IDs of a user, oldest click first.
+    Single-partition query (clicks are partitioned by user_id).
+    """
+    if not isinstance(user_id, int):
+        logger.warning("Invalid user_id provided to get_user_click_history: %s", user_id)
+        return []
+    container = get_container()
+    query = "SELECT c.click_article_id FROM c WHERE c.user_id = @user_id ORDER BY c.click_timestamp ASC"
+    params = [{"name": "@user_id", "value": user_id}]
+
+    try:
+        items = container.query_items(query=query, parameters=params, partition_key=user_id)
+        articles = [int(doc["click_article_id"]) for doc in items]
+        logger.debug("User %s has %d clicks.", user_id, len(articles))
+        return articles
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error("Cosmos DB query error in get_user_click_history: %s", e)
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error retrieving user click history: %s", e)
+        raise
+
+
+@traced("cosmos.clicks.get_last_clicked_by_user")
 def get_last_clicked_by_user(user_id: int) -> Optional[int]:
     """
     Retrieve the most recently clicked article ID for a given user.
@@ -127,6 +157,7 @@ def get_last_clicked_by_user(user_id: int) -> Optional[int]:
         raise
 
 
+@traced("cosmos.clicks.get_users")
 def get_users() -> List[int]:
     container = get_container()
     query = "SELECT c.user_id FROM c"
@@ -140,4 +171,30 @@ def get_users() -> List[int]:
         raise
     except Exception as e:
         logger.exception("Unexpected error retrieving last click: %s", e)
-        raise
\ No newline at end of file
+        raise
+
+
+@traced("cosmos.clicks.add_click")
+def add_click(user_id: int, article_id: int, session_id: int, click_timestamp: int) -> dict:
+    """
+    Write a click record. The document id follows the bulk upload format
+    (user-session-timestamp), so replaying the same click is idempotent.
+    """
+    container = get_container()
+    item = {
+        "id": f"{user_id}-{session_id}-{click_timestamp}",
+        "user_id": int(user_id),
+        "session_id": int(session_id),
+        "click_article_id": int(article_id),
+        "click_timestamp": int(click_timestamp),
+    }
+    try:
+        container.upsert_item(item)
+        logger.debug("Recorded click of user %s on article %s.", user_id, article_id)
+        return item
+    except exceptions.CosmosHttpResponseError as e:
+        logger.error("Cosmos DB write error in add_click: %s", e)
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error recording click: %s", e)
+        raise
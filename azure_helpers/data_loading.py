@@ -1,26 +1,103 @@
-import logging, random
-from typing import Optional, List
+import logging, os, random, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, List
 import numpy as np
 import pandas as pd
 
 import azure_helpers.cosmos_articles_repository as articles_db
 import azure_helpers.cosmos_clicks_repository as clicks_db
+from azure_helpers.user_history_store import UserHistoryStore
+
+# Per-user click histories, read from Cosmos on a miss and updated on every ingested click
+user_histories = UserHistoryStore(
+    max_bytes=int(os.getenv("UserHistoryStoreMaxBytes", str(64 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("UserHistoryTTLSeconds", "300"))
+)
+
+# Columns used downstream and their compact dtypes (raw click files carry ~12 int64 columns)
+CLICK_DTYPES = {
+    "user_id": "int32",
+    "session_id": "int64",
+    "click_article_id": "int32",
+    "click_timestamp": "int64",
+}
+
+# ---------------------------------------------------------------------
+# Click Files (training data)
+# ---------------------------------------------------------------------
+
+def read_clicks_csv(path: str, chunksize: int = 1_000_000) -> pd.DataFrame:
+    """
+    Read one click CSV in chunks, keeping only CLICK_DTYPES columns and
+    dropping duplicate rows chunk by chunk.
+    """
+    chunks = pd.read_csv(path, usecols=list(CLICK_DTYPES), dtype=CLICK_DTYPES, chunksize=chunksize)
+    return pd.concat([chunk.drop_duplicates() for chunk in chunks], ignore_index=True)
+
+
+def read_click_files(paths: Iterable[str], chunksize: int = 1_000_000, n_jobs: int = 1) -> pd.DataFrame:
+    """
+    Load and deduplicate many click CSVs with compact dtypes.
+
+    Files are read chunk by chunk (optionally on `n_jobs` threads; the CSV
+    parser releases the GIL) and deduplicated as they arrive, then
+    concatenated once, instead of growing a frame with repeated pd.concat.
+
+    Args:
+        paths (Iterable[str]): CSV files with at least the CLICK_DTYPES columns.
+        chunksize (int): Rows parsed per chunk.
+        n_jobs (int): Files read concurrently.
+
+    Returns:
+        pd.DataFrame: Columns [user_id, session_id, click_article_id, click_timestamp].
+    """
+    paths = list(paths)
+    if not paths:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in CLICK_DTYPES.items()})
+
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            frames = list(pool.map(lambda path: read_clicks_csv(path, chunksize), paths))
+    else:
+        frames = [read_clicks_csv(path, chunksize) for path in paths]
+
+    clicks = pd.concat(frames, ignore_index=True)
+    del frames
+    clicks = clicks.drop_duplicates(ignore_index=True)
+    logging.info("Loaded %d unique clicks from %d files (%.1f MB).",
+                 len(clicks), len(paths), clicks.memory_usage(deep=True).sum() / 1e6)
+    return clicks
+
+
+def list_click_files(directory: str) -> List[str]:
+    """Sorted paths of the CSV files of a click directory."""
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".csv")
+    )
 
 # ---------------------------------------------------------------------
 # Core Interaction Functions
 # ---------------------------------------------------------------------
 
-def get_interactions(clicks_df = None) -> pd.DataFrame:
+def get_interactions(clicks_df = None, copy: bool = True) -> pd.DataFrame:
     """
     Retrieve user-article interaction data from the clicks repository,
     enriched with recency-based weights and timestamps.
 
+    Args:
+        clicks_df (Optional[pd.DataFrame]): Clicks to use instead of querying Cosmos DB.
+        copy (bool): Set to False to add the columns to `clicks_df` in place
+                     (avoids a full copy when the caller owns the frame).
+
     Returns:
         pd.DataFrame: Columns include user_id, article_id, click_time,
                       click_days_ago, recency_weight, etc.
     """
     try:
-        click_stats = clicks_db.get_all_clicks() if clicks_df is None else clicks_df.copy()
+        if clicks_df is None:
+            click_stats = clicks_db.get_all_clicks()
+        else:
+            click_stats = clicks_df.copy() if copy else clicks_df
 
         if click_stats.empty:
             logging.info("No click data found in get_interactions().")
@@ -30,7 +107,7 @@ def get_interactions(clicks_df = None) -> pd.DataFrame:
         click_stats["click_time"] = pd.to_datetime(click_stats["click_timestamp"], unit="ms")
         max_time = click_stats["click_time"].max()
 
-        click_stats["click_days_ago"] = (max_time - click_stats["click_time"]).dt.days
+        click_stats["click_days_ago"] = (max_time - click_stats["click_time"]).dt.days.astype("int32")
         click_stats["recency_weight"] = 1 / (1 + click_stats["click_days_ago"])
         click_stats = click_stats.rename(columns={"click_article_id": "article_id"})
 
@@ -52,13 +129,14 @@ def get_user_article_affinity_ratings(interactions_df = None) -> pd.DataFrame:
                       where rating ∈ [1, 5].
     """
     try:
-        df = get_interactions() if interactions_df is None else interactions_df.copy() 
+        # Only derived frames are built below, so the input is never modified
+        df = get_interactions() if interactions_df is None else interactions_df
         if df.empty:
             logging.info("No interactions found for affinity computation.")
             return pd.DataFrame(columns=["user_id", "item_id", "rating"])
 
         df = (
-            df.drop(columns=["click_timestamp"])
+            df[["user_id", "article_id", "recency_weight"]]
             .groupby(["user_id", "article_id"], as_index=False)
             .agg(click_count=("article_id", "count"),
                  recency_weight=("recency_weight", "sum"))
@@ -88,15 +166,19 @@ def get_user_article_affinity_ratings(interactions_df = None) -> pd.DataFrame:
         raise
 
 
-def get_articles_scores() -> pd.DataFrame:
+def get_articles_scores(articles_df = None, clicks_df = None) -> pd.DataFrame:
     """
     Compute freshness and popularity scores for all articles.
 
+    Args:
+        articles_df (Optional[pd.DataFrame]): Articles to use instead of querying Cosmos DB.
+        clicks_df (Optional[pd.DataFrame]): Clicks to use instead of querying Cosmos DB.
+
     Returns:
         pd.DataFrame: Columns [article_id, freshness_score, popularity_score]
     """
     try:
-        articles = articles_db.get_all_articles()
+        articles = articles_db.get_all_articles() if articles_df is None else articles_df.copy()
         if articles.empty:
             logging.info("No article data found in get_articles_scores().")
             return pd.DataFrame(columns=["article_id", "freshness_score", "popularity_score"])
@@ -107,7 +189,7 @@ def get_articles_scores() -> pd.DataFrame:
         articles["freshness_score"] = np.exp(-(max_ts - articles["created_at_ts"]) / decay_rate)
 
         # Aggregate popularity from interactions
-        click_stats = get_interactions()
+        click_stats = get_interactions(clicks_df)
         if not click_stats.empty:
             popularity = (
                 click_stats.groupby("article_id", as_index=False)["recency_weight"].sum()
@@ -142,24 +224,72 @@ def get_random_users(n_users) -> List[int]:
     return random.sample(all_users, min(n_users, len(all_users)))
 
 # ---------------------------------------------------------------------
-# Pass-through Repository Accessors
+# User History Accessors (read-through / write-through store)
 # ---------------------------------------------------------------------
+def get_user_history(user_id: int, cached: bool = True) -> np.ndarray:
+    """
+    Clicked article IDs of a user, oldest first, as a read-only int32 array.
+    Served from the in-process history store; Cosmos is queried on a miss.
+    With `cached=False` Cosmos is always queried and the store left alone,
+    for processes that do not record the clicks themselves.
+    """
+    if not cached:
+        history = np.array(clicks_db.get_user_click_history(int(user_id)), dtype=np.int32)
+        history.setflags(write=False)
+        return history
+    history = user_histories.get(user_id)
+    if history is None:
+        read_at = user_histories.begin_load(user_id)
+        try:
+            clicks = clicks_db.get_user_click_history(int(user_id))
+        except Exception:
+            user_histories.cancel_load(user_id)
+            raise
+        history = user_histories.put(user_id, clicks, read_at)
+    return history
+
+
 def get_clicked_articles_by_user(user_id: int):
-    """Wrapper for clicks_repository.get_clicked_articles_by_user()."""
+    """Clicked article IDs of a user (history store, Cosmos on a miss)."""
     if not isinstance(user_id, int):
         logging.warning("Invalid user_id in get_clicked_articles_by_user: %s", user_id)
         return []
-    return clicks_db.get_clicked_articles_by_user(int(user_id))
+    return get_user_history(user_id).tolist()
 
 
 def get_last_clicked_by_user(user_id: int) -> Optional[int]:
-    """Wrapper for clicks_repository.get_last_clicked_by_user()."""
+    """Most recently clicked article ID of a user (history store, Cosmos on a miss)."""
     if not isinstance(user_id, int):
         logging.warning("Invalid user_id in get_last_clicked_by_user: %s", user_id)
         return None
-    return clicks_db.get_last_clicked_by_user(int(user_id))
+    history = get_user_history(user_id)
+    return int(history[-1]) if len(history) else None
+
+
+def record_click(user_id: int, article_id: int, session_id: Optional[int] = None,
+                 click_timestamp: Optional[int] = None) -> dict:
+    """
+    Write a click to Cosmos DB, then to the cached history of the user.
+
+    Args:
+        user_id (int): Clicking user.
+        article_id (int): Clicked article.
+        session_id (Optional[int]): Session of the click (defaults to the click timestamp).
+        click_timestamp (Optional[int]): Epoch milliseconds (defaults to now).
+
+    Returns:
+        dict: The stored click document.
+    """
+    click_timestamp = int(click_timestamp) if click_timestamp is not None else int(time.time() * 1000)
+    session_id = int(session_id) if session_id is not None else click_timestamp
+    item = clicks_db.add_click(int(user_id), int(article_id), session_id, click_timestamp)
+    user_histories.append(int(user_id), int(article_id), click_timestamp)
+    return item
 
 
+# ---------------------------------------------------------------------
+# Pass-through Repository Accessors
+# ---------------------------------------------------------------------
 def get_all_articles() -> pd.DataFrame:
     """Wrapper for articles_repository.get_all_articles()."""
     return articles_db.get_all_articles()
\ No newline at end of file
@@ -0,0 +1,166 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# Rough per-entry cost of the dict slot, key and array header (bytes).
+ENTRY_OVERHEAD = 160
+
+
+class UserHistoryStore:
+    """
+    In-process, memory-bounded cache of per-user click histories.
+
+    Each history is an int32 array of article ids in click order. Entries
+    are evicted least-recently-used once `max_bytes` is exceeded, and
+    expire after `ttl_seconds` so clicks written by other instances are
+    eventually picked up from Cosmos DB. Clicks arriving out of order drop
+    the entry instead, so the next read gets Cosmos DB's timestamp order;
+    so do clicks arriving while the history is being read (`begin_load`).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 300.0):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (history, loaded_at, newest click epoch ms)
+        self._loads = {}  # user_id -> [reads in flight, clicked during them]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def memory_footprint(self) -> dict:
+        """Accounted size of the cached histories (same shape as function_app_memory.footprint)."""
+        return {
+            "private_bytes": self._bytes,
+            "shared_bytes": 0,
+            "entries": len(self._entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def get(self, user_id: int) -> Optional[np.ndarray]:
+        """
+        Cached history of a user, or None on a miss (absent or expired).
+        The returned array is read-only and shared; copy before mutating.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or (self.ttl_seconds > 0 and time.monotonic() - entry[1] > self.ttl_seconds):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def begin_load(self, user_id: int) -> int:
+        """
+        Register a read of the user's history from Cosmos DB, about to start.
+        A click appended before the matching `put` (or `cancel_load`) may be
+        missing from that read, which is then not stored.
+
+        Returns:
+            int: Start of the read (epoch ms), for `put`.
+        """
+        with self._lock:
+            self._loads.setdefault(user_id, [0, False])[0] += 1
+        return int(time.time() * 1000)
+
+    def cancel_load(self, user_id: int):
+        """End a `begin_load` whose read failed."""
+        with self._lock:
+            self._end_load(user_id)
+
+    def put(self, user_id: int, history, read_at: Optional[int] = None) -> np.ndarray:
+        """
+        Store the full history of a user (article ids, oldest first).
+
+        Args:
+            user_id (int): User of the history.
+            history: Article ids, oldest first.
+            read_at (Optional[int]): `begin_load` value of the read that returned `history`;
+                                     None for a history that is complete now.
+
+        Returns:
+            np.ndarray: The history, read-only (returned even when a click during the read kept it out).
+        """
+        history = np.array(history, dtype=np.int32)
+        history.setflags(write=False)
+        with self._lock:
+            if read_at is not None and self._end_load(user_id):
+                return history
+            self._discard(user_id)
+            # Clicks appended later must not be older than the read
+            newest = read_at if read_at is not None else int(time.time() * 1000)
+            self._entries[user_id] = (history, time.monotonic(), newest)
+            self._bytes += history.nbytes + ENTRY_OVERHEAD
+            self._evict()
+        return history
+
+    def append(self, user_id: int, article_id: int, click_timestamp: Optional[int] = None) -> bool:
+        """
+        Add a click to a cached history (write-through). Users that are not
+        cached are left alone: their next read loads the click from Cosmos.
+        A click older than the newest one cached (or than the load of the
+        history) drops the entry, as it does not go at the end.
+
+        Args:
+            user_id (int): Clicking user.
+            article_id (int): Clicked article.
+            click_timestamp (Optional[int]): Epoch milliseconds of the click (defaults to now).
+
+        Returns:
+            bool: Whether a cached history was updated.
+        """
+        if click_timestamp is None:
+            click_timestamp = int(time.time() * 1000)
+        with self._lock:
+            load = self._loads.get(user_id)
+            if load is not None:
+                # A read in flight may or may not see this click: do not store it
+                load[1] = True
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return False
+            if click_timestamp < entry[2]:
+                self._discard(user_id)
+                return False
+            history = np.append(entry[0], np.int32(article_id))
+            history.setflags(write=False)
+            self._bytes += history.nbytes - entry[0].nbytes
+            self._entries[user_id] = (history, entry[1], click_timestamp)
+            self._entries.move_to_end(user_id)
+            self._evict()
+            return True
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._discard(user_id)
+
+    def _end_load(self, user_id) -> bool:
+        # Whether a click arrived during the read; the flag lasts until the last overlapping read ends
+        load = self._loads[user_id]
+        load[0] -= 1
+        if load[0] == 0:
+            del self._loads[user_id]
+        return load[1]
+
+    def _discard(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry[0].nbytes + ENTRY_OVERHEAD
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (history, *_) = self._entries.popitem(last=False)
+            self._bytes -= history.nbytes + ENTRY_OVERHEAD
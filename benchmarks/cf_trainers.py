@@ -0,0 +1,110 @@
+"""
+Compare the collaborative-filtering trainers on a click sample:
+surprise SVD++ (build_train_svd) vs. the sparse ALS trainer (build_train_als).
+
+Ratings are split at random per interaction; reported per trainer:
+wall time of fit, test RMSE, and recall@k of held-out articles when ranking
+every unseen training item.
+
+    python -m benchmarks.cf_trainers --clicks dataset/clicks_sample.csv
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from azure_helpers.data_loading import get_interactions, get_user_article_affinity_ratings, read_click_files
+from build_train_als import predict, train_als
+from build_train_svd import fit_svdpp
+from engines.batch_scoring import top_k
+from engines.svd_engine import factors_from_surprise
+
+
+def split_ratings(ratings_df, test_size=0.2, random_state=42):
+    rng = np.random.default_rng(random_state)
+    is_test = rng.random(len(ratings_df)) < test_size
+    return ratings_df[~is_test].reset_index(drop=True), ratings_df[is_test].reset_index(drop=True)
+
+
+def fit_svdpp_factors(train_df, **params):
+    """SVD++ as trained by build_train_svd (SVDPP_PARAMS, overridden by `params`), as dense factors."""
+    model, trainset = fit_svdpp(train_df, **params)
+    return factors_from_surprise(model, trainset)
+
+
+def fit_als(train_df, n_factors=100, n_epochs=15):
+    return train_als(train_df, n_factors=n_factors, n_epochs=n_epochs)
+
+
+def rmse(factors, test_df):
+    est = predict(factors, test_df["user_id"], test_df["item_id"])
+    return float(np.sqrt(np.mean((est - test_df["rating"].to_numpy()) ** 2)))
+
+
+def recall_at_k(factors, train_df, test_df, k=10):
+    """
+    Mean over test users known to the model of |top-k ∩ held-out| / min(k, |held-out|),
+    ranking all training items the user has not rated in train.
+    """
+    user_ids, item_ids = factors["user_ids"], factors["item_ids"]
+    u_index = {int(u): n for n, u in enumerate(user_ids)}
+    i_index = {int(i): n for n, i in enumerate(item_ids)}
+
+    held_out = test_df.groupby("user_id")["item_id"].apply(lambda s: {i_index[i] for i in s if i in i_index})
+    held_out = held_out[held_out.map(len) > 0]
+    held_out = held_out[held_out.index.isin(u_index)]
+    if held_out.empty:
+        return float("nan")
+
+    users = np.array([u_index[u] for u in held_out.index])
+    est = (factors["user_bias"][users][:, None] + factors["item_bias"][None, :]
+           + factors["user_factors"][users] @ factors["item_factors"].T)
+    seen_u = train_df["user_id"].map(u_index).to_numpy()
+    seen_i = train_df["item_id"].map(i_index).to_numpy()
+    row_of = np.full(len(user_ids), -1)
+    row_of[users] = np.arange(len(users))
+    rows = row_of[seen_u]
+    est[rows[rows >= 0], seen_i[rows >= 0]] = -np.inf
+
+    top, _ = top_k(est, k)
+    hits = [len(set(row.tolist()) & items) / min(k, len(items)) for row, items in zip(top, held_out)]
+    return float(np.mean(hits))
+
+
+TRAINERS = {"svdpp": fit_svdpp_factors, "als": fit_als}
+
+
+def run(clicks_path, trainers, n_factors, k, test_size, random_state):
+    clicks = read_click_files([clicks_path])
+    ratings_df = get_user_article_affinity_ratings(interactions_df=get_interactions(clicks, copy=False))
+    train_df, test_df = split_ratings(ratings_df, test_size, random_state)
+
+    results = []
+    for name in trainers:
+        started = time.perf_counter()
+        factors = TRAINERS[name](train_df, n_factors=n_factors)
+        fit_seconds = time.perf_counter() - started
+        results.append({
+            "trainer": name,
+            "fit_seconds": round(fit_seconds, 3),
+            "rmse": round(rmse(factors, test_df), 4),
+            f"recall@{k}": round(recall_at_k(factors, train_df, test_df, k), 4),
+            "n_train": len(train_df),
+            "n_test": len(test_df),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark SVD++ against the sparse ALS trainer.")
+    parser.add_argument("--clicks", default="dataset/clicks_sample.csv")
+    parser.add_argument("--trainers", nargs="+", default=list(TRAINERS), choices=list(TRAINERS))
+    parser.add_argument("--factors", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for row in run(args.clicks, args.trainers, args.factors, args.k, args.test_size, args.seed):
+        print(json.dumps(row))
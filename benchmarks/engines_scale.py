@@ -0,0 +1,200 @@
+"""
+Scale benchmark of the three engines on synthetic data.
+
+For each engine: init time, peak and retained memory of init (tracemalloc,
+NumPy buffers included), and single-request latency percentiles.
+Results are JSON, the only output on stdout (logs go to stderr); with
+--baseline, metrics worse than the baseline by more than --tolerance are
+reported on stderr and the exit status is 1.
+
+    python -m benchmarks.engines_scale --scale medium --output medium.json
+    python -m benchmarks.engines_scale --scale medium --baseline medium.json
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.generators import generate_articles, generate_clicks, generate_embeddings, generate_factors
+from benchmarks.load_test import git_revision
+from benchmarks.standins import build_environment, install
+
+SCALES = {
+    "small": {"n_articles": 10_000, "n_users": 10_000, "n_clicks": 100_000},
+    "medium": {"n_articles": 100_000, "n_users": 100_000, "n_clicks": 1_000_000},
+    "large": {"n_articles": 1_000_000, "n_users": 1_000_000, "n_clicks": 10_000_000},
+}
+ENGINES = ("content_based", "svd", "hybrid")
+# Lower is better for all of them
+REGRESSION_METRICS = ("init_s", "init_peak_mb", "p50_ms", "p95_ms")
+
+
+# -------------------------------------------------------------------------
+# Engines under test
+# -------------------------------------------------------------------------
+def _content_based(cosmos, rng, n_requests):
+    from engines.content_based_engine import ContentBasedRecommendationEngine
+
+    clicked = cosmos.get_all_clicks()["click_article_id"].to_numpy()
+    articles = rng.choice(clicked, n_requests)
+    build = lambda: ContentBasedRecommendationEngine(embeddings_path=os.getenv("ArticlesEmbeddingsFile"))
+    requests = [lambda engine, a=int(a): engine.recommend(a) for a in articles]
+    return build, requests
+
+
+def _svd(cosmos, rng, n_requests):
+    from engines.svd_engine import SVDRecommendationEngine
+
+    catalogue = cosmos.get_all_articles()["article_id"].to_numpy()
+    users = rng.choice(cosmos.get_users(), n_requests)
+    # Candidate lists as the hybrid engine builds them (unseen articles), prepared outside the timings
+    requests = []
+    for user in users:
+        candidates = catalogue[~np.isin(catalogue, cosmos.get_user_click_history(user))].tolist()
+        requests.append(lambda engine, u=int(user), c=candidates: engine.recommend_for_user(u, c))
+    build = lambda: SVDRecommendationEngine(model_path=os.getenv("SVDppModelFile"))
+    return build, requests
+
+
+def _hybrid(cosmos, rng, n_requests):
+    from engines.hybrid_engine import HybridRecommendationEngine
+
+    users = rng.choice(cosmos.get_users(), n_requests)
+    requests = [lambda engine, u=int(u): engine.recommend(u) for u in users]
+    return lambda: HybridRecommendationEngine(n_recs=5), requests
+
+
+SETUPS = {"content_based": _content_based, "svd": _svd, "hybrid": _hybrid}
+
+
+# -------------------------------------------------------------------------
+# Measurements
+# -------------------------------------------------------------------------
+def measure_engine(name, cosmos, n_requests=200, warmup=10, seed=0):
+    """
+    Init the engine untraced (init time), serve requests one at a time
+    (latency), then init it again under tracemalloc (memory).
+    """
+    rng = np.random.default_rng(seed)
+    build, requests = SETUPS[name](cosmos, rng, n_requests + warmup)
+
+    started = time.perf_counter()
+    engine = build()
+    init_s = time.perf_counter() - started
+
+    for request in requests[:warmup]:
+        request(engine)
+    latencies = []
+    for request in requests[warmup:]:
+        started = time.perf_counter()
+        request(engine)
+        latencies.append((time.perf_counter() - started) * 1000)
+    del engine
+    gc.collect()
+
+    tracemalloc.start()
+    engine = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del engine
+    gc.collect()
+
+    latencies = np.array(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "init_s": round(init_s, 3),
+        "init_peak_mb": round(peak / 1e6, 1),
+        "retained_mb": round(retained / 1e6, 1),
+        "requests": len(latencies),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def run_benchmark(n_articles, n_users, n_clicks, dim=250, n_factors=100, train_factors=False,
+                  engines=ENGINES, n_requests=200, seed=0):
+    started = time.perf_counter()
+    articles = generate_articles(n_articles, seed=seed)
+    embeddings = generate_embeddings(n_articles, dim=dim, seed=seed)
+    clicks = generate_clicks(n_users, n_articles, n_clicks, seed=seed)
+    factors = None if train_factors else generate_factors(
+        clicks["user_id"], clicks["click_article_id"], n_factors, seed=seed
+    )
+    cosmos, blobs = build_environment(clicks=clicks, articles=articles, embeddings=embeddings, factors=factors,
+                                      n_factors=n_factors, seed=seed)
+    install(cosmos, blobs)
+    del articles, embeddings, clicks, factors
+    setup_s = time.perf_counter() - started
+
+    return {
+        "git": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "n_articles": n_articles, "n_users": n_users, "n_clicks": n_clicks, "dim": dim,
+            "n_factors": n_factors, "train_factors": train_factors, "n_requests": n_requests, "seed": seed,
+            "shared_arrays": os.getenv("SharedArraysEnabled", "true"),
+        },
+        "setup_s": round(setup_s, 1),
+        "engines": {name: measure_engine(name, cosmos, n_requests, seed=seed) for name in engines},
+    }
+
+
+def regressions(baseline: dict, results: dict, tolerance: float = 0.25) -> list:
+    """(engine, metric, baseline, current) for every metric worse than baseline * (1 + tolerance)."""
+    found = []
+    for name, metrics in results["engines"].items():
+        previous = baseline.get("engines", {}).get(name, {})
+        for metric in REGRESSION_METRICS:
+            if metric in previous and previous[metric] > 0 and metrics[metric] > previous[metric] * (1 + tolerance):
+                found.append((name, metric, previous[metric], metrics[metric]))
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Engine init time, memory and latency at synthetic scale.")
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--articles", type=int, default=None)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--clicks", type=int, default=None)
+    parser.add_argument("--dim", type=int, default=250)
+    parser.add_argument("--factors", type=int, default=100)
+    parser.add_argument("--train-factors", action="store_true", help="Fit ALS instead of random factors.")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shared-arrays", action="store_true",
+                        help="Keep shared-array publishing on (re-inits then map the first one's arrays).")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None, help="Results JSON to check for regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # Read by engines.shared_arrays at import, which happens lazily in the setups
+    os.environ["SharedArraysEnabled"] = "true" if args.shared_arrays else "false"
+    scale = SCALES[args.scale]
+    # The engines' console loggers are created during the run and write to sys.stdout: keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run_benchmark(
+            args.articles or scale["n_articles"], args.users or scale["n_users"], args.clicks or scale["n_clicks"],
+            args.dim, args.factors, args.train_factors, args.engines, args.requests, args.seed,
+        )
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(json.load(f), results, args.tolerance)
+        for name, metric, before, after in found:
+            print(f"REGRESSION {name}.{metric}: {before} -> {after}", file=sys.stderr)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,76 @@
+"""
+Synthetic data shaped like the production inputs: article metadata,
+clustered embeddings and Zipf-distributed click logs.
+"""
+import numpy as np
+import pandas as pd
+
+START_TS = 1_506_816_000_000    # 2017-10-01, the period of the original click logs (ms)
+DAY_MS = 24 * 3600 * 1000
+
+
+def power_law_probabilities(n: int, a: float, rng) -> np.ndarray:
+    """Zipf-like probabilities over n items (rank^-a), assigned to items in random order."""
+    weights = 1.0 / np.arange(1, n + 1) ** a
+    return rng.permutation(weights / weights.sum())
+
+
+def generate_articles(n_articles: int, days: int = 365, seed: int = 0) -> pd.DataFrame:
+    """[article_id, created_at_ts] for ids 0..n_articles-1, created over `days` before the click period."""
+    rng = np.random.default_rng(seed)
+    created = START_TS - rng.integers(0, days * DAY_MS, n_articles)
+    return pd.DataFrame({"article_id": np.arange(n_articles, dtype=np.int64), "created_at_ts": created})
+
+
+def generate_embeddings(n_articles: int, dim: int = 250, n_topics: int = 50, noise: float = 0.5,
+                        seed: int = 0) -> np.ndarray:
+    """Clustered float32 embeddings (row = article_id): topic centroid plus noise."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    topics = rng.integers(0, n_topics, n_articles)
+    embeddings = centroids[topics]
+    embeddings += noise * rng.normal(size=(n_articles, dim)).astype(np.float32)
+    return embeddings
+
+
+def generate_clicks(n_users: int, n_articles: int, n_clicks: int, user_a: float = 0.8, article_a: float = 1.1,
+                    days: int = 16, seed: int = 0) -> pd.DataFrame:
+    """
+    Click log with heavy-tailed user activity and article popularity.
+
+    Returns:
+        pd.DataFrame: [user_id, session_id, click_article_id, click_timestamp] with
+        the dtypes of azure_helpers.data_loading.CLICK_DTYPES.
+    """
+    rng = np.random.default_rng(seed)
+    users = rng.choice(n_users, n_clicks, p=power_law_probabilities(n_users, user_a, rng))
+    articles = rng.choice(n_articles, n_clicks, p=power_law_probabilities(n_articles, article_a, rng))
+    timestamps = START_TS + rng.integers(0, days * DAY_MS, n_clicks)
+    # One session per user and half hour
+    sessions = users.astype(np.int64) * 10_000 + (timestamps - START_TS) // (DAY_MS // 48)
+    return pd.DataFrame({
+        "user_id": users.astype(np.int32),
+        "session_id": sessions.astype(np.int64),
+        "click_article_id": articles.astype(np.int32),
+        "click_timestamp": timestamps.astype(np.int64),
+    })
+
+
+def generate_factors(user_ids, item_ids, n_factors: int = 100, std: float = 0.1, seed: int = 0) -> dict:
+    """
+    Random CF factors in the layout of svd_engine.factors_from_surprise, for
+    scales where training a model first is not the point of the benchmark.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = np.unique(np.asarray(user_ids, dtype=np.int64))
+    item_ids = np.unique(np.asarray(item_ids, dtype=np.int64))
+    return {
+        "global_mean": np.array([3.0]),
+        "rating_scale": np.array([1.0, 5.0]),
+        "user_ids": user_ids,
+        "item_ids": item_ids,
+        "user_bias": rng.normal(0, 0.3, len(user_ids)).astype(np.float32),
+        "item_bias": rng.normal(0, 0.3, len(item_ids)).astype(np.float32),
+        "user_factors": rng.normal(0, std, (len(user_ids), n_factors)).astype(np.float32),
+        "item_factors": rng.normal(0, std, (len(item_ids), n_factors)).astype(np.float32),
+    }
@@ -0,0 +1,279 @@
+"""
+Load test of /recommendations, offline, against in-memory stand-ins.
+
+Targets:
+  engine  HybridRecommendationEngine.recommend_json called from a thread pool
+  route   the async Functions handler (function_app.recommendations), executor included
+
+Workloads: a Zipf-distributed user mix over the known users, or a replayed
+request log (.jsonl / .csv with a user_id column, or any text log with
+`user_id=<n>`). Requests are closed-loop at `--concurrency`, or open-loop at
+`--rate` requests/s (latency then counts from the scheduled send time).
+
+    python -m benchmarks.load_test run --target route --requests 2000 --concurrency 16 --output after.json
+    python -m benchmarks.load_test compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.standins import build_environment, install
+import function_app_tracing as tracing
+
+
+# -------------------------------------------------------------------------
+# Workloads
+# -------------------------------------------------------------------------
+def zipf_workload(user_ids, n_requests: int, a: float = 1.2, anonymous_share: float = 0.0, seed: int = 0):
+    """User ids drawn with rank^-a popularity (None = anonymous request)."""
+    rng = np.random.default_rng(seed)
+    user_ids = np.asarray(user_ids)
+    weights = 1.0 / np.arange(1, len(user_ids) + 1) ** a
+    picks = rng.choice(rng.permutation(user_ids), n_requests, p=weights / weights.sum()).tolist()
+    anonymous = rng.random(n_requests) < anonymous_share
+    return [None if anon else int(u) for u, anon in zip(picks, anonymous)]
+
+
+def replay_workload(path: str):
+    """User ids of a request log, in order (lines without a user are anonymous)."""
+    users = []
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    user_id = json.loads(line).get("user_id")
+                    users.append(int(user_id) if user_id not in (None, "") else None)
+        elif path.endswith(".csv"):
+            import pandas as pd
+            column = pd.read_csv(f, usecols=["user_id"])["user_id"]
+            users = [None if pd.isna(u) else int(u) for u in column]
+        else:
+            pattern = re.compile(r"user_id=(\d+)")
+            for line in f:
+                match = pattern.search(line)
+                users.append(int(match.group(1)) if match else None)
+    return users
+
+
+# -------------------------------------------------------------------------
+# Targets
+# -------------------------------------------------------------------------
+class EngineTarget:
+    """Calls the engine directly; blocking calls run on a thread pool."""
+
+    def __init__(self, concurrency: int, budget_ms: float | None = None):
+        from engines.hybrid_engine import Deadline, HybridRecommendationEngine
+        self._deadline = Deadline.from_budget
+        self.budget_ms = budget_ms
+        self.engine = HybridRecommendationEngine(n_recs=5)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _call(self, user_id):
+        if not user_id:
+            self.engine.anonymous_recommendations_json()
+            return {"degraded": False, "dropped": []}
+        _, report, _ = self.engine.recommend_json(user_id, self._deadline(self.budget_ms))
+        return {"degraded": False, "dropped": report["dropped"]}
+
+    async def __call__(self, user_id):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, self._call, user_id)
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class RouteTarget:
+    """Calls the async HTTP handler of function_app, as the Functions host would."""
+
+    def __init__(self, concurrency: int, budget_ms: float | None = None):
+        import azure.functions as func
+        # Process workers would not see the in-memory stand-ins
+        os.environ["RecommendationExecutor"] = "thread"
+        import function_app
+        self._request = func.HttpRequest
+        self.handler = function_app.recommendations
+        self.budget_ms = budget_ms
+
+    async def __call__(self, user_id):
+        params = {} if not user_id else {"user_id": str(user_id)}
+        if self.budget_ms:
+            params["budget_ms"] = str(self.budget_ms)
+        response = await self.handler(self._request("GET", "/api/recommendations", params=params, body=b""))
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        dropped = response.headers.get("X-Recommendation-Dropped")
+        return {
+            "degraded": "X-Recommendation-Degraded" in response.headers,
+            "dropped": dropped.split(",") if dropped else [],
+        }
+
+    def close(self):
+        pass
+
+
+TARGETS = {"engine": EngineTarget, "route": RouteTarget}
+
+
+# -------------------------------------------------------------------------
+# Driver
+# -------------------------------------------------------------------------
+async def _drive(target, workload, concurrency: int, rate: float | None):
+    latencies = np.full(len(workload), np.nan)
+    outcomes = [None] * len(workload)
+    next_index = iter(range(len(workload)))
+    started = time.perf_counter()
+
+    async def worker():
+        for i in next_index:
+            scheduled = started + i / rate if rate else None
+            if scheduled is not None:
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            sent = scheduled if scheduled is not None else time.perf_counter()
+            try:
+                outcomes[i] = await target(workload[i])
+            except Exception as e:
+                outcomes[i] = {"error": repr(e)}
+            latencies[i] = (time.perf_counter() - sent) * 1000
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, outcomes, time.perf_counter() - started
+
+
+def _latency_summary(latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "mean": round(float(latencies.mean()), 3),
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "max": round(float(latencies.max()), 3),
+    }
+
+
+def git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        return {"rev": rev or None, "dirty": bool(dirty)}
+    except OSError:
+        return {"rev": None, "dirty": None}
+
+
+def run_load_test(target: str = "route", n_requests: int = 1000, concurrency: int = 8, rate: float | None = None,
+                  replay: str | None = None, zipf_a: float = 1.2, anonymous_share: float = 0.0,
+                  warmup: int = 50, budget_ms: float | None = None, sample_rate: float = 1.0,
+                  n_articles: int = 5_000, n_users: int = 2_000, n_clicks: int = 50_000,
+                  cosmos_latency_ms: float = 0.0, seed: int = 0) -> dict:
+    """
+    Build the offline environment, warm the target up, replay the workload
+    and summarize throughput, latency percentiles and per-stage spans.
+
+    Returns:
+        dict: JSON-serializable results (config, git revision, metrics).
+    """
+    config = {k: v for k, v in locals().items()}
+    cosmos, blobs = build_environment(n_articles=n_articles, n_users=n_users, n_clicks=n_clicks,
+                                      latency_ms=cosmos_latency_ms, seed=seed)
+    install(cosmos, blobs)
+    tracing.SAMPLE_RATE = sample_rate
+
+    runner = TARGETS[target](concurrency, budget_ms)
+    try:
+        workload = replay_workload(replay) if replay else zipf_workload(
+            cosmos.get_users(), n_requests, zipf_a, anonymous_share, seed
+        )
+        async def session():
+            # One event loop for warm-up and measurement (the route executor binds to it)
+            if warmup:
+                await _drive(runner, workload[:warmup], concurrency, None)
+            tracing.reset_latency()
+            return await _drive(runner, workload, concurrency, rate)
+
+        latencies, outcomes, elapsed = asyncio.run(session())
+    finally:
+        runner.close()
+
+    errors = [o["error"] for o in outcomes if "error" in o]
+    dropped = {}
+    for outcome in outcomes:
+        for stage in outcome.get("dropped", []):
+            dropped[stage] = dropped.get(stage, 0) + 1
+    return {
+        "git": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config,
+        "requests": len(workload),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "degraded": sum(1 for o in outcomes if o.get("degraded")),
+        "dropped_stages": dropped,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(workload) / elapsed, 2),
+        "latency_ms": _latency_summary(latencies),
+        "stages": tracing.get_latency_summary()["spans"],
+    }
+
+
+def compare(before: dict, after: dict) -> list:
+    """Rows (metric, before, after, change %) of two result files."""
+    rows = [("throughput_rps", before["throughput_rps"], after["throughput_rps"])]
+    rows += [(f"latency.{k}", before["latency_ms"][k], after["latency_ms"][k]) for k in after["latency_ms"]]
+    for stage in sorted(set(before["stages"]) & set(after["stages"])):
+        for k in ("p50_ms", "p95_ms", "p99_ms"):
+            if k in before["stages"][stage] and k in after["stages"][stage]:
+                rows.append((f"{stage}.{k}", before["stages"][stage][k], after["stages"][stage][k]))
+    return [(name, b, a, round(100 * (a - b) / b, 1) if b else None) for name, b, a in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of the recommendations path.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run")
+    run.add_argument("--target", choices=list(TARGETS), default="route")
+    run.add_argument("--requests", type=int, default=1000)
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--rate", type=float, default=None, help="Open-loop requests/s (default: closed loop).")
+    run.add_argument("--replay", default=None, help="Request log to replay instead of the Zipf mix.")
+    run.add_argument("--zipf-a", type=float, default=1.2)
+    run.add_argument("--anonymous-share", type=float, default=0.0)
+    run.add_argument("--warmup", type=int, default=50)
+    run.add_argument("--budget-ms", type=float, default=None)
+    run.add_argument("--articles", type=int, default=5_000)
+    run.add_argument("--users", type=int, default=2_000)
+    run.add_argument("--clicks", type=int, default=50_000)
+    run.add_argument("--cosmos-latency-ms", type=float, default=0.0)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output", default=None, help="Write the results JSON here.")
+
+    cmp = commands.add_parser("compare")
+    cmp.add_argument("before")
+    cmp.add_argument("after")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.before) as f_before, open(args.after) as f_after:
+            before, after = json.load(f_before), json.load(f_after)
+        print(f"{before['git']['rev']} -> {after['git']['rev']}")
+        for name, b, a, change in compare(before, after):
+            print(f"{name:<48} {b:>12} {a:>12} {'' if change is None else f'{change:+.1f}%':>9}")
+    else:
+        results = run_load_test(
+            args.target, args.requests, args.concurrency, args.rate, args.replay, args.zipf_a,
+            args.anonymous_share, args.warmup, args.budget_ms, n_articles=args.articles, n_users=args.users,
+            n_clicks=args.clicks, cosmos_latency_ms=args.cosmos_latency_ms, seed=args.seed,
+        )
+        text = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text)
+        print(text)
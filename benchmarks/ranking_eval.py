@@ -0,0 +1,397 @@
+"""
+Offline ranking evaluation of the engines and the hybrid blend.
+
+The click log is split by time: everything before the cutoff trains the CF
+factors and the article scores, and each user's articles clicked after it
+(not already clicked before) are the relevant set. The session co-visitation
+matrix is built from the train clicks too, and blended into "hybrid" as when
+CovisitationFile is set; "hybrid_no_covisitation" is the blend without it, so
+CovisitationWeight can be judged. Every variant is scored
+for all held-out users in vectorized chunks (engines.batch_scoring), then
+recall@k, NDCG@k and catalogue coverage are computed per variant. As in the
+served engine, every variant ranks only articles the user has not clicked.
+Users without history before the cutoff get the anonymous fallback and are
+reported apart. With --requests, per-request latency and init memory of the
+served engines are measured too (benchmarks.engines_scale). The results
+JSON is the only output on stdout (logs go to stderr).
+
+    python -m benchmarks.ranking_eval --clicks-dir dataset/clicks --articles dataset/articles_metadata.csv \\
+        --embeddings models/articles_embeddings.pkl --output eval.json
+    python -m benchmarks.ranking_eval --synthetic small
+"""
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing as mp
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from azure_helpers.data_loading import (
+    get_articles_scores, get_interactions, get_user_article_affinity_ratings, list_click_files, read_click_files
+)
+from build_train_als import train_als
+from engines.batch_scoring import (
+    build_scoring_arrays, cf_scores, content_scores, covisitation_scores, seen_matrix, top_k, weight_matrix
+)
+from engines.covisitation_engine import build_covisitation, serving_arrays
+from engines.hybrid_engine import SCORES, blend_weights
+from engines.shared_arrays import attach, cache_key, discard, load_or_publish
+from engines.svd_engine import factors_from_artifact
+
+VARIANTS = ("freshness", "popularity", "content_based", "cf", "covisitation", "hybrid", "hybrid_no_covisitation")
+
+
+# -------------------------------------------------------------------------
+# Split
+# -------------------------------------------------------------------------
+def time_split(clicks: pd.DataFrame, test_fraction: float = 0.1, max_users: int | None = None, seed: int = 0):
+    """
+    Split clicks at the timestamp quantile 1 - test_fraction.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, int]: train clicks, test clicks
+        (optionally of at most `max_users` random users) and the cutoff (ms).
+    """
+    cutoff = int(np.quantile(clicks["click_timestamp"].to_numpy(), 1 - test_fraction))
+    before = clicks["click_timestamp"].to_numpy() < cutoff
+    train, test = clicks.loc[before], clicks.loc[~before]
+    if max_users:
+        users = test["user_id"].unique()
+        if len(users) > max_users:
+            keep = np.random.default_rng(seed).choice(users, max_users, replace=False)
+            test = test.loc[test["user_id"].isin(keep)]
+    return train, test, cutoff
+
+
+def relevance_arrays(arrays, test: pd.DataFrame) -> dict:
+    """
+    Relevant catalogue positions of each user in arrays["user_ids"], CSR-style:
+    test-period articles that are in the catalogue and not in the user's history.
+    """
+    article_ids, user_ids = arrays["article_ids"], arrays["user_ids"]
+    pairs = test[["user_id", "click_article_id"]].drop_duplicates()
+    rows = np.searchsorted(user_ids, pairs["user_id"].to_numpy(dtype=np.int64))
+    pos = np.searchsorted(article_ids, pairs["click_article_id"].to_numpy(dtype=np.int64))
+    inside = (
+        (rows < len(user_ids)) & (user_ids[np.minimum(rows, len(user_ids) - 1)] == pairs["user_id"].to_numpy())
+        & (pos < len(article_ids)) & (article_ids[np.minimum(pos, len(article_ids) - 1)] == pairs["click_article_id"].to_numpy())
+    )
+    keys = rows[inside].astype(np.int64) * len(article_ids) + pos[inside]
+
+    # Drop re-clicks of articles already in the history
+    hist_rows = np.repeat(np.arange(len(user_ids)), np.diff(arrays["hist_indptr"]))
+    hist_keys = hist_rows.astype(np.int64) * len(article_ids) + arrays["hist_pos"]
+    keys = np.setdiff1d(keys, hist_keys[arrays["hist_pos"] >= 0])  # sorted, unique
+
+    counts = np.bincount(keys // len(article_ids), minlength=len(user_ids))
+    return {"rel_keys": keys, "rel_indptr": np.concatenate([[0], np.cumsum(counts)])}
+
+
+# -------------------------------------------------------------------------
+# Metrics
+# -------------------------------------------------------------------------
+def ranking_metrics(recommended: np.ndarray, rows: np.ndarray, rel_keys: np.ndarray, n_relevant: np.ndarray,
+                    n_articles: int) -> dict:
+    """
+    Per-user recall@k and NDCG@k of `recommended` catalogue positions (users x k)
+    for user rows `rows`, as sums over users (averaged by the caller).
+    """
+    k = recommended.shape[1]
+    keys = rows[:, None].astype(np.int64) * n_articles + recommended
+    hits = np.isin(keys, rel_keys)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])[np.minimum(n_relevant, k)]
+    return {
+        "recall": float((hits.sum(axis=1) / n_relevant).sum()),
+        "ndcg": float(((hits * discounts).sum(axis=1) / ideal).sum()),
+        "hit_rate": float(hits.any(axis=1).sum()),
+    }
+
+
+def _variant_scores(arrays, start: int, stop: int, weights):
+    seen = seen_matrix(arrays, start, stop)
+    cf = cf_scores(arrays, start, stop, seen)
+    cb, has_cb = content_scores(arrays, start, stop)
+    cv, has_cv = covisitation_scores(arrays, start, stop)
+    history_sizes = np.diff(arrays["hist_indptr"][start:stop + 1])
+
+    def blend(has_cv=None):
+        w = weight_matrix(history_sizes, has_cb, has_cv=has_cv, weights=weights).astype(np.float32)
+        return (
+            w[:, [0]] * arrays["freshness"][None, :]
+            + w[:, [1]] * arrays["popularity"][None, :]
+            + w[:, [2]] * cb
+            + w[:, [3]] * cf
+            + w[:, [4]] * cv
+        )
+
+    scores = {
+        "freshness": np.repeat(arrays["freshness"][None, :], stop - start, axis=0),
+        "popularity": np.repeat(arrays["popularity"][None, :], stop - start, axis=0),
+        "content_based": cb,
+        "cf": cf,
+        "covisitation": cv,
+        "hybrid": blend(has_cv),
+        "hybrid_no_covisitation": blend(),
+    }
+    # Every variant ranks unseen articles only, as served
+    for matrix in scores.values():
+        matrix[seen] = -np.inf
+    return scores
+
+
+def evaluate_chunk(arrays, bounds, weights=blend_weights) -> dict:
+    """
+    Score users[start:stop] with every variant and sum their metrics.
+
+    Returns:
+        dict: {variant: {"recall", "ndcg", "hit_rate", "recommended" (catalogue positions)}, "seconds": float}.
+    """
+    start, stop, k = bounds
+    started = time.perf_counter()
+    indptr = arrays["rel_indptr"][start:stop + 1]
+    n_relevant = np.diff(indptr)
+    rows = np.arange(start, stop)[n_relevant > 0]
+    rel_keys = arrays["rel_keys"][indptr[0]:indptr[-1]]
+    n_articles = len(arrays["article_ids"])
+
+    results = {}
+    scores = _variant_scores(arrays, start, stop, weights)
+    for name, matrix in scores.items():
+        idx, top = top_k(matrix[n_relevant > 0], k)
+        results[name] = {**ranking_metrics(idx, rows, rel_keys, n_relevant[n_relevant > 0], n_articles),
+                         # Seen articles fill the top-k of users with few unseen ones: not recommended
+                         "recommended": np.unique(idx[np.isfinite(top)])}
+    results["seconds"] = time.perf_counter() - started
+    return results
+
+
+_arrays = None
+
+
+def _logs_to_stderr():
+    # Console handlers of function_app_logging write to stdout, which carries the results JSON
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        for handler in getattr(logger, "handlers", []):
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+                handler.setStream(sys.stderr)
+
+
+def _init_worker(key):
+    global _arrays
+    _logs_to_stderr()
+    _arrays = attach(key)
+
+
+def _evaluate_task(bounds):
+    return evaluate_chunk(_arrays, bounds)
+
+
+def cold_start_metrics(scores: pd.DataFrame, test: pd.DataFrame, cold_users, k: int) -> dict:
+    """Metrics of the anonymous fallback (blend_weights(0) over freshness/popularity) for users without history."""
+    weights = blend_weights(0)
+    overall = sum(weights[s] * scores[s].to_numpy() for s in SCORES if s in scores.columns)
+    ranked = scores["article_id"].to_numpy()[np.argsort(-overall, kind="stable")[:k]]
+    relevant = test.loc[test["user_id"].isin(cold_users)].groupby("user_id")["click_article_id"].unique()
+    if relevant.empty:
+        return {"users": 0}
+
+    # Every cold user gets the same list: hits by rank against each relevant set
+    hits = np.array([np.isin(ranked, r) for r in relevant])
+    sizes = relevant.map(len).to_numpy()
+    discounts = 1.0 / np.log2(np.arange(2, len(ranked) + 2))
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])[np.minimum(sizes, len(ranked))]
+    return {
+        "users": len(relevant),
+        f"recall@{k}": round(float((hits.sum(axis=1) / sizes).mean()), 4),
+        f"ndcg@{k}": round(float(((hits * discounts).sum(axis=1) / ideal).mean()), 4),
+        "hit_rate": round(float(hits.any(axis=1).mean()), 4),
+    }
+
+
+# -------------------------------------------------------------------------
+# Evaluation
+# -------------------------------------------------------------------------
+def evaluate(clicks: pd.DataFrame, articles: pd.DataFrame, embeddings: np.ndarray, factors: dict | None = None,
+             k: int = 10, test_fraction: float = 0.1, max_users: int | None = None, chunk_size: int = 128,
+             n_jobs: int | None = None, weights=blend_weights, n_factors: int = 64, n_requests: int = 0,
+             seed: int = 0) -> dict:
+    """
+    Time-split evaluation of every variant on held-out users.
+
+    Args:
+        clicks (pd.DataFrame): Full click log [user_id, session_id, click_article_id, click_timestamp].
+        articles (pd.DataFrame): [article_id, created_at_ts].
+        embeddings (np.ndarray): Article embeddings (row = article_id).
+        factors (Optional[dict]): CF factors; ALS is trained on the train split if omitted.
+        k (int): Cutoff of the metrics.
+        test_fraction (float): Share of clicks (latest first) held out.
+        max_users (Optional[int]): Evaluate at most that many random held-out users.
+        chunk_size (int): Users per vectorized chunk.
+        n_jobs (Optional[int]): Worker processes (default: all cores; 1 = in-process).
+        weights (Callable): History size -> blend weights (hybrid_engine.blend_weights by default).
+        n_factors (int): ALS factors when training.
+        n_requests (int): Requests per served engine for the latency measurement (0 = skip).
+
+    Returns:
+        dict: JSON-serializable results.
+    """
+    started = time.perf_counter()
+    n_jobs = n_jobs or os.cpu_count() or 1
+    train, test, cutoff = time_split(clicks, test_fraction, max_users, seed)
+    trained = factors is None
+    logging.info("Split at %d: %d train / %d test clicks.", cutoff, len(train), len(test))
+
+    if factors is None:
+        ratings = get_user_article_affinity_ratings(interactions_df=get_interactions(train))
+        factors = train_als(ratings, n_factors=n_factors, random_state=seed)
+    scores = get_articles_scores(articles_df=articles, clicks_df=train)
+    covisitation = serving_arrays(build_covisitation(train))
+    setup_s = time.perf_counter() - started
+
+    test_users = test["user_id"].unique()
+    warm = train["user_id"].isin(test_users).to_numpy()
+    cold_users = np.setdiff1d(test_users, train["user_id"].unique())
+
+    key = cache_key("evaluation", time.time_ns(), os.getpid())
+    def build():
+        arrays = build_scoring_arrays(scores, train.loc[warm], embeddings, factors, covisitation)
+        return {**arrays, **relevance_arrays(arrays, test)}
+    # Per-run key: a concurrent evaluation must not prune it
+    arrays = load_or_publish(key, build, prune=False)
+
+    try:
+        n_users = len(arrays["user_ids"])
+        n_articles = len(arrays["article_ids"])
+        n_relevant = np.diff(arrays["rel_indptr"])
+        k = min(k, n_articles)
+        chunks = [(s, min(s + chunk_size, n_users), k) for s in range(0, n_users, chunk_size)]
+        logging.info("Evaluating %d users over %d articles (k=%d, %d chunks, %d jobs).",
+                     int((n_relevant > 0).sum()), n_articles, k, len(chunks), n_jobs)
+
+        # Working memory of one chunk, in-process
+        tracemalloc.start()
+        if chunks:
+            evaluate_chunk(arrays, chunks[0], weights)
+        _, chunk_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        scoring_started = time.perf_counter()
+        if n_jobs == 1 or weights is not blend_weights:
+            # Custom weights may not be importable by spawned workers
+            parts = [evaluate_chunk(arrays, chunk, weights) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(key,)) as pool:
+                parts = list(pool.map(_evaluate_task, chunks))
+        scoring_s = time.perf_counter() - scoring_started
+        arrays_mb = sum(a.nbytes for a in arrays.values()) / 1e6
+    finally:
+        del arrays
+        discard(key)
+
+    evaluated = int((n_relevant > 0).sum())
+    variants = {}
+    for name in VARIANTS:
+        recommended = np.unique(np.concatenate([p[name]["recommended"] for p in parts])) if parts else []
+        variants[name] = {
+            f"recall@{k}": round(sum(p[name]["recall"] for p in parts) / max(evaluated, 1), 4),
+            f"ndcg@{k}": round(sum(p[name]["ndcg"] for p in parts) / max(evaluated, 1), 4),
+            "hit_rate": round(sum(p[name]["hit_rate"] for p in parts) / max(evaluated, 1), 4),
+            "coverage": round(len(recommended) / n_articles, 4),
+        }
+
+    results = {
+        "config": {
+            "n_clicks": len(clicks), "k": k, "test_fraction": test_fraction, "max_users": max_users,
+            "chunk_size": chunk_size, "n_jobs": n_jobs, "seed": seed, "cutoff_ts": cutoff,
+            "factors": "als (train split)" if trained else "given",
+        },
+        "users": {"warm": evaluated, "cold": len(cold_users), "catalogue": n_articles},
+        "variants": variants,
+        "cold_start": cold_start_metrics(scores, test, cold_users, k),
+        "cost": {
+            "setup_s": round(setup_s, 1),
+            "scoring_s": round(scoring_s, 2),
+            # Worker time per user, all variants (they share the chunk products)
+            "cpu_ms_per_user": round(1000 * sum(p["seconds"] for p in parts) / max(n_users, 1), 3),
+            "arrays_mb": round(arrays_mb, 1),
+            "chunk_peak_mb": round(chunk_peak / 1e6, 1),
+        },
+    }
+
+    if n_requests:
+        # Served engines on the train split: per-request latency and init memory
+        from benchmarks.engines_scale import ENGINES, measure_engine
+        from benchmarks.standins import build_environment, install, uninstall
+        cosmos, blobs = build_environment(clicks=train, articles=articles, embeddings=embeddings, factors=factors,
+                                          seed=seed)
+        install(cosmos, blobs)
+        try:
+            results["engines"] = {name: measure_engine(name, cosmos, n_requests, seed=seed) for name in ENGINES}
+        finally:
+            uninstall()
+
+    results["total_s"] = round(time.perf_counter() - started, 1)
+    return results
+
+
+def _load_pickle(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-split ranking evaluation of the engines and hybrid blend.")
+    parser.add_argument("--synthetic", choices=["small", "medium", "large"], default=None,
+                        help="Use generated data at this scale instead of files.")
+    parser.add_argument("--clicks-dir", default=os.getenv("ClicksDirectory"))
+    parser.add_argument("--clicks-file", default="dataset/clicks_sample.csv")
+    parser.add_argument("--articles", default="dataset/articles_metadata.csv")
+    parser.add_argument("--embeddings", default="models/articles_embeddings.pkl")
+    parser.add_argument("--model", default=None, help="CF model artifact (default: train ALS on the train split).")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--test-fraction", type=float, default=0.1)
+    parser.add_argument("--max-users", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=128)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=0, help="Per-engine requests for latency (0 = skip).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.synthetic:
+        from benchmarks.engines_scale import SCALES
+        from benchmarks.generators import generate_articles, generate_clicks, generate_embeddings
+        scale = SCALES[args.synthetic]
+        articles = generate_articles(scale["n_articles"], seed=args.seed)
+        embeddings = generate_embeddings(scale["n_articles"], seed=args.seed)
+        clicks = generate_clicks(scale["n_users"], scale["n_articles"], scale["n_clicks"], seed=args.seed)
+    else:
+        paths = list_click_files(args.clicks_dir) if args.clicks_dir else [args.clicks_file]
+        clicks = read_click_files(paths)
+        articles = pd.read_csv(args.articles, usecols=["article_id", "created_at_ts"])
+        embeddings = _load_pickle(args.embeddings)
+    factors = factors_from_artifact(_load_pickle(args.model)) if args.model else None
+
+    # Loggers created at import, then the ones the served engines create during the run (--requests)
+    _logs_to_stderr()
+    with contextlib.redirect_stdout(sys.stderr):
+        results = evaluate(clicks, articles, embeddings, factors, k=args.k, test_fraction=args.test_fraction,
+                           max_users=args.max_users, chunk_size=args.chunk_size, n_jobs=args.jobs,
+                           n_factors=args.factors, n_requests=args.requests, seed=args.seed)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
@@ -0,0 +1,233 @@
+"""
+In-memory stand-ins for the Cosmos DB repositories and the blob model store,
+so engines and routes can be exercised offline.
+
+    cosmos, blobs = build_environment(n_articles=5_000, n_users=2_000, n_clicks=50_000)
+    install(cosmos, blobs)
+    engine = HybridRecommendationEngine(n_recs=5)
+
+Importing this module disables blob logging (console only).
+"""
+import os
+
+# Offline: console logging only (see function_app_logging.get_logger)
+os.environ.pop("AzureBlobStorageConnectionString", None)
+
+import hashlib
+import importlib
+import pickle
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from function_app_tracing import traced
+
+
+class InMemoryCosmos:
+    """
+    Clicks and articles held in memory, answering the queries of
+    cosmos_clicks_repository / cosmos_articles_repository. `latency_ms`
+    adds a fixed delay per query to mimic the network round trip.
+    """
+
+    def __init__(self, clicks: pd.DataFrame, articles: pd.DataFrame, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.articles = articles.sort_values("article_id").reset_index(drop=True)
+        self._clicks = clicks.sort_values(["user_id", "click_timestamp"], kind="stable").reset_index(drop=True)
+        self._added = []
+        self._lock = threading.Lock()
+
+        users = self._clicks["user_id"].to_numpy()
+        self._user_ids, starts = np.unique(users, return_index=True)
+        stops = np.append(starts[1:], len(users))
+        self._ranges = dict(zip(self._user_ids.tolist(), zip(starts.tolist(), stops.tolist())))
+        self._articles = self._clicks["click_article_id"].to_numpy()
+        self._extra = {}  # user_id -> article ids added at runtime
+
+    def _io(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def get_all_clicks(self) -> pd.DataFrame:
+        self._io()
+        with self._lock:
+            added = pd.DataFrame(self._added, columns=self._clicks.columns)
+        return pd.concat([self._clicks, added], ignore_index=True) if len(added) else self._clicks.copy()
+
+    def get_users(self):
+        self._io()
+        return sorted(set(self._user_ids.tolist()) | set(self._extra))
+
+    def get_user_click_history(self, user_id: int):
+        self._io()
+        start, stop = self._ranges.get(int(user_id), (0, 0))
+        return self._articles[start:stop].tolist() + self._extra.get(int(user_id), [])
+
+    def get_clicked_articles_by_user(self, user_id: int):
+        return self.get_user_click_history(user_id)
+
+    def get_last_clicked_by_user(self, user_id: int):
+        history = self.get_user_click_history(user_id)
+        return history[-1] if history else None
+
+    def add_click(self, user_id: int, article_id: int, session_id: int, click_timestamp: int) -> dict:
+        self._io()
+        item = {
+            "id": f"{user_id}-{session_id}-{click_timestamp}",
+            "user_id": user_id,
+            "session_id": session_id,
+            "click_article_id": article_id,
+            "click_timestamp": click_timestamp,
+        }
+        with self._lock:
+            self._added.append((user_id, session_id, article_id, click_timestamp))
+            self._extra.setdefault(int(user_id), []).append(int(article_id))
+        return item
+
+    def get_all_articles(self) -> pd.DataFrame:
+        self._io()
+        return self.articles.copy()
+
+    def get_n_newest(self, n: int):
+        self._io()
+        return self.articles.nlargest(n, "created_at_ts").to_dict(orient="records")
+
+
+class InMemoryBlobStore:
+    """
+    Pickled artifacts by blob name, with an ETag that changes with their
+    content. Loads unpickle the stored bytes, so deserialization costs are
+    still measured.
+    """
+
+    def __init__(self):
+        self._blobs = {}
+        self._etags = {}
+
+    def put(self, blob_name: str, obj):
+        self.put_bytes(blob_name, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def put_bytes(self, blob_name: str, data: bytes):
+        self._blobs[blob_name] = data
+        # Content hash: shared-array caches keyed on the ETag never reuse other data, and processes
+        # rebuilding the same environment (StandinLoader) map the arrays already published
+        self._etags[blob_name] = hashlib.sha1(data).hexdigest()
+
+    def load_model_from_blob_storage(self, blob_name: str = "svdpp_model.pkl", container_name: str = None):
+        return pickle.loads(self._blobs[blob_name])
+
+    def get_blob_etag(self, blob_name: str, container_name: str = None) -> str:
+        return self._etags[blob_name]
+
+    def upload_file_to_blob(self, local_path: str, blob_name: str, container_name: str = None):
+        with open(local_path, "rb") as f:
+            self.put_bytes(blob_name, f.read())
+
+    def download_file_from_blob(self, blob_name: str, local_path: str, container_name: str = None):
+        with open(local_path, "wb") as f:
+            f.write(self._blobs[blob_name])
+
+
+_CLICKS_QUERIES = ("get_all_clicks", "get_users", "get_user_click_history", "get_clicked_articles_by_user",
+                   "get_last_clicked_by_user", "add_click")
+_ARTICLES_QUERIES = ("get_all_articles", "get_n_newest")
+_BLOB_FUNCTIONS = ("load_model_from_blob_storage", "get_blob_etag", "upload_file_to_blob", "download_file_from_blob")
+# Modules that import blob helpers by name
+_BLOB_IMPORTERS = ("engines.content_based_engine", "engines.svd_engine", "engines.covisitation_engine",
+                   "engines.hybrid_engine",
+                   "build_batch_recommendations", "build_train_svd", "build_train_als", "build_covisitation")
+
+_patched = []
+
+
+def _patch(module, name, value):
+    _patched.append((module, name, getattr(module, name)))
+    setattr(module, name, value)
+
+
+def install(cosmos: InMemoryCosmos, blobs: InMemoryBlobStore):
+    """
+    Route the repository and blob helpers (and the names already imported
+    from them) to the stand-ins. Repository queries keep their tracing spans.
+    Build scripts that import blob helpers by name must be imported first.
+    """
+    clicks_repo = importlib.import_module("azure_helpers.cosmos_clicks_repository")
+    articles_repo = importlib.import_module("azure_helpers.cosmos_articles_repository")
+    blob_utils = importlib.import_module("azure_helpers.blob_utils")
+
+    for name in _CLICKS_QUERIES:
+        _patch(clicks_repo, name, traced(f"cosmos.clicks.{name}")(getattr(cosmos, name)))
+    for name in _ARTICLES_QUERIES:
+        _patch(articles_repo, name, traced(f"cosmos.articles.{name}")(getattr(cosmos, name)))
+    # Engines bind blob helpers at import: load them now so their references get patched too
+    importlib.import_module("engines.content_based_engine")
+    importlib.import_module("engines.svd_engine")
+    importlib.import_module("engines.covisitation_engine")
+    importlib.import_module("engines.hybrid_engine")
+    for name in _BLOB_FUNCTIONS:
+        _patch(blob_utils, name, getattr(blobs, name))
+        for module_name in _BLOB_IMPORTERS:
+            module = sys.modules.get(module_name)
+            if module is not None and hasattr(module, name):
+                _patch(module, name, getattr(blobs, name))
+
+
+def uninstall():
+    """Restore everything `install` replaced."""
+    while _patched:
+        module, name, value = _patched.pop()
+        setattr(module, name, value)
+
+
+class StandinLoader:
+    """
+    Picklable engine loader for spawned processes (ShardedScorer workers),
+    which do not inherit the stand-ins installed in the parent: installs
+    `build_environment(**environment)` there, then loads the engines. Pass
+    the dataset and factors so the workers do not retrain.
+    """
+
+    def __init__(self, **environment):
+        self.environment = environment
+
+    def __call__(self):
+        install(*build_environment(**self.environment))
+        from engines.sharded_scoring import load_engines
+        return load_engines()
+
+
+def build_environment(n_articles: int = 5_000, n_users: int = 2_000, n_clicks: int = 50_000, dim: int = 64,
+                      n_factors: int = 32, latency_ms: float = 0.0, seed: int = 0, clicks: pd.DataFrame = None,
+                      articles: pd.DataFrame = None, embeddings: np.ndarray = None, factors: dict = None):
+    """
+    Generate (or take) a dataset, train CF factors on it unless `factors` is
+    given, and return the stand-ins holding everything. Sets
+    ArticlesEmbeddingsFile and SVDppModelFile to the blob names used.
+
+    Returns:
+        Tuple[InMemoryCosmos, InMemoryBlobStore]
+    """
+    from azure_helpers.data_loading import get_interactions, get_user_article_affinity_ratings
+    from benchmarks.generators import generate_articles, generate_clicks, generate_embeddings
+    from build_train_als import train_als
+
+    if articles is None:
+        articles = generate_articles(n_articles, seed=seed)
+    if embeddings is None:
+        embeddings = generate_embeddings(int(articles["article_id"].max()) + 1, dim=dim, seed=seed)
+    if clicks is None:
+        clicks = generate_clicks(n_users, len(articles), n_clicks, seed=seed)
+
+    if factors is None:
+        ratings = get_user_article_affinity_ratings(interactions_df=get_interactions(clicks))
+        factors = train_als(ratings, n_factors=n_factors, n_epochs=5)
+
+    blobs = InMemoryBlobStore()
+    blobs.put("articles_embeddings.pkl", embeddings)
+    blobs.put("svdpp_model.pkl", {"factors": factors})
+    os.environ["ArticlesEmbeddingsFile"] = "articles_embeddings.pkl"
+    os.environ["SVDppModelFile"] = "svdpp_model.pkl"
+    return InMemoryCosmos(clicks, articles, latency_ms=latency_ms), blobs
@@ -0,0 +1,139 @@
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from azure_helpers.blob_utils import load_model_from_blob_storage, upload_file_to_blob
+from azure_helpers.data_loading import get_articles_scores
+import azure_helpers.cosmos_clicks_repository as clicks_db
+from engines.batch_scoring import build_scoring_arrays, score_users
+from engines.covisitation_engine import serving_arrays
+from engines.shared_arrays import attach, cache_key, discard, load_or_publish
+from engines.svd_engine import factors_from_artifact
+
+
+# -------------------------------------------------------------------------
+# Worker side
+# -------------------------------------------------------------------------
+_arrays = None
+
+
+def _init_worker(key):
+    global _arrays
+    # Zero-copy: workers map the arrays published by the parent
+    _arrays = attach(key)
+
+
+def _score_chunk(bounds):
+    return score_users_chunk(_arrays, bounds)
+
+
+def score_users_chunk(arrays, bounds):
+    start, stop, k = bounds
+    return start, *score_users(arrays, start, stop, k)
+
+
+# -------------------------------------------------------------------------
+# Batch job
+# -------------------------------------------------------------------------
+def build_batch_recommendations(save_path: str, k: int = 20, chunk_size: int = 256, n_jobs: int | None = None,
+                                clicks_df=None, blob_name: str | None = "batch_recommendations.npz"):
+    """
+    Materialize the top-k hybrid recommendations of every known user.
+
+    Loads scores, embeddings, CF factors and, when CovisitationFile is set
+    (as for the served blend), the co-visitation matrix once, publishes them
+    as shared arrays, then scores users in chunks (users x catalogue matrix products)
+    across a process pool. Results are written as a compressed .npz of
+    columns: user_ids (n,), article_ids (n, k), scores (n, k). Users with
+    fewer than k unseen articles have their rows padded with article id -1
+    and score NaN.
+
+    Args:
+        save_path (str): Local output path (.npz).
+        k (int): Recommendations kept per user.
+        chunk_size (int): Users scored per matrix product.
+        n_jobs (Optional[int]): Worker processes (default: all cores; 1 = in-process).
+        clicks_df (Optional[pd.DataFrame]): Click history; read from Cosmos DB if omitted.
+        blob_name (Optional[str]): Blob to upload the result to (None to skip).
+
+    Returns:
+        dict: The written columns.
+    """
+    try:
+        started = time.perf_counter()
+        n_jobs = n_jobs or os.cpu_count() or 1
+
+        clicks = clicks_db.get_all_clicks() if clicks_df is None else clicks_df
+        scores = get_articles_scores()
+        embeddings = load_model_from_blob_storage(blob_name=os.getenv("ArticlesEmbeddingsFile"))
+        factors = factors_from_artifact(load_model_from_blob_storage(blob_name=os.getenv("SVDppModelFile")))
+        covisitation = None
+        if os.getenv("CovisitationFile"):
+            covisitation = serving_arrays(
+                load_model_from_blob_storage(blob_name=os.getenv("CovisitationFile"))["covisitation"]
+            )
+
+        key = cache_key("batch", time.time_ns(), os.getpid())
+        # Per-run key: a concurrent run must not prune it
+        arrays = load_or_publish(key, lambda: build_scoring_arrays(scores, clicks, embeddings, factors, covisitation),
+                                 prune=False)
+        del embeddings, factors, covisitation
+        n_users = len(arrays["user_ids"])
+        logging.info("Scoring %d users over %d articles (k=%d, %d jobs).",
+                     n_users, len(arrays["article_ids"]), k, n_jobs)
+
+        k = min(k, len(arrays["article_ids"]))
+        article_ids = np.empty((n_users, k), dtype=np.int64)
+        top_scores = np.empty((n_users, k), dtype=np.float32)
+        chunks = [(start, min(start + chunk_size, n_users), k) for start in range(0, n_users, chunk_size)]
+
+        try:
+            if n_jobs == 1:
+                results = (score_users_chunk(arrays, chunk) for chunk in chunks)
+                for start, ids, values in results:
+                    article_ids[start:start + len(ids)] = ids
+                    top_scores[start:start + len(ids)] = values
+            else:
+                with ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(key,)) as pool:
+                    for start, ids, values in pool.map(_score_chunk, chunks):
+                        article_ids[start:start + len(ids)] = ids
+                        top_scores[start:start + len(ids)] = values
+            user_ids = np.array(arrays["user_ids"])
+        finally:
+            del arrays
+            discard(key)
+
+        columns = {"user_ids": user_ids, "article_ids": article_ids, "scores": top_scores}
+        if os.path.dirname(save_path):
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        np.savez_compressed(save_path, **columns)
+        logging.info("Wrote top-%d recommendations of %d users to %s in %.1fs.",
+                     k, n_users, save_path, time.perf_counter() - started)
+
+        if blob_name:
+            upload_file_to_blob(local_path=save_path, blob_name=blob_name)
+        return columns
+
+    except Exception as e:
+        logging.exception("Error building batch recommendations: %s", e)
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize top-k recommendations for every user.")
+    parser.add_argument("--output", default="models/batch_recommendations.npz")
+    parser.add_argument("-k", type=int, default=20)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--no-upload", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    build_batch_recommendations(args.output, k=args.k, chunk_size=args.chunk_size, n_jobs=args.jobs,
+                                blob_name=None if args.no_upload else "batch_recommendations.npz")
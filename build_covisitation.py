@@ -0,0 +1,118 @@
+import argparse
+import logging
+import os
+import pickle
+import time
+
+import pandas as pd
+
+from azure_helpers.blob_utils import load_model_from_blob_storage, upload_file_to_blob
+from azure_helpers.data_loading import list_click_files, read_click_files
+from engines.covisitation_engine import build_covisitation, update_covisitation
+
+
+# -------------------------------------------------------------------------
+# Co-visitation Matrix Build and Persistence
+# -------------------------------------------------------------------------
+def _save(artifact: dict, save_path: str, blob_name: str | None):
+    if os.path.dirname(save_path):
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    with open(save_path, "wb") as f:
+        pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+    logging.info("Saved co-visitation artifact to %s", save_path)
+
+    if blob_name:
+        upload_file_to_blob(local_path=save_path, blob_name=blob_name)
+
+
+def build_covisitation_model(save_path: str, clicks_directory: str | None = os.getenv("ClicksDirectory"),
+                             clicks_file: str = 'dataset/clicks_sample.csv', clicks_df: pd.DataFrame | None = None,
+                             top_k: int = 50, blob_name: str | None = 'covisitation.pkl'):
+    """
+    Build the session co-visitation matrix from the full click history and
+    publish it for CovisitationRecommendationEngine (env CovisitationFile).
+
+    Args:
+        save_path (str): Local path of the artifact.
+        clicks_directory (Optional[str]): Click CSV directory (env ClicksDirectory).
+        clicks_file (str): Click CSV used when no directory is set.
+        clicks_df (Optional[pd.DataFrame]): Clicks to use instead of reading files.
+        top_k (int): Neighbours kept per article.
+        blob_name (Optional[str]): Blob to upload the artifact to (None to skip).
+
+    Returns:
+        dict: The co-visitation arrays.
+    """
+    try:
+        started = time.perf_counter()
+        if clicks_df is None:
+            files = list_click_files(clicks_directory) if clicks_directory else [clicks_file]
+            clicks_df = read_click_files(files)
+
+        covisitation = build_covisitation(clicks_df, top_k=top_k)
+        logging.info("Built co-visitation from %d clicks in %.1fs.", len(clicks_df), time.perf_counter() - started)
+        _save({"covisitation": covisitation, "params": {"top_k": top_k}}, save_path, blob_name)
+        return covisitation
+
+    except Exception as e:
+        logging.exception("Error building co-visitation matrix: %s", e)
+        raise
+
+
+def incremental_update_covisitation(save_path: str, new_clicks_files: list, previous_path: str | None = None,
+                                    previous_blob: str = os.getenv("CovisitationFile", "covisitation.pkl"),
+                                    top_k: int = 50, decay: float = 1.0,
+                                    blob_name: str | None = 'covisitation.pkl'):
+    """
+    Fold newly arrived clicks into the published co-visitation matrix without
+    reading the full history (see engines.covisitation_engine.update_covisitation).
+
+    Args:
+        save_path (str): Local path of the updated artifact.
+        new_clicks_files (list): Click CSVs received since the previous build.
+        previous_path (Optional[str]): Local previous artifact; downloaded from
+                                       `previous_blob` when omitted.
+        top_k (int): Neighbours kept per article.
+        decay (float): Factor applied to the previous counts (1.0 = no decay).
+        blob_name (Optional[str]): Blob to publish the updated artifact to (None to skip).
+
+    Returns:
+        dict: The updated co-visitation arrays.
+    """
+    try:
+        started = time.perf_counter()
+        if previous_path:
+            with open(previous_path, "rb") as f:
+                previous = pickle.load(f)
+        else:
+            previous = load_model_from_blob_storage(blob_name=previous_blob)
+
+        new_clicks = read_click_files(new_clicks_files)
+        covisitation = update_covisitation(previous["covisitation"], new_clicks, top_k=top_k, decay=decay)
+        logging.info("Updated co-visitation with %d clicks in %.1fs.", len(new_clicks), time.perf_counter() - started)
+        _save({"covisitation": covisitation, "params": {"top_k": top_k, "decay": decay}}, save_path, blob_name)
+        return covisitation
+
+    except Exception as e:
+        logging.exception("Error updating co-visitation matrix: %s", e)
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the session co-visitation matrix.")
+    parser.add_argument("--output", default="models/covisitation.pkl")
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--update", nargs="+", default=None, metavar="CLICKS_CSV",
+                        help="Fold these new click files into the published matrix instead of rebuilding.")
+    parser.add_argument("--previous", default=None, help="Local previous artifact for --update.")
+    parser.add_argument("--decay", type=float, default=1.0)
+    parser.add_argument("--no-upload", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    blob_name = None if args.no_upload else "covisitation.pkl"
+    if args.update:
+        incremental_update_covisitation(args.output, args.update, previous_path=args.previous, top_k=args.top_k,
+                                        decay=args.decay, blob_name=blob_name)
+    else:
+        build_covisitation_model(args.output, top_k=args.top_k, blob_name=blob_name)
@@ -0,0 +1,177 @@
+import argparse
+import logging
+import os
+import pickle
+import time
+
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import normalize
+from sklearn.utils.extmath import randomized_svd
+
+from azure_helpers.blob_utils import load_model_from_blob_storage, upload_file_to_blob
+
+
+# -------------------------------------------------------------------------
+# Projection
+# -------------------------------------------------------------------------
+def fit_projection(embeddings: np.ndarray, dim: int, method: str = "svd", sample_size: int | None = 100_000,
+                   random_state: int = 42) -> dict:
+    """
+    Fit a linear projection of the article embeddings to `dim` columns.
+
+    "svd" is a randomized truncated SVD of the L2-normalized rows (no
+    centering), which best preserves the dot products the content engine
+    ranks by. "pca" centers first (randomized PCA). Both are fitted on at
+    most `sample_size` rows.
+
+    Returns:
+        dict: components (dim x width, float32), mean (width,), method.
+    """
+    rng = np.random.default_rng(random_state)
+    rows = normalize(np.asarray(embeddings, dtype=np.float32), axis=1)
+    if sample_size and len(rows) > sample_size:
+        rows = rows[rng.choice(len(rows), sample_size, replace=False)]
+
+    if method == "svd":
+        _, _, components = randomized_svd(rows, n_components=dim, random_state=random_state)
+        mean = np.zeros(rows.shape[1], dtype=np.float32)
+    elif method == "pca":
+        pca = PCA(n_components=dim, svd_solver="randomized", random_state=random_state).fit(rows)
+        components, mean = pca.components_, pca.mean_
+    else:
+        raise ValueError(f"Unknown projection method: {method}")
+    return {"components": components.astype(np.float32), "mean": mean.astype(np.float32), "method": method}
+
+
+def project(embeddings: np.ndarray, projection: dict, chunk_size: int = 100_000) -> np.ndarray:
+    """Project (normalized) embeddings in chunks; rows keep their article_id positions."""
+    out = np.empty((len(embeddings), projection["components"].shape[0]), dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        rows = normalize(np.asarray(embeddings[start:start + chunk_size], dtype=np.float32), axis=1)
+        out[start:start + chunk_size] = (rows - projection["mean"]) @ projection["components"].T
+    return out
+
+
+# -------------------------------------------------------------------------
+# Evaluation
+# -------------------------------------------------------------------------
+def _top_k(normalized: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    sims = normalized[queries] @ normalized.T
+    sims[np.arange(len(queries)), queries] = -np.inf  # the article itself, as in the engine
+    return np.argpartition(-sims, k, axis=1)[:, :k]
+
+
+def _query_latency_ms(normalized: np.ndarray, queries: np.ndarray) -> float:
+    # One engine-style request: a matrix-vector product and a full sort
+    started = time.perf_counter()
+    for q in queries:
+        np.argsort(-(normalized @ normalized[q]))
+    return (time.perf_counter() - started) * 1000 / len(queries)
+
+
+def evaluate_projection(embeddings: np.ndarray, reduced: np.ndarray, k: int = 10, n_queries: int = 500,
+                        n_latency_queries: int = 50, random_state: int = 42, full: np.ndarray | None = None) -> dict:
+    """
+    Compare the reduced embeddings with the full-width ones on random query
+    articles: mean top-k overlap (|top_k full ∩ top_k reduced| / k), memory
+    and single-query latency of each.
+    """
+    rng = np.random.default_rng(random_state)
+    full = normalize(np.asarray(embeddings, dtype=np.float32), axis=1) if full is None else full
+    small = normalize(reduced, axis=1)
+    queries = rng.choice(len(full), min(n_queries, len(full)), replace=False)
+
+    overlaps = []
+    for start in range(0, len(queries), 100):
+        batch = queries[start:start + 100]
+        for a, b in zip(_top_k(full, batch, k), _top_k(small, batch, k)):
+            overlaps.append(len(np.intersect1d(a, b)) / k)
+
+    latency_queries = queries[:n_latency_queries]
+    full_ms = _query_latency_ms(full, latency_queries)
+    small_ms = _query_latency_ms(small, latency_queries)
+    return {
+        "dim": reduced.shape[1],
+        f"overlap@{k}": round(float(np.mean(overlaps)), 4),
+        "memory_mb": round(small.nbytes / 1e6, 1),
+        "full_memory_mb": round(full.nbytes / 1e6, 1),
+        "memory_saving": round(1 - small.nbytes / full.nbytes, 3),
+        "query_ms": round(small_ms, 3),
+        "full_query_ms": round(full_ms, 3),
+        "speedup": round(full_ms / small_ms, 2) if small_ms else None,
+    }
+
+
+# -------------------------------------------------------------------------
+# Build
+# -------------------------------------------------------------------------
+def build_reduced_embeddings(save_path: str, dims=(32, 64, 100, 150), min_overlap: float = 0.9, k: int = 10,
+                             method: str = "svd", embeddings: np.ndarray | None = None,
+                             source_blob: str | None = os.getenv("ArticlesEmbeddingsFile"),
+                             blob_name: str | None = None, n_queries: int = 500):
+    """
+    Sweep projection sizes, keep the smallest one whose top-k overlap with
+    the full-width similarities is at least `min_overlap` (the largest tried
+    otherwise), and save it as a drop-in embeddings artifact (float32 matrix,
+    row = article_id). Point ArticlesEmbeddingsFile at `blob_name` to serve it.
+
+    Returns:
+        Tuple[np.ndarray, List[dict]]: The chosen reduced matrix and one report per dimension.
+    """
+    try:
+        if embeddings is None:
+            embeddings = load_model_from_blob_storage(blob_name=source_blob)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        full = normalize(embeddings, axis=1)
+        logging.info("Reducing %d x %d embeddings (%s), dims %s.", *embeddings.shape, method, list(dims))
+
+        reports, chosen = [], None
+        for dim in sorted(d for d in dims if d < embeddings.shape[1]):
+            started = time.perf_counter()
+            reduced = project(embeddings, fit_projection(embeddings, dim, method))
+            report = evaluate_projection(embeddings, reduced, k=k, n_queries=n_queries, full=full)
+            report["fit_s"] = round(time.perf_counter() - started, 2)
+            reports.append(report)
+            logging.info("dim=%d: %s", dim, report)
+            chosen = reduced
+            if report[f"overlap@{k}"] >= min_overlap:
+                break
+        if chosen is None:
+            raise ValueError(f"No dimension below the embedding width {embeddings.shape[1]} was given.")
+
+        if os.path.dirname(save_path):
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        with open(save_path, "wb") as f:
+            pickle.dump(chosen, f, protocol=pickle.HIGHEST_PROTOCOL)
+        logging.info("Saved %d-d embeddings to %s.", chosen.shape[1], save_path)
+
+        if blob_name:
+            upload_file_to_blob(local_path=save_path, blob_name=blob_name)
+        return chosen, reports
+
+    except Exception as e:
+        logging.exception("Error building reduced embeddings: %s", e)
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Project article embeddings to fewer dimensions.")
+    parser.add_argument("--output", default="models/articles_embeddings_reduced.pkl")
+    parser.add_argument("--dims", type=int, nargs="+", default=[32, 64, 100, 150])
+    parser.add_argument("--min-overlap", type=float, default=0.9)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--method", choices=["svd", "pca"], default="svd")
+    parser.add_argument("--source", default=None, help="Local embeddings pickle (default: ArticlesEmbeddingsFile blob).")
+    parser.add_argument("--upload", default=None, help="Blob name for the reduced artifact.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    source = None
+    if args.source:
+        with open(args.source, "rb") as f:
+            source = pickle.load(f)
+    _, reports = build_reduced_embeddings(args.output, args.dims, args.min_overlap, args.k, args.method,
+                                          embeddings=source, blob_name=args.upload)
+    for report in reports:
+        print(report)
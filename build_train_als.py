@@ -0,0 +1,330 @@
+import os
+
+import logging
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from azure_helpers.blob_utils import upload_file_to_blob
+from azure_helpers.data_loading import (
+    get_interactions, get_user_article_affinity_ratings, list_click_files, read_click_files
+)
+
+
+# -------------------------------------------------------------------------
+# Sparse ratings
+# -------------------------------------------------------------------------
+class RatingsMatrix:
+    """
+    Ratings as index arrays plus CSR structures in both orientations, so that
+    user and item half-steps can rebuild sparse operators by only swapping
+    their `.data` vector.
+    """
+
+    def __init__(self, users: np.ndarray, items: np.ndarray, ratings: np.ndarray, n_users: int, n_items: int):
+        self.n_users = n_users
+        self.n_items = n_items
+        self.global_mean = float(ratings.mean()) if len(ratings) else 0.0
+
+        by_user = np.lexsort((items, users))
+        self.u_rows, self.u_cols, self.u_vals = users[by_user], items[by_user], ratings[by_user]
+        self.by_user = sp.csr_matrix(
+            (np.ones(len(by_user), dtype=np.float32), self.u_cols, self._indptr(self.u_rows, n_users)),
+            shape=(n_users, n_items)
+        )
+
+        by_item = np.lexsort((users, items))
+        self.i_rows, self.i_cols, self.i_vals = items[by_item], users[by_item], ratings[by_item]
+        self.by_item = sp.csr_matrix(
+            (np.ones(len(by_item), dtype=np.float32), self.i_cols, self._indptr(self.i_rows, n_items)),
+            shape=(n_items, n_users)
+        )
+
+        self.user_counts = np.diff(self.by_user.indptr).astype(np.float32)
+        self.item_counts = np.diff(self.by_item.indptr).astype(np.float32)
+
+    @staticmethod
+    def _indptr(sorted_rows, n_rows):
+        return np.concatenate([[0], np.cumsum(np.bincount(sorted_rows, minlength=n_rows))])
+
+    @classmethod
+    def from_frame(cls, ratings_df: pd.DataFrame):
+        """
+        Build from [user_id, item_id, rating] triplets.
+
+        Returns:
+            Tuple[RatingsMatrix, np.ndarray, np.ndarray]: matrix, raw user ids, raw item ids
+            (position = inner index).
+        """
+        user_ids, users = np.unique(ratings_df["user_id"].to_numpy(dtype=np.int64), return_inverse=True)
+        item_ids, items = np.unique(ratings_df["item_id"].to_numpy(dtype=np.int64), return_inverse=True)
+        matrix = cls(users, items, ratings_df["rating"].to_numpy(dtype=np.float32), len(user_ids), len(item_ids))
+        return matrix, user_ids, item_ids
+
+
+# -------------------------------------------------------------------------
+# Alternating least squares (biased, explicit ratings)
+# -------------------------------------------------------------------------
+def _rowwise_dot(a, b, rows, cols, chunk=1 << 20):
+    # a[rows] . b[cols] for every rating, in bounded memory
+    out = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), chunk):
+        stop = start + chunk
+        out[start:stop] = np.einsum("ij,ij->i", a[rows[start:stop]], b[cols[start:stop]])
+    return out
+
+
+def _cg_half_step(x, features, structure, rows, cols, targets, counts, reg, cg_steps):
+    """
+    Solve (F_u^T F_u + reg * n_u * I) x_u = F_u^T y_u for every row u at once
+    with a few conjugate-gradient iterations, warm-started from `x`.
+    Each iteration costs two sparse products (O(nnz * k)); no k x k system is formed.
+    """
+    operator = structure.copy()
+    damping = (reg * counts)[:, None]
+
+    def matvec(v):
+        operator.data = _rowwise_dot(v, features, rows, cols)
+        return operator @ features + damping * v
+
+    operator.data = targets
+    b = operator @ features
+    r = b - matvec(x)
+    p = r.copy()
+    rs = np.einsum("ij,ij->i", r, r)
+    for _ in range(cg_steps):
+        ap = matvec(p)
+        denom = np.einsum("ij,ij->i", p, ap)
+        alpha = np.divide(rs, denom, out=np.zeros_like(rs), where=denom > 1e-12)[:, None]
+        x += alpha * p
+        r -= alpha * ap
+        rs_new = np.einsum("ij,ij->i", r, r)
+        beta = np.divide(rs_new, rs, out=np.zeros_like(rs), where=rs > 1e-12)[:, None]
+        p = r + beta * p
+        rs = rs_new
+    return x
+
+
+def solve_users(matrix: RatingsMatrix, mu: float, user_factors, user_bias, item_factors, item_bias,
+                reg: float, cg_steps: int, users=None):
+    """
+    User half-step, in place: re-solve [p_u, b_u] against fixed items, with
+    features [q_i, 1] and targets r - mu - b_i. The rows of `matrix` are
+    `users` (indices into user_factors) when given, else every user.
+    """
+    rows = slice(None) if users is None else users
+    x = np.hstack([user_factors[rows], user_bias[rows][:, None]])
+    features = np.hstack([item_factors, np.ones((len(item_factors), 1), dtype=np.float32)])
+    x = _cg_half_step(
+        x, features, matrix.by_user, matrix.u_rows, matrix.u_cols,
+        matrix.u_vals - mu - item_bias[matrix.u_cols], matrix.user_counts, reg, cg_steps
+    )
+    user_factors[rows], user_bias[rows] = x[:, :-1], x[:, -1]
+
+
+def solve_items(matrix: RatingsMatrix, mu: float, user_factors, user_bias, item_factors, item_bias,
+                reg: float, cg_steps: int, items=None):
+    """
+    Item half-step, in place: re-solve [q_i, b_i] against fixed users, with
+    features [p_u, 1] and targets r - mu - b_u. The columns of `matrix` are
+    `items` (indices into item_factors) when given, else every item.
+    """
+    rows = slice(None) if items is None else items
+    x = np.hstack([item_factors[rows], item_bias[rows][:, None]])
+    features = np.hstack([user_factors, np.ones((len(user_factors), 1), dtype=np.float32)])
+    x = _cg_half_step(
+        x, features, matrix.by_item, matrix.i_rows, matrix.i_cols,
+        matrix.i_vals - mu - user_bias[matrix.i_cols], matrix.item_counts, reg, cg_steps
+    )
+    item_factors[rows], item_bias[rows] = x[:, :-1], x[:, -1]
+
+
+def train_als(ratings_df: pd.DataFrame, n_factors: int = 100, n_epochs: int = 15, reg: float = 0.05,
+              cg_steps: int = 3, init_std: float = 0.1, random_state: int = 42,
+              rating_scale=(1, 5)) -> dict:
+    """
+    Train a biased matrix factorization on a scipy.sparse ratings matrix with
+    alternating least squares and batched conjugate-gradient solves.
+
+    Args:
+        ratings_df (pd.DataFrame): [user_id, item_id, rating] triplets.
+        n_factors (int): Latent dimension.
+        n_epochs (int): ALS epochs (one user and one item half-step each).
+        reg (float): L2 regularization, scaled by each row's rating count.
+        cg_steps (int): CG iterations per half-step.
+        init_std (float): Std of the random factor initialization.
+        random_state (int): Seed.
+        rating_scale (tuple): Clipping range used at serving time.
+
+    Returns:
+        dict: Factors in the layout of svd_engine.factors_from_surprise.
+    """
+    matrix, user_ids, item_ids = RatingsMatrix.from_frame(ratings_df)
+    rng = np.random.default_rng(random_state)
+    user_factors = rng.normal(0, init_std, (matrix.n_users, n_factors)).astype(np.float32)
+    item_factors = rng.normal(0, init_std, (matrix.n_items, n_factors)).astype(np.float32)
+    user_bias = np.zeros(matrix.n_users, dtype=np.float32)
+    item_bias = np.zeros(matrix.n_items, dtype=np.float32)
+
+    mu = matrix.global_mean
+    for _ in range(n_epochs):
+        solve_users(matrix, mu, user_factors, user_bias, item_factors, item_bias, reg, cg_steps)
+        solve_items(matrix, mu, user_factors, user_bias, item_factors, item_bias, reg, cg_steps)
+    return {
+        "global_mean": np.array([matrix.global_mean]),
+        "rating_scale": np.array(rating_scale, dtype=np.float64),
+        "user_ids": user_ids,
+        "item_ids": item_ids,
+        "user_bias": user_bias,
+        "item_bias": item_bias,
+        "user_factors": user_factors,
+        "item_factors": item_factors,
+    }
+
+
+def update_als(factors: dict, ratings_df: pd.DataFrame, touched_users, touched_items, n_epochs: int = 3,
+               reg: float = 0.05, cg_steps: int = 3, init_std: float = 0.1, random_state: int = 42) -> dict:
+    """
+    Warm-start update of trained factors (from any trainer) with new interactions.
+
+    Unknown users / items get new rows (appended, so existing inner indices
+    are stable). Only `touched_users` and `touched_items` are re-solved, each
+    against all of its own ratings with the other side held fixed, so the
+    cost scales with the ratings of touched rows, not the whole matrix. The
+    global mean and every untouched row are kept as is.
+
+    Args:
+        factors (dict): Previous factors (see svd_engine.factors_from_artifact).
+        ratings_df (pd.DataFrame): [user_id, item_id, rating]; must contain the
+                                   full rating rows of the touched users and items.
+        touched_users, touched_items: Raw ids with new interactions.
+        n_epochs (int): Alternations over the touched rows.
+
+    Returns:
+        dict: Updated factors, same layout.
+    """
+    rng = np.random.default_rng(random_state)
+    n_factors = factors["item_factors"].shape[1]
+
+    def extend(ids, vectors, bias, new_ids):
+        new_ids = np.setdiff1d(np.asarray(new_ids, dtype=np.int64), ids)
+        return (
+            np.concatenate([ids, new_ids]),
+            np.vstack([vectors, rng.normal(0, init_std, (len(new_ids), n_factors))]).astype(np.float32),
+            np.concatenate([bias, np.zeros(len(new_ids))]).astype(np.float32),
+        )
+
+    user_ids, user_factors, user_bias = extend(
+        factors["user_ids"], factors["user_factors"], factors["user_bias"], touched_users
+    )
+    item_ids, item_factors, item_bias = extend(
+        factors["item_ids"], factors["item_factors"], factors["item_bias"], touched_items
+    )
+    mu = float(factors["global_mean"][0])
+
+    users = _lookup(user_ids, ratings_df["user_id"].to_numpy(dtype=np.int64))
+    items = _lookup(item_ids, ratings_df["item_id"].to_numpy(dtype=np.int64))
+    ratings = ratings_df["rating"].to_numpy(dtype=np.float32)
+    known = (users >= 0) & (items >= 0)
+    users, items, ratings = users[known], items[known], ratings[known]
+
+    # Sub-matrices: touched users x all items, all users x touched items (local row / column numbers)
+    touched_u = np.unique(_lookup(user_ids, np.asarray(touched_users, dtype=np.int64)))
+    touched_i = np.unique(_lookup(item_ids, np.asarray(touched_items, dtype=np.int64)))
+    local_u = np.full(len(user_ids), -1)
+    local_u[touched_u] = np.arange(len(touched_u))
+    local_i = np.full(len(item_ids), -1)
+    local_i[touched_i] = np.arange(len(touched_i))
+
+    in_u = local_u[users] >= 0
+    user_matrix = RatingsMatrix(local_u[users[in_u]], items[in_u], ratings[in_u], len(touched_u), len(item_ids))
+    in_i = local_i[items] >= 0
+    item_matrix = RatingsMatrix(users[in_i], local_i[items[in_i]], ratings[in_i], len(user_ids), len(touched_i))
+
+    for _ in range(n_epochs):
+        if len(touched_u):
+            solve_users(user_matrix, mu, user_factors, user_bias, item_factors, item_bias, reg, cg_steps, touched_u)
+        if len(touched_i):
+            solve_items(item_matrix, mu, user_factors, user_bias, item_factors, item_bias, reg, cg_steps, touched_i)
+
+    return {
+        **factors,
+        "user_ids": user_ids,
+        "item_ids": item_ids,
+        "user_bias": user_bias,
+        "item_bias": item_bias,
+        "user_factors": user_factors,
+        "item_factors": item_factors,
+    }
+
+
+def predict(factors: dict, user_ids, item_ids) -> np.ndarray:
+    """
+    Clipped rating estimates for (user, item) pairs of raw ids, with the
+    serving engine's rules (unknown user: baseline; unknown item: global mean).
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    item_ids = np.asarray(item_ids, dtype=np.int64)
+    u = _lookup(factors["user_ids"], user_ids)
+    i = _lookup(factors["item_ids"], item_ids)
+    est = np.full(len(user_ids), factors["global_mean"][0], dtype=np.float64)
+    known_u, known_i = u >= 0, i >= 0
+    both = known_u & known_i
+    est[known_i] += factors["item_bias"][i[known_i]]
+    est[known_u & known_i] += factors["user_bias"][u[both]] + np.einsum(
+        "ij,ij->i", factors["user_factors"][u[both]], factors["item_factors"][i[both]]
+    )
+    return np.clip(est, *factors["rating_scale"])
+
+
+def _lookup(raw_ids, values):
+    order = np.argsort(raw_ids, kind="stable")
+    pos = np.minimum(np.searchsorted(raw_ids[order], values), max(len(raw_ids) - 1, 0))
+    found = raw_ids[order][pos] == values
+    return np.where(found, order[pos], -1)
+
+
+# -------------------------------------------------------------------------
+# Model Training and Persistence
+# -------------------------------------------------------------------------
+def build_and_train_als_model(save_model_path: str, clicks_directory: str | None = os.getenv("ClicksDirectory"),
+                              clicks_file: str = 'dataset/clicks_sample.csv', blob_name: str | None = 'als_model.pkl',
+                              ratings_df: pd.DataFrame | None = None, **params):
+    """
+    Train the ALS factorization from user-article affinity ratings and persist
+    a {"factors": ...} artifact loadable by SVDRecommendationEngine
+    (point SVDppModelFile at `blob_name` to serve it). Trains on `ratings_df`
+    when given, otherwise on the click files.
+    """
+    try:
+        if ratings_df is None:
+            if clicks_directory:
+                clicks = read_click_files(list_click_files(clicks_directory))
+            else:
+                clicks = read_click_files([clicks_file])
+            ratings_df = get_user_article_affinity_ratings(interactions_df=get_interactions(clicks, copy=False))
+            del clicks
+        if ratings_df.empty:
+            raise ValueError("No training data available for ALS model.")
+
+        started = time.perf_counter()
+        factors = train_als(ratings_df, **params)
+        logging.info("Trained ALS model on %d interactions in %.1fs.", len(ratings_df), time.perf_counter() - started)
+
+        artifact = {"factors": factors, "trainer": "als", "params": params}
+        if os.path.dirname(save_model_path):
+            os.makedirs(os.path.dirname(save_model_path), exist_ok=True)
+        with open(save_model_path, "wb") as f:
+            pickle.dump(artifact, f)
+
+        if blob_name:
+            upload_file_to_blob(local_path=save_model_path, blob_name=blob_name)
+        logging.info("Saved ALS model artifact to %s", save_model_path)
+        return factors
+
+    except Exception as e:
+        logging.exception("Error training ALS model: %s", e)
+        raise
@@ -3,61 +3,90 @@ import os
 
 import logging
 import pickle
+import time
 
 import pandas as pd
 from surprise import Dataset, Reader, SVDpp
 
 
-from azure_helpers.blob_utils import upload_file_to_blob
-from azure_helpers.data_loading import get_interactions, get_user_article_affinity_ratings
+from azure_helpers.blob_utils import load_model_from_blob_storage, upload_file_to_blob
+from azure_helpers.data_loading import (
+    get_interactions, get_user_article_affinity_ratings, list_click_files, read_click_files
+)
+from build_train_als import update_als
+from engines.svd_engine import factors_from_artifact
 
 
 # -------------------------------------------------------------------------
 # Model Training and Persistence
 # -------------------------------------------------------------------------
-def __load_training_data(directory = None, file='dataset/clicks_sample.csv'):
-    if directory:
-        clicks_df = pd.DataFrame()
-        for file in os.listdir(directory):
-            clicks_df = pd.concat([clicks_df, pd.read_csv(directory + file)])
+SVDPP_PARAMS = {
+    "n_factors": 100,
+    "n_epochs": 20,
+    "lr_all": 0.004,
+    "reg_all": 0.04,
+    "random_state": 42,
+}
 
-        # print("\ndTypes when loading from CSV:\n", clicks_df.dtypes)
 
-        clicks_df = clicks_df.drop_duplicates()
+def __load_training_data(directory = None, file='dataset/clicks_sample.csv', n_jobs: int = 1):
+    """
+    Load deduplicated clicks with compact dtypes, from every CSV of
+    `directory` (full click history) or from a single `file`.
+    """
+    if directory:
+        clicks_df = read_click_files(list_click_files(directory), n_jobs=n_jobs)
     elif file:
-        clicks_df = pd.read_csv(file).drop_duplicates()
+        clicks_df = read_click_files([file])
     else:
         return None
     return clicks_df
 
 
-def build_and_train_model(save_model_path: str):
+def fit_svdpp(ratings_df, **params):
+    """
+    Fit SVD++ on [user_id, item_id, rating] triplets; `params` override SVDPP_PARAMS.
+
+    Returns:
+        Tuple[SVDpp, Trainset]: The fitted model and its training set.
+    """
+    reader = Reader(rating_scale=(1, 5))
+    data = Dataset.load_from_df(ratings_df[["user_id", "item_id", "rating"]], reader)
+    trainset = data.build_full_trainset()
+
+    model = SVDpp(**{**SVDPP_PARAMS, **params})
+    model.fit(trainset)
+    return model, trainset
+
+
+def build_and_train_model(save_model_path: str, clicks_directory: str | None = os.getenv("ClicksDirectory"),
+                          clicks_file: str = 'dataset/clicks_sample.csv', n_jobs: int = 1,
+                          params: dict | None = None, blob_name: str | None = 'svdpp_model.pkl',
+                          ratings_df: pd.DataFrame | None = None):
     """
     Train a new SVD++ model from user-article affinity ratings
     and persist it to disk.
+
+    Trains on `ratings_df` when given (e.g. the ratings tune_cf_model
+    searched on), otherwise on every click file of `clicks_directory` (env
+    ClicksDirectory) when set, else on `clicks_file`. `params` override
+    SVDPP_PARAMS (e.g. the best configuration found by tune_cf_model).
     """
     try:
-        clicks = __load_training_data(file='dataset/clicks_sample.csv')
-        interactions = get_interactions(clicks_df=clicks)
-        ratings_df = get_user_article_affinity_ratings(interactions_df=interactions)
+        if ratings_df is None:
+            clicks = __load_training_data(directory=clicks_directory, file=clicks_file, n_jobs=n_jobs)
+            # The loader owns these frames: enrich in place and release them once ratings exist
+            interactions = get_interactions(clicks_df=clicks, copy=False)
+            del clicks
+            ratings_df = get_user_article_affinity_ratings(interactions_df=interactions)
+            del interactions
 
         if ratings_df.empty:
             raise ValueError("No training data available for SVD++ model.")
         
         # print("\ndTypes at training start:\n", ratings_df.dtypes)
 
-        reader = Reader(rating_scale=(1, 5))
-        data = Dataset.load_from_df(ratings_df, reader)
-        trainset = data.build_full_trainset()
-
-        model = SVDpp(
-            n_factors=100,
-            n_epochs=20,
-            lr_all=0.004,
-            reg_all=0.04,
-            random_state=42
-        )
-        model.fit(trainset)
+        model, trainset = fit_svdpp(ratings_df, **(params or {}))
         logging.info("Trained SVD++ model on %d interactions.", trainset.n_ratings)
 
         artifact = {
@@ -66,17 +95,100 @@ def build_and_train_model(save_model_path: str):
             "user_raw_to_inner": trainset._raw2inner_id_users,
             "item_raw_to_inner": trainset._raw2inner_id_items,
             "user_inner_to_raw": trainset._inner2raw_id_users,
-            "item_inner_to_raw": trainset._inner2raw_id_items
+            "item_inner_to_raw": trainset._inner2raw_id_items,
+            "params": {**SVDPP_PARAMS, **(params or {})},
         }
 
         os.makedirs(os.path.dirname(save_model_path), exist_ok=True)
         with open(save_model_path, "wb") as f:
             pickle.dump(artifact, f)
 
-        upload_file_to_blob(local_path=save_model_path, blob_name='svdpp_model.pkl')
+        if blob_name:
+            upload_file_to_blob(local_path=save_model_path, blob_name=blob_name)
         logging.info("Saved SVD++ model artifact to %s", save_model_path)
         return model, trainset
 
     except Exception as e:
         logging.exception("Error training SVD++ model: %s", e)
-        raise
\ No newline at end of file
+        raise
+
+def incremental_update_model(save_model_path: str, new_clicks_files: list,
+                             clicks_directory: str | None = os.getenv("ClicksDirectory"),
+                             clicks_file: str = 'dataset/clicks_sample.csv',
+                             previous_model_path: str | None = None,
+                             previous_blob: str = os.getenv("SVDppModelFile", "svdpp_model.pkl"),
+                             n_epochs: int = 3, reg: float = 0.05, blob_name: str | None = 'svdpp_model.pkl'):
+    """
+    Refresh the published CF model with newly arrived clicks, without a full retrain.
+
+    Loads the previous factors (SVD++ or ALS artifact), adds rows for new users
+    and articles, and re-solves only the users and articles that appear in
+    `new_clicks_files` (see build_train_als.update_als), each against its full
+    rating history. Everything else keeps its previous factors. The result is
+    written as a dense {"factors": ...} artifact, which the serving engine
+    loads like any other; run build_and_train_model periodically for a full refit.
+
+    Args:
+        save_model_path (str): Local path of the updated artifact.
+        new_clicks_files (list): Click CSVs received since the previous model.
+        clicks_directory (Optional[str]): Full click history (env ClicksDirectory).
+        clicks_file (str): History file used when no directory is set.
+        previous_model_path (Optional[str]): Local previous artifact; downloaded from
+                                             `previous_blob` when omitted.
+        n_epochs (int): ALS alternations over the touched rows.
+        reg (float): L2 regularization of the re-solved rows.
+        blob_name (Optional[str]): Blob to publish the updated artifact to (None to skip).
+
+    Returns:
+        dict: The updated factors.
+    """
+    try:
+        started = time.perf_counter()
+        if previous_model_path:
+            with open(previous_model_path, "rb") as f:
+                previous = pickle.load(f)
+        else:
+            previous = load_model_from_blob_storage(blob_name=previous_blob)
+        factors = factors_from_artifact(previous)
+
+        new_clicks = read_click_files(new_clicks_files)
+        new_paths = {os.path.abspath(path) for path in new_clicks_files}
+        history_files = list_click_files(clicks_directory) if clicks_directory else [clicks_file]
+        history_files = [path for path in history_files if os.path.abspath(path) not in new_paths]
+        clicks = pd.concat(
+            [read_click_files(history_files), new_clicks] if history_files else [new_clicks], ignore_index=True
+        ).drop_duplicates(ignore_index=True)
+
+        touched_users = new_clicks["user_id"].unique()
+        touched_items = new_clicks["click_article_id"].unique()
+        ratings_df = get_user_article_affinity_ratings(interactions_df=get_interactions(clicks_df=clicks, copy=False))
+        del clicks, new_clicks
+
+        updated = update_als(factors, ratings_df, touched_users, touched_items, n_epochs=n_epochs, reg=reg)
+        logging.info(
+            "Updated CF model for %d users and %d articles (%d new users, %d new articles) in %.1fs.",
+            len(touched_users), len(touched_items),
+            len(updated["user_ids"]) - len(factors["user_ids"]),
+            len(updated["item_ids"]) - len(factors["item_ids"]),
+            time.perf_counter() - started
+        )
+
+        artifact = {
+            "factors": updated,
+            "trainer": "incremental",
+            "base_params": previous.get("params"),
+            "params": {"n_epochs": n_epochs, "reg": reg},
+        }
+        if os.path.dirname(save_model_path):
+            os.makedirs(os.path.dirname(save_model_path), exist_ok=True)
+        with open(save_model_path, "wb") as f:
+            pickle.dump(artifact, f)
+
+        if blob_name:
+            upload_file_to_blob(local_path=save_model_path, blob_name=blob_name)
+        logging.info("Saved incrementally updated model artifact to %s", save_model_path)
+        return updated
+
+    except Exception as e:
+        logging.exception("Error updating CF model incrementally: %s", e)
+        raise
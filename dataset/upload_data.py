@@ -1,6 +1,12 @@
+import argparse
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos import CosmosClient, PartitionKey, exceptions
 from dotenv import load_dotenv
 import pandas as pd
 
@@ -12,51 +18,306 @@ DATABASE_NAME = "bookrec"
 ARTICLES_CONTAINER = "articles"
 CLICKS_CONTAINER = "clicks"
 
+MAX_BATCH_OPERATIONS = 100      # Cosmos DB transactional batch limit
+MAX_WORKERS = 16
+PROGRESS_SECONDS = 5.0
+CHECKPOINT_DIR = "dataset/.upload_checkpoints"
 
-client = CosmosClient.from_connection_string(conn_str=COSMOS_CONNECTION_STRING)
-# Create database if it doesn't exist
-database = client.create_database_if_not_exists(id=DATABASE_NAME)
+_client = None
 
-# --- Upload Function ---
-def upload(container_name, df, id_field):
 
-    db = client.get_database_client(DATABASE_NAME)
+def get_database():
+    global _client
+    if _client is None:
+        _client = CosmosClient.from_connection_string(conn_str=COSMOS_CONNECTION_STRING)
+    # Create database if it doesn't exist
+    return _client.create_database_if_not_exists(id=DATABASE_NAME)
+
+
+# --- Documents and batches ---
+def to_documents(df, id_field):
+    """
+    Rows as Cosmos documents (native Python values), with `id` taken from `id_field`.
+    """
+    docs = df.to_dict(orient="records")
+    for doc in docs:
+        doc["id"] = str(doc[id_field])
+    return docs
+
+
+def partition_batches(docs, partition_key_field, batch_size=MAX_BATCH_OPERATIONS):
+    """
+    Group documents by partition key value and cut each group into batches of
+    at most `batch_size` (one transactional batch each). The order is
+    deterministic for a given input, so batch numbers can be checkpointed.
+
+    Returns:
+        List[Tuple[Any, List[dict]]]: (partition key value, documents).
+    """
+    groups = {}
+    for doc in docs:
+        groups.setdefault(doc[partition_key_field], []).append(doc)
+
+    batches = []
+    for key in sorted(groups):
+        group = sorted(groups[key], key=lambda d: d["id"])
+        for start in range(0, len(group), batch_size):
+            batches.append((key, group[start:start + batch_size]))
+    return batches
+
+
+def plan_fingerprint(container_name, batches):
+    """
+    Identify a batch plan by the content of its batches (partition key and
+    documents, in batch order), so a checkpoint only resumes the same input.
+    """
+    digest = hashlib.sha1()
+    for partition_key, docs in batches:
+        digest.update(json.dumps([partition_key, docs], sort_keys=True, default=str).encode("utf-8"))
+    return json.dumps({"container": container_name, "batches": len(batches), "sha1": digest.hexdigest()})
+
+
+# --- Throttling ---
+class AdaptiveThrottle:
+    """
+    Backoff shared by all upload threads: a 429 pauses every thread for the
+    server's retry-after (or an exponentially growing delay), and the delay
+    decays again as requests succeed.
+    """
+
+    def __init__(self, base_delay=0.1, max_delay=30.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled_count = 0
+        self._delay = 0.0
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            self.throttled_count += 1
+            self._delay = min(self.max_delay, max(self._delay * 2, self.base_delay, retry_after or 0.0))
+            self._resume_at = max(self._resume_at, time.monotonic() + self._delay)
+
+    def succeeded(self):
+        with self._lock:
+            self._delay /= 2
+
+
+def _retry_after_seconds(error):
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("x-ms-retry-after-ms")
+    return float(value) / 1000 if value else None
+
+
+# --- Checkpoints ---
+class Checkpoint:
+    """
+    Append-only record of completed batch numbers, so an interrupted upload
+    resumes where it stopped. The first line identifies the batch plan; a
+    checkpoint written for different input is ignored.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                header = f.readline().strip()
+                if header == fingerprint:
+                    self.done = {int(line) for line in f if line.strip()}
+        if not self.done:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                f.write(fingerprint + "\n")
+        self._file = open(path, "a")
+
+    def mark(self, batch_number):
+        with self._lock:
+            self._file.write(f"{batch_number}\n")
+            self._file.flush()
+            self.done.add(batch_number)
+
+    def close(self):
+        self._file.close()
+
+
+# --- Upload ---
+class _Progress:
+    def __init__(self, total_docs, total_batches):
+        self.total_docs = total_docs
+        self.total_batches = total_batches
+        self.docs = 0
+        self.batches = 0
+        self.request_units = 0.0
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._lock = threading.Lock()
+
+    def add(self, n_docs, request_units):
+        with self._lock:
+            self.docs += n_docs
+            self.batches += 1
+            self.request_units += request_units
+
+    def report(self, throttle, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_SECONDS:
+            return
+        self._last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        print(f"  {self.docs}/{self.total_docs} docs, {self.batches}/{self.total_batches} batches | "
+              f"{self.docs / elapsed:.0f} docs/s, {self.request_units / elapsed:.0f} RU/s | "
+              f"{throttle.throttled_count} throttled | {elapsed:.0f}s")
+
+
+def _write_batch(container, partition_key, docs, throttle, max_retries=10):
+    """
+    Upsert one partition batch (transactional batch, or a single upsert for a
+    lone document), retrying throttled requests. Returns the RU charge.
+    """
+    charge = {}
+
+    def hook(headers, _):
+        charge["ru"] = float(headers.get("x-ms-request-charge", 0) or 0)
+
+    for attempt in range(max_retries + 1):
+        throttle.wait()
+        try:
+            if len(docs) == 1:
+                container.upsert_item(docs[0], response_hook=hook)
+            else:
+                container.execute_item_batch(
+                    [("upsert", (doc,)) for doc in docs], partition_key=partition_key, response_hook=hook
+                )
+            throttle.succeeded()
+            return charge.get("ru", 0.0)
+        except exceptions.CosmosHttpResponseError as e:
+            if e.status_code == 429 and attempt < max_retries:
+                throttle.throttled(_retry_after_seconds(e))
+                continue
+            if e.status_code == 413 and len(docs) > 1:
+                # Batch payload too large: split it
+                half = len(docs) // 2
+                return (_write_batch(container, partition_key, docs[:half], throttle, max_retries)
+                        + _write_batch(container, partition_key, docs[half:], throttle, max_retries))
+            raise
+
+
+def bulk_upload(container_name, df, id_field, partition_key_field, max_workers=MAX_WORKERS,
+                checkpoint_path=None):
+    """
+    Upsert a DataFrame into a container with partition-grouped transactional
+    batches written concurrently from a thread pool.
+
+    Args:
+        container_name (str): Target container.
+        df (pd.DataFrame): One document per row.
+        id_field (str): Column used as document id.
+        partition_key_field (str): Column holding the container's partition key.
+        max_workers (int): Concurrent requests.
+        checkpoint_path (Optional[str]): Progress file enabling resume
+            (default: CHECKPOINT_DIR/<container>.ckpt).
+    """
+    db = get_database()
     container = db.get_container_client(container_name)
 
-    for _, row in df.iterrows():
-        item = row.to_dict()
-        item["id"] = str(item[id_field])
-        container.upsert_item(item)
+    batches = partition_batches(to_documents(df, id_field), partition_key_field)
+    checkpoint = Checkpoint(checkpoint_path or os.path.join(CHECKPOINT_DIR, f"{container_name}.ckpt"),
+                            plan_fingerprint(container_name, batches))
+    pending = [n for n in range(len(batches)) if n not in checkpoint.done]
+    if checkpoint.done:
+        print(f"Resuming: {len(checkpoint.done)} of {len(batches)} batches already uploaded.")
+
+    throttle = AdaptiveThrottle()
+    progress = _Progress(sum(len(batches[n][1]) for n in pending), len(pending))
+
+    def run(n):
+        partition_key, docs = batches[n]
+        request_units = _write_batch(container, partition_key, docs, throttle)
+        checkpoint.mark(n)
+        progress.add(len(docs), request_units)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            in_flight = set()
+            for n in pending:
+                # Bounded submission keeps memory flat on large datasets
+                if len(in_flight) >= max_workers * 4:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                    progress.report(throttle)
+                in_flight.add(pool.submit(run, n))
+            for future in in_flight:
+                future.result()
+    finally:
+        checkpoint.close()
+        progress.report(throttle, force=True)
     print("Upload complete.")
 
-clicks_container = database.create_container_if_not_exists(
-    id=CLICKS_CONTAINER,
-    partition_key=PartitionKey(path="/user_id")
-)
-clicks_df = pd.read_csv('dataset/clicks_sample.csv')
-clicks_df['id'] = (
-    clicks_df['user_id'].astype(str)
-    + '-' +
-    clicks_df['session_id'].astype(str)
-    + '-' +
-    clicks_df['click_timestamp'].astype(str)
-)
-print("Clicks : uploading", clicks_df.shape[0], "rows and", clicks_df.shape[1], "columns...")
-print(clicks_df.head())
-upload(CLICKS_CONTAINER, clicks_df, id_field='id')
-
-
-# --- ARTICLES : run upload ---
-articles_container = database.create_container_if_not_exists(
-    id=ARTICLES_CONTAINER,
-    partition_key=PartitionKey(path="/article_id")
-)
-articles_df = pd.read_csv('dataset/articles_metadata.csv').drop(columns=['publisher_id']).drop_duplicates(subset='article_id')
-articles_df = articles_df.loc[articles_df['article_id'].isin(clicks_df['click_article_id'])]
-print("Articles : uploading", articles_df.shape[0], "rows and", articles_df.shape[1], "columns...")
-upload(ARTICLES_CONTAINER, articles_df, id_field='article_id')
-exit()
 
+# --- Datasets ---
+def load_clicks(path="dataset/clicks_sample.csv"):
+    clicks_df = pd.read_csv(path)
+    clicks_df['id'] = (
+        clicks_df['user_id'].astype(str)
+        + '-' +
+        clicks_df['session_id'].astype(str)
+        + '-' +
+        clicks_df['click_timestamp'].astype(str)
+    )
+    return clicks_df
+
+
+def load_articles(clicks_df, path="dataset/articles_metadata.csv"):
+    articles_df = pd.read_csv(path).drop(columns=['publisher_id']).drop_duplicates(subset='article_id')
+    return articles_df.loc[articles_df['article_id'].isin(clicks_df['click_article_id'])]
+
+
+def main(clicks_path="dataset/clicks_sample.csv", articles_path="dataset/articles_metadata.csv",
+         max_workers=MAX_WORKERS, reset=False):
+    database = get_database()
+    if reset:
+        for name in (CLICKS_CONTAINER, ARTICLES_CONTAINER):
+            path = os.path.join(CHECKPOINT_DIR, f"{name}.ckpt")
+            if os.path.exists(path):
+                os.remove(path)
+
+    # --- CLICKS : run upload ---
+    database.create_container_if_not_exists(
+        id=CLICKS_CONTAINER,
+        partition_key=PartitionKey(path="/user_id")
+    )
+    clicks_df = load_clicks(clicks_path)
+    print("Clicks : uploading", clicks_df.shape[0], "rows and", clicks_df.shape[1], "columns...")
+    print(clicks_df.head())
+    bulk_upload(CLICKS_CONTAINER, clicks_df, id_field='id', partition_key_field='user_id', max_workers=max_workers)
+
+    # --- ARTICLES : run upload ---
+    database.create_container_if_not_exists(
+        id=ARTICLES_CONTAINER,
+        partition_key=PartitionKey(path="/article_id")
+    )
+    articles_df = load_articles(clicks_df, articles_path)
+    print("Articles : uploading", articles_df.shape[0], "rows and", articles_df.shape[1], "columns...")
+    bulk_upload(ARTICLES_CONTAINER, articles_df, id_field='article_id', partition_key_field='article_id',
+                max_workers=max_workers)
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load clicks and articles into Cosmos DB.")
+    parser.add_argument("--clicks", default="dataset/clicks_sample.csv")
+    parser.add_argument("--articles", default="dataset/articles_metadata.csv")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--reset", action="store_true", help="Ignore checkpoints and upload everything again.")
+    args = parser.parse_args()
 
+    main(args.clicks, args.articles, args.workers, args.reset)
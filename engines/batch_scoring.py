@@ -0,0 +1,279 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from engines.covisitation_engine import N_RECENT
+from engines.hybrid_engine import COVISITATION_SCORE, SCORES, blend_weights
+
+# Column order of weight_matrix
+BLEND_SCORES = SCORES + [COVISITATION_SCORE]
+
+
+# -------------------------------------------------------------------------
+# Array preparation
+# -------------------------------------------------------------------------
+
+def build_scoring_arrays(scores: pd.DataFrame, clicks: pd.DataFrame, embeddings: np.ndarray,
+                         factors: Dict[str, np.ndarray],
+                         covisitation: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+    """
+    Align every score source on one article index (the catalogue of `scores`,
+    sorted by article_id) and pack user histories as CSR-style arrays, so that
+    many users can be scored with matrix products.
+
+    Args:
+        scores (pd.DataFrame): [article_id, freshness_score, popularity_score].
+        clicks (pd.DataFrame): [user_id, click_article_id, click_timestamp, ...].
+        embeddings (np.ndarray): Raw article embeddings indexed by article_id.
+        factors (Dict[str, np.ndarray]): CF factors (see svd_engine.factors_from_artifact).
+        covisitation (Optional[Dict[str, np.ndarray]]): Lookup arrays of the co-visitation
+            engine (covisitation_engine.serving_arrays), when it is part of the blend.
+
+    Returns:
+        Dict[str, np.ndarray]: Numeric arrays only (shareable through engines.shared_arrays).
+    """
+    scores = scores.sort_values(by="article_id")
+    article_ids = scores["article_id"].to_numpy(dtype=np.int64)
+
+    # CF item side, restricted to the catalogue; unknown items get zero factors and are masked
+    order = np.argsort(factors["item_ids"], kind="stable")
+    sorted_items = factors["item_ids"][order]
+    pos = np.minimum(np.searchsorted(sorted_items, article_ids), max(len(sorted_items) - 1, 0))
+    known = sorted_items[pos] == article_ids if len(sorted_items) else np.zeros(len(article_ids), dtype=bool)
+    item_inner = np.where(known, order[pos], 0)
+    item_factors = np.where(known[:, None], factors["item_factors"][item_inner], 0.0).astype(np.float32)
+    item_bias = np.where(known, factors["item_bias"][item_inner], 0.0).astype(np.float32)
+
+    # User histories in click order, as catalogue positions (-1 when outside the catalogue)
+    clicks = clicks.sort_values(by=["user_id", "click_timestamp"], kind="stable")
+    user_ids, counts = np.unique(clicks["user_id"].to_numpy(dtype=np.int64), return_counts=True)
+    clicked = clicks["click_article_id"].to_numpy(dtype=np.int64)
+    hist_pos = np.searchsorted(article_ids, clicked)
+    hist_pos = np.where(
+        (hist_pos < len(article_ids)) & (article_ids[np.minimum(hist_pos, len(article_ids) - 1)] == clicked),
+        hist_pos, -1
+    )
+    hist_indptr = np.concatenate([[0], np.cumsum(counts)])
+    last_pos = hist_pos[hist_indptr[1:] - 1]
+
+    user_order = np.argsort(factors["user_ids"], kind="stable")
+    sorted_users = factors["user_ids"][user_order]
+    upos = np.minimum(np.searchsorted(sorted_users, user_ids), max(len(sorted_users) - 1, 0))
+    user_known = sorted_users[upos] == user_ids if len(sorted_users) else np.zeros(len(user_ids), dtype=bool)
+    user_inner = np.where(user_known, user_order[upos], -1)
+
+    arrays = {
+        "article_ids": article_ids,
+        "freshness": scores["freshness_score"].to_numpy(dtype=np.float32),
+        "popularity": scores["popularity_score"].to_numpy(dtype=np.float32),
+        "embeddings": normalize(np.asarray(embeddings)[article_ids], axis=1).astype(np.float32),
+        "item_known": known,
+        "item_factors": item_factors,
+        "item_bias": item_bias,
+        "global_mean": np.asarray(factors["global_mean"], dtype=np.float64),
+        "rating_scale": np.asarray(factors["rating_scale"], dtype=np.float64),
+        "user_factors": np.asarray(factors["user_factors"], dtype=np.float32),
+        "user_bias": np.asarray(factors["user_bias"], dtype=np.float32),
+        "user_ids": user_ids,
+        "user_inner": user_inner,
+        "hist_indptr": hist_indptr,
+        "hist_pos": hist_pos,
+        "last_pos": last_pos,
+    }
+    if covisitation is not None:
+        arrays.update(_covisitation_arrays(covisitation, article_ids, clicked))
+    return arrays
+
+
+def _covisitation_arrays(covisitation, article_ids, clicked):
+    # Co-visitation rows over its own article index, which may reach beyond the catalogue:
+    # the served engine scales scores by their maximum over all its candidates
+    item_ids = covisitation["item_ids"]
+    hist_cv = np.searchsorted(item_ids, clicked)
+    inside = (hist_cv < len(item_ids)) & (item_ids[np.minimum(hist_cv, max(len(item_ids) - 1, 0))] == clicked)
+    catalogue_pos = np.searchsorted(article_ids, item_ids)
+    in_catalogue = (catalogue_pos < len(article_ids)) & (
+        article_ids[np.minimum(catalogue_pos, len(article_ids) - 1)] == item_ids
+    )
+    return {
+        "hist_ids": clicked,
+        "hist_cv": np.where(inside, hist_cv, -1),
+        "cv_indptr": covisitation["indptr"],
+        "cv_indices": np.searchsorted(item_ids, covisitation["neighbor_ids"]),
+        "cv_weights": covisitation["weights"],
+        "cv_catalogue_pos": np.where(in_catalogue, catalogue_pos, -1),
+    }
+
+
+# -------------------------------------------------------------------------
+# Vectorized scoring
+# -------------------------------------------------------------------------
+
+def seen_matrix(arrays, start: int, stop: int) -> np.ndarray:
+    """Boolean (users x catalogue) matrix of already clicked articles."""
+    indptr = arrays["hist_indptr"][start:stop + 1]
+    pos = arrays["hist_pos"][indptr[0]:indptr[-1]]
+    rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+    seen = np.zeros((stop - start, len(arrays["article_ids"])), dtype=bool)
+    inside = pos >= 0
+    seen[rows[inside], pos[inside]] = True
+    return seen
+
+
+def cf_scores(arrays, start: int, stop: int, seen: np.ndarray) -> np.ndarray:
+    """
+    Min-max normalized CF scores (users x catalogue) of users[start:stop] over
+    their unseen known candidates, 0 elsewhere (the hybrid blend skips NaN),
+    as in SVDRecommendationEngine.recommend_for_user.
+    """
+    inner = arrays["user_inner"][start:stop]
+    est = np.broadcast_to(
+        arrays["global_mean"][0] + arrays["item_bias"], (stop - start, len(arrays["article_ids"]))
+    ).astype(np.float32)
+    known_users = inner >= 0
+    if known_users.any():
+        rows = inner[known_users]
+        est[known_users] += (
+            arrays["user_bias"][rows][:, None]
+            + arrays["user_factors"][rows] @ arrays["item_factors"].T
+        )
+    np.clip(est, *arrays["rating_scale"], out=est)
+
+    valid = arrays["item_known"][None, :] & ~seen
+    lo = np.where(valid, est, np.inf).min(axis=1, keepdims=True)
+    hi = np.where(valid, est, -np.inf).max(axis=1, keepdims=True)
+    span = hi - lo
+    with np.errstate(invalid="ignore", divide="ignore"):
+        norm = np.where(span > 0, (est - lo) / span, 0.0)
+    return np.where(valid, norm, 0.0).astype(np.float32)
+
+
+def content_scores(arrays, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cosine similarity to each user's last clicked article, mapped to [0, 1]
+    with the article itself set to -1, as in ContentBasedRecommendationEngine.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: scores (users x catalogue), and whether
+        the user's last click is in the catalogue (the CB column exists).
+    """
+    last = arrays["last_pos"][start:stop]
+    has_last = last >= 0
+    embeddings = arrays["embeddings"]
+    sims = np.zeros((stop - start, len(arrays["article_ids"])), dtype=np.float32)
+    if has_last.any():
+        rows = np.flatnonzero(has_last)
+        sims[rows] = (embeddings[last[rows]] @ embeddings.T + 1) / 2
+        sims[rows, last[rows]] = -1.0
+    return sims, has_last
+
+
+def covisitation_scores(arrays, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Co-visitation scores (users x catalogue) of users[start:stop], as in
+    CovisitationRecommendationEngine.scores: rows of the last N_RECENT
+    distinct clicks weighted 1, 1/2, 1/3..., clicked articles excluded,
+    scaled to a maximum of 1 and 0 where an article has no score.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: scores, and whether the user has any
+        co-visitation score (the CV column exists).
+    """
+    indptr = arrays["hist_indptr"][start:stop + 1]
+    n_users, n_cv = stop - start, len(arrays["cv_indptr"]) - 1
+    rows = np.repeat(np.arange(n_users), np.diff(indptr))
+    clicked = arrays["hist_ids"][indptr[0]:indptr[-1]]
+    hist_cv = arrays["hist_cv"][indptr[0]:indptr[-1]]
+    order = np.arange(len(rows))
+
+    # Most recent click of each (user, article), then each user's distinct articles, most recent first
+    by_article = np.lexsort((-order, clicked, rows))
+    first = np.ones(len(by_article), dtype=bool)
+    first[1:] = (np.diff(rows[by_article]) != 0) | (np.diff(clicked[by_article]) != 0)
+    recent = by_article[first]
+    recent = recent[np.lexsort((-recent, rows[recent]))]
+    rank = np.arange(len(recent)) - np.searchsorted(rows[recent], rows[recent])
+    recent, rank = recent[rank < N_RECENT], rank[rank < N_RECENT]
+    known = hist_cv[recent] >= 0
+
+    query = sp.csr_matrix((1.0 / (rank[known] + 1), (rows[recent[known]], hist_cv[recent[known]])),
+                          shape=(n_users, n_cv))
+    matrix = sp.csr_matrix((arrays["cv_weights"], arrays["cv_indices"], arrays["cv_indptr"]), shape=(n_cv, n_cv))
+    scores = (query @ matrix).toarray()
+    scores[rows[hist_cv >= 0], hist_cv[hist_cv >= 0]] = 0.0
+    top = scores.max(axis=1, initial=0.0)
+    has_cv = top > 0
+    scores[has_cv] /= top[has_cv, None]
+
+    cv = np.zeros((n_users, len(arrays["article_ids"])), dtype=np.float32)
+    inside = arrays["cv_catalogue_pos"] >= 0
+    cv[:, arrays["cv_catalogue_pos"][inside]] = scores[:, inside]
+    return cv, has_cv
+
+
+def weight_matrix(history_sizes: np.ndarray, has_cb: np.ndarray, has_cf: np.ndarray | None = None,
+                  has_cv: np.ndarray | None = None, weights=blend_weights) -> np.ndarray:
+    """
+    Per-user blend weights (users x 5, in BLEND_SCORES order). Sources a user
+    has no column for are zeroed and the rest renormalized, like the hybrid
+    blend; without `has_cv` co-visitation is not blended (no CovisitationFile).
+    `weights` maps a history size to {score: weight} (hybrid_engine.blend_weights).
+    """
+    sizes, inverse = np.unique(history_sizes, return_inverse=True)
+    table = np.array([[weights(int(n)).get(k, 0.0) for k in BLEND_SCORES] for n in sizes])
+    w = table[inverse]
+    w[:, BLEND_SCORES.index("cb_score")] *= has_cb
+    if has_cf is not None:
+        w[:, BLEND_SCORES.index("cf_score")] *= has_cf
+    w[:, BLEND_SCORES.index(COVISITATION_SCORE)] *= has_cv if has_cv is not None else 0.0
+    total = w.sum(axis=1, keepdims=True)
+    return np.divide(w, total, out=np.zeros_like(w), where=total > 0)
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise top-k (descending) with argpartition: O(n) per row plus k log k.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: column indices and scores, both (rows x k).
+    """
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def score_users(arrays, start: int, stop: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Blend freshness, popularity, content, CF and (when the arrays have it)
+    co-visitation scores for users[start:stop] and keep each user's top-k
+    among the articles they have not clicked yet.
+    Users with fewer than k unseen articles get padded rows (article id -1,
+    score NaN) rather than articles they already clicked.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: article ids (int64) and overall scores (float32), (users x k).
+    """
+    seen = seen_matrix(arrays, start, stop)
+    cf = cf_scores(arrays, start, stop, seen)
+    cb, has_cb = content_scores(arrays, start, stop)
+    cv, has_cv = covisitation_scores(arrays, start, stop) if "cv_indptr" in arrays else (None, None)
+    w = weight_matrix(np.diff(arrays["hist_indptr"][start:stop + 1]), has_cb, has_cv=has_cv).astype(np.float32)
+
+    overall = (
+        w[:, [0]] * arrays["freshness"][None, :]
+        + w[:, [1]] * arrays["popularity"][None, :]
+        + w[:, [2]] * cb
+        + w[:, [3]] * cf
+    )
+    if cv is not None:
+        overall += w[:, [4]] * cv
+    overall[seen] = -np.inf
+    idx, top = top_k(overall, k)
+    # Seen articles only reach the top-k as -inf fillers
+    unseen = np.isfinite(top)
+    return np.where(unseen, arrays["article_ids"][idx], -1), np.where(unseen, top, np.nan).astype(np.float32)
@@ -0,0 +1,60 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+def align(catalogue: np.ndarray, ids: np.ndarray, values: np.ndarray, fill: float = np.nan) -> np.ndarray:
+    """Scatter (ids, values) onto the sorted catalogue; `fill` where an article has no value."""
+    if len(ids) == len(catalogue) and np.array_equal(ids, catalogue):
+        return np.asarray(values, dtype=np.float64)
+    column = np.full(len(catalogue), fill)
+    if len(ids) and len(catalogue):
+        pos = np.minimum(np.searchsorted(catalogue, ids), len(catalogue) - 1)
+        found = catalogue[pos] == ids
+        column[pos[found]] = values[found]
+    return column
+
+
+def seen_mask(catalogue: np.ndarray, history) -> np.ndarray:
+    """
+    Boolean mask over the sorted catalogue, True at the articles of `history`
+    (clicked ids, any order; ids outside the catalogue are ignored).
+    """
+    mask = np.zeros(len(catalogue), dtype=bool)
+    history = np.asarray(history, dtype=np.int64)
+    if len(history) and len(catalogue):
+        pos = np.minimum(np.searchsorted(catalogue, history), len(catalogue) - 1)
+        mask[pos[catalogue[pos] == history]] = True
+    return mask
+
+
+def normalized_weights(weights: Dict[str, float], names) -> Dict[str, float]:
+    """Weights of the sources in `names`, renormalized to sum to 1 (when any is positive)."""
+    weights = {k: v for k, v in weights.items() if k in names}
+    w = np.array(list(weights.values()))
+    if w.sum() > 0:
+        w = w / w.sum()
+    return dict(zip(weights, w))
+
+
+def weighted_top(columns: Dict[str, np.ndarray], weights: Dict[str, float], n: int,
+                 exclude: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted sum of the score columns (missing values count as 0) and the
+    positions of its n best entries, skipping those set in `exclude`.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Top positions (best first, ties in
+        position order) and the overall score of every position.
+    """
+    length = len(next(iter(columns.values()))) if columns else 0
+    overall = np.zeros(length)
+    for k, wk in weights.items():
+        overall += wk * np.nan_to_num(columns[k])
+
+    candidates = np.flatnonzero(~exclude) if exclude is not None else np.arange(length)
+    n = min(n, len(candidates))
+    if n == 0:
+        return candidates[:0], overall
+    top = candidates[np.argpartition(-overall[candidates], n - 1)[:n]]
+    return top[np.lexsort((top, -overall[top]))], overall
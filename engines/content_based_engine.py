@@ -6,8 +6,10 @@ import numpy as np
 import pandas as pd
 from sklearn.preprocessing import normalize
 
-from azure_helpers.blob_utils import load_model_from_blob_storage
+from azure_helpers.blob_utils import get_blob_etag, load_model_from_blob_storage
 import azure_helpers.data_loading as db
+from engines.shared_arrays import SHARED_ARRAYS_ENABLED, cache_key, load_or_publish
+from function_app_memory import footprint
 
 
 class ContentBasedRecommendationEngine:
@@ -21,15 +23,10 @@ class ContentBasedRecommendationEngine:
         Initialize the recommendation engine by loading article embeddings and metadata.
         """
         logging.info("Initializing ContentBasedRecommendationEngine...")
-        try:
-            if storage_mode == 'blob':
-                embeddings = load_model_from_blob_storage(blob_name=embeddings_path)
-            else:
-                raise
-        except:
+        if storage_mode != 'blob':
             logging.error("Copuld not load embeddings.")
             raise FileNotFoundError("Embeddings file not found or path not set.")
-        
+
         try:
             available_articles = (
                 db.get_all_articles()["article_id"]
@@ -43,26 +40,107 @@ class ContentBasedRecommendationEngine:
         except Exception as e:
             logging.error("No articles found in database query result.")
             raise
-        
+
+        self.article_ids = np.array(available_articles)
+        self.article_ids_to_index = {aid: idx for idx, aid in enumerate(self.article_ids)}
+
+        def build():
+            return {"embeddings": self.__load_embeddings(embeddings_path, available_articles)}
+
+        self.embeddings = None
+        if SHARED_ARRAYS_ENABLED:
+            try:
+                # Versioned by blob ETag and article set: every worker process maps the same pages
+                key = cache_key("embeddings", embeddings_path, get_blob_etag(embeddings_path), self.article_ids)
+                self.embeddings = load_or_publish(key, build)["embeddings"]
+            except OSError as e:
+                logging.warning("Shared embeddings unavailable, loading privately: %s", e)
+        if self.embeddings is None:
+            self.embeddings = build()["embeddings"]
+
+    @staticmethod
+    def __load_embeddings(embeddings_path, available_articles):
+        try:
+            embeddings = load_model_from_blob_storage(blob_name=embeddings_path)
+        except:
+            logging.error("Copuld not load embeddings.")
+            raise FileNotFoundError("Embeddings file not found or path not set.")
+
         try:
             embeddings = embeddings[available_articles]
-            self.article_ids = np.array(available_articles)
-            self.article_ids_to_index = {aid: idx for idx, aid in enumerate(self.article_ids)}
         except Exception as e:
             logging.exception("Error filtering embeddings: %s", e)
             raise
 
         try:
             # Normalize embeddings once for cosine similarity via dot product
-            self.embeddings = normalize(embeddings, axis=1)
+            return normalize(embeddings, axis=1)
         except Exception as e:
             logging.exception("Error normalizing embeddings: %s", e)
             raise
 
+    def memory_footprint(self) -> dict:
+        """Resident size of the embeddings and id index (see function_app_memory.footprint)."""
+        return footprint(
+            embeddings=self.embeddings, article_ids=self.article_ids, article_ids_to_index=self.article_ids_to_index
+        )
+
     # -------------------------------------------------------------------------
     # Recommendation Logic
     # -------------------------------------------------------------------------
 
+    def query_vector(self, article_id: int) -> Optional[np.ndarray]:
+        """Unit-norm embedding of an article, or None if it is not indexed."""
+        if article_id not in self.article_ids_to_index:
+            logging.warning("Article ID %s not found in embeddings index.", article_id)
+            return None
+        q = self.embeddings[self.article_ids_to_index[article_id]]
+        return q / np.linalg.norm(q)  # re-normalize query just in case
+
+    def similarities(self, article_id: int) -> Optional[np.ndarray]:
+        """
+        Similarity of every article of `self.article_ids` to the given one,
+        mapped to [0, 1], with the article itself at -1. None if unknown.
+        """
+        q = self.query_vector(article_id)
+        if q is None:
+            return None
+
+        try:
+            article_idx = self.article_ids_to_index[article_id]
+            sims = self.embeddings @ q  # cosine similarity since pre-normalized
+
+            # Map cosine similarity [-1, 1] → [0, 1]
+            sims = (sims + 1) / 2
+            sims[article_idx] = -1.0  # exclude the article itself
+            return sims
+
+        except Exception as e:
+            logging.exception("Error computing similarities for article %s: %s", article_id, e)
+            raise
+
+    def similarities_batch(self, article_ids: List[int]) -> List[Optional[np.ndarray]]:
+        """
+        `similarities` of several articles with one matrix-matrix product
+        (engines.micro_batcher). Rows are views of the batch result.
+        """
+        queries = [self.query_vector(article_id) for article_id in article_ids]
+        known = [i for i, q in enumerate(queries) if q is not None]
+        results = [None] * len(article_ids)
+        if not known:
+            return results
+
+        try:
+            sims = (np.stack([queries[i] for i in known]) @ self.embeddings.T + 1) / 2
+            for row, i in enumerate(known):
+                sims[row, self.article_ids_to_index[article_ids[i]]] = -1.0  # exclude the article itself
+                results[i] = sims[row]
+            return results
+
+        except Exception as e:
+            logging.exception("Error computing similarities for %d articles: %s", len(article_ids), e)
+            raise
+
     def recommend(self, article_id: int, n_recs: Optional[int] = None) -> List[Tuple[int, float]]:
         """
         Recommend articles similar to the given one, based on cosine similarity.
@@ -74,20 +152,11 @@ class ContentBasedRecommendationEngine:
         Returns:
             List[Tuple[int, float]]: [(recommended_article_id, similarity_score), ...]
         """
-        if article_id not in self.article_ids_to_index:
-            logging.warning("Article ID %s not found in embeddings index.", article_id)
+        sims = self.similarities(article_id)
+        if sims is None:
             return []
 
         try:
-            article_idx = self.article_ids_to_index[article_id]
-            q = self.embeddings[article_idx]
-            q = q / np.linalg.norm(q)  # re-normalize query just in case
-            sims = self.embeddings @ q  # cosine similarity since pre-normalized
-
-            # Map cosine similarity [-1, 1] → [0, 1]
-            sims = (sims + 1) / 2
-            sims[article_idx] = -1.0  # exclude the article itself
-
             # Sort and select top results
             sorted_idx = np.argsort(-sims)
             if n_recs is not None:
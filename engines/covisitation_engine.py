@@ -0,0 +1,261 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from azure_helpers.blob_utils import get_blob_etag, load_model_from_blob_storage
+from engines.shared_arrays import SHARED_ARRAYS_ENABLED, cache_key, load_or_publish
+from function_app_logging import get_logger
+from function_app_memory import footprint
+logger = get_logger("covisitation_engine")
+
+# Most recent distinct clicks whose co-visitation rows are summed
+N_RECENT = 5
+
+
+# -------------------------------------------------------------------------
+# Co-visitation matrix
+# -------------------------------------------------------------------------
+
+def prune_rows(matrix: sp.csr_matrix, top_k: int) -> sp.csr_matrix:
+    """Keep the `top_k` largest entries of every row (ties broken by column)."""
+    matrix = matrix.tocsr()
+    matrix.eliminate_zeros()
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((matrix.indices, -matrix.data, rows))
+    rank = np.arange(len(order)) - matrix.indptr[rows[order]]
+    keep = np.sort(order[rank < top_k])
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=matrix.shape[0]))])
+    return sp.csr_matrix((matrix.data[keep], matrix.indices[keep], indptr), shape=matrix.shape)
+
+
+def _session_matrix(clicks: pd.DataFrame, item_ids: np.ndarray) -> sp.csr_matrix:
+    # Binary sessions x items matrix: an article counts once per session
+    sessions = pd.MultiIndex.from_frame(clicks[["user_id", "session_id"]]).factorize()[0]
+    items = np.searchsorted(item_ids, clicks["click_article_id"].to_numpy(dtype=np.int64))
+    matrix = sp.csr_matrix(
+        (np.ones(len(items), dtype=np.float32), (sessions, items)),
+        shape=(int(sessions.max()) + 1 if len(sessions) else 0, len(item_ids)),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return matrix
+
+
+def _co_counts(sessions: sp.csr_matrix, top_k: Optional[int], block_size: int) -> sp.csr_matrix:
+    # items x items co-occurrence, built by row blocks so the unpruned product never exists in full
+    by_item = sessions.T.tocsr()
+    blocks = []
+    for start in range(0, by_item.shape[0], block_size):
+        block = (by_item[start:start + block_size] @ sessions).tocoo()
+        off_diagonal = block.row + start != block.col
+        block = sp.csr_matrix(
+            (block.data[off_diagonal], (block.row[off_diagonal], block.col[off_diagonal])), shape=block.shape
+        )
+        blocks.append(prune_rows(block, top_k) if top_k else block)
+    return sp.vstack(blocks, format="csr") if blocks else sp.csr_matrix((0, 0), dtype=np.float32)
+
+
+def build_covisitation(clicks: pd.DataFrame, top_k: Optional[int] = 50, block_size: int = 20_000) -> Dict[str, np.ndarray]:
+    """
+    Item x item co-click counts from sessions, pruned to the `top_k` strongest
+    neighbours of each article.
+
+    Two articles co-occur once per (user_id, session_id) in which both were
+    clicked. Counts are raw; the engine normalizes them at load time.
+
+    Args:
+        clicks (pd.DataFrame): [user_id, session_id, click_article_id, ...].
+        top_k (Optional[int]): Neighbours kept per article (None = all).
+        block_size (int): Articles per block of the sparse product.
+
+    Returns:
+        Dict[str, np.ndarray]: item_ids (sorted), item_counts (sessions per
+        article), and the CSR arrays indptr, indices (positions in item_ids), counts.
+    """
+    item_ids = np.unique(clicks["click_article_id"].to_numpy(dtype=np.int64))
+    sessions = _session_matrix(clicks, item_ids)
+    co = _co_counts(sessions, top_k, block_size)
+    logger.info("Built co-visitation of %d articles from %d sessions (%d pairs kept).",
+                len(item_ids), sessions.shape[0], co.nnz)
+    return {
+        "item_ids": item_ids,
+        "item_counts": np.asarray(sessions.sum(axis=0)).ravel().astype(np.int64),
+        "indptr": co.indptr.astype(np.int64),
+        "indices": co.indices.astype(np.int32),
+        "counts": co.data.astype(np.float32),
+    }
+
+
+def update_covisitation(covisitation: Dict[str, np.ndarray], new_clicks: pd.DataFrame, top_k: int = 50,
+                        decay: float = 1.0, block_size: int = 20_000) -> Dict[str, np.ndarray]:
+    """
+    Add the sessions of `new_clicks` to an existing co-visitation matrix.
+
+    Previous counts (optionally multiplied by `decay`) and the new sessions'
+    counts are summed over the union of articles, then every row is pruned
+    back to `top_k`. Pairs pruned earlier restart from the new counts only,
+    so the result approximates a full rebuild, closely for the strong pairs
+    that matter for ranking. Sessions must not straddle the two click sets.
+    """
+    delta = build_covisitation(new_clicks, top_k=None, block_size=block_size)
+    item_ids = np.union1d(covisitation["item_ids"], delta["item_ids"])
+
+    def remapped(arrays, scale):
+        position = np.searchsorted(item_ids, arrays["item_ids"])
+        n = len(arrays["item_ids"])
+        matrix = sp.csr_matrix((arrays["counts"] * scale, arrays["indices"], arrays["indptr"]), shape=(n, n)).tocoo()
+        counts = np.zeros(len(item_ids), dtype=np.float64)
+        counts[position] = arrays["item_counts"] * scale
+        return sp.csr_matrix(
+            (matrix.data, (position[matrix.row], position[matrix.col])), shape=(len(item_ids), len(item_ids))
+        ), counts
+
+    old, old_counts = remapped(covisitation, decay)
+    new, new_counts = remapped(delta, 1.0)
+    co = prune_rows(old + new, top_k)
+    logger.info("Updated co-visitation with %d clicks: %d articles (%d new), %d pairs kept.",
+                len(new_clicks), len(item_ids), len(item_ids) - len(covisitation["item_ids"]), co.nnz)
+    return {
+        "item_ids": item_ids,
+        "item_counts": np.rint(old_counts + new_counts).astype(np.int64),
+        "indptr": co.indptr.astype(np.int64),
+        "indices": co.indices.astype(np.int32),
+        "counts": co.data.astype(np.float32),
+    }
+
+
+def serving_arrays(covisitation: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Lookup arrays of the engine: raw neighbour ids and weights
+    count(i, j) / sqrt(count(i) * count(j)), so popular articles do not
+    dominate every row.
+    """
+    indptr = covisitation["indptr"]
+    indices = covisitation["indices"]
+    item_counts = covisitation["item_counts"].astype(np.float64)
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = covisitation["counts"] / np.sqrt(item_counts[rows] * item_counts[indices])
+    return {
+        "item_ids": covisitation["item_ids"],
+        "indptr": indptr,
+        "neighbor_ids": covisitation["item_ids"][indices],
+        "weights": np.nan_to_num(weights, nan=0.0, posinf=0.0).astype(np.float32),
+    }
+
+
+# -------------------------------------------------------------------------
+# Engine
+# -------------------------------------------------------------------------
+
+class CovisitationRecommendationEngine:
+    """
+    Item-to-item recommender over session co-clicks. Scores are sums of the
+    co-visitation rows of the user's most recent clicks, so a request costs a
+    few hundred array reads whatever the catalogue size.
+    """
+
+    def __init__(self, model_path, storage_mode='blob', n_recent: int = N_RECENT):
+        logger.info("Initializing CovisitationRecommendationEngine... Loading matrix.")
+        self.n_recent = n_recent
+        arrays = self._load_arrays(model_path, storage_mode)
+        self.item_ids = arrays["item_ids"]
+        self.indptr = arrays["indptr"]
+        self.neighbor_ids = arrays["neighbor_ids"]
+        self.weights = arrays["weights"]
+        logger.info("Loaded co-visitation of %d articles (%d pairs).", len(self.item_ids), len(self.weights))
+
+    def _load_arrays(self, file_path, storage_mode='blob'):
+        if storage_mode != 'blob':
+            raise ValueError(f"Unsupported storage mode: {storage_mode}")
+
+        def build():
+            try:
+                return serving_arrays(load_model_from_blob_storage(blob_name=file_path)["covisitation"])
+            except Exception as e:
+                logger.exception("Error loading co-visitation matrix from (%s) %s: %s", storage_mode, file_path, e)
+                raise
+
+        if SHARED_ARRAYS_ENABLED:
+            try:
+                return load_or_publish(cache_key("covisitation", file_path, get_blob_etag(file_path)), build)
+            except OSError as e:
+                logger.warning("Shared co-visitation unavailable, loading privately: %s", e)
+        return build()
+
+    def memory_footprint(self) -> dict:
+        """Resident size of the lookup arrays (see function_app_memory.footprint)."""
+        return footprint(item_ids=self.item_ids, indptr=self.indptr, neighbor_ids=self.neighbor_ids,
+                         weights=self.weights)
+
+    def neighbours(self, article_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Neighbour article ids and weights of one article (empty if unknown)."""
+        pos = np.searchsorted(self.item_ids, article_id)
+        if pos >= len(self.item_ids) or self.item_ids[pos] != article_id:
+            return self.neighbor_ids[:0], self.weights[:0]
+        start, stop = self.indptr[pos], self.indptr[pos + 1]
+        return self.neighbor_ids[start:stop], self.weights[start:stop]
+
+    # -------------------------------------------------------------------------
+    # Recommendation Logic
+    # -------------------------------------------------------------------------
+
+    def scores(self, history) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Co-visitation scores of the neighbours of the user's recent clicks.
+
+        The last `n_recent` distinct clicks contribute their rows, weighted
+        1, 1/2, 1/3... from the most recent one. Already clicked articles are
+        excluded; scores are scaled to a maximum of 1.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Article ids (sorted) and scores; empty if none.
+        """
+        history = np.asarray(history, dtype=np.int64)
+        empty = (self.item_ids[:0], np.empty(0))
+        if len(history) == 0:
+            return empty
+
+        # Most recent first, duplicates dropped
+        recent = history[::-1]
+        _, first = np.unique(recent, return_index=True)
+        recent = recent[np.sort(first)][:self.n_recent]
+
+        ids, weights = [], []
+        for rank, article_id in enumerate(recent.tolist()):
+            neighbor_ids, neighbor_weights = self.neighbours(article_id)
+            ids.append(neighbor_ids)
+            weights.append(neighbor_weights / (rank + 1))
+        ids, weights = np.concatenate(ids), np.concatenate(weights)
+        if len(ids) == 0:
+            return empty
+
+        candidates, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        unseen = ~np.isin(candidates, history)
+        candidates, scores = candidates[unseen], scores[unseen]
+        if len(scores) == 0 or scores.max() <= 0:
+            return empty
+        return candidates, scores / scores.max()
+
+    def recommend(self, history, n_recs: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Recommend articles co-clicked with the user's recent clicks (see `scores`).
+
+        Args:
+            history: Clicked article ids, in click order.
+            n_recs (Optional[int]): Number of recommendations to return (default: all).
+
+        Returns:
+            List[Tuple[int, float]]: (article_id, score in [0, 1]) sorted descending.
+        """
+        candidates, scores = self.scores(history)
+        if len(candidates) == 0:
+            return []
+
+        order = np.argsort(-scores, kind="stable")
+        if n_recs:
+            order = order[:n_recs]
+        return list(zip(candidates[order].tolist(), scores[order].tolist()))
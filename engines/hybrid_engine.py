@@ -1,29 +1,306 @@
+import contextvars
+import hashlib
 import logging
 import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 import numpy as np
 import pandas as pd
 
 import azure_helpers.data_loading as db
+from azure_helpers.blob_utils import get_blob_etag
+from engines.blend import align, normalized_weights, seen_mask, weighted_top
 from engines.content_based_engine import ContentBasedRecommendationEngine as ContentBased
+from engines.covisitation_engine import CovisitationRecommendationEngine as Covisitation
+from engines.micro_batcher import MicroBatcher
+from engines.ranked_list_cache import RankedListCache, decode_cursor, encode_cursor
+from engines.records_json import dumps, record_items
+from engines.sharded_scoring import ShardedScorer
+from engines.shared_arrays import SHARED_ARRAYS_ENABLED, cache_key
 from engines.svd_engine import SVDRecommendationEngine as SVDEngine
 
 from function_app_logging import get_logger
+import function_app_memory as memory
+from function_app_tracing import span, trace
 logger = get_logger("hybrid_engine")
 
+SCORES = ['freshness_score', 'popularity_score', 'cb_score', 'cf_score']
+# Blended only when a co-visitation matrix is configured (CovisitationFile)
+COVISITATION_SCORE = 'cv_score'
+COVISITATION_WEIGHT = float(os.getenv("CovisitationWeight", "0.3"))
+# Reload freshness/popularity scores after this many seconds (0 = never).
+SCORES_TTL_SECONDS = float(os.getenv("ArticleScoresTTLSeconds", "0"))
+# Pause before retrying a failed background reload of the scores.
+REFRESH_RETRY_SECONDS = 30.0
+# Default latency budget of a recommendation request (0 = unbounded).
+BUDGET_MS = float(os.getenv("RecommendationBudgetMs", "800"))
+STAGE_WORKERS = int(os.getenv("RecommendationStageWorkers", str(4 * (os.cpu_count() or 1))))
+# Length of the ranked list computed for paged requests (the deepest reachable page).
+PAGE_DEPTH = int(os.getenv("RecommendationPageDepth", "100"))
+# Ranked lists kept for follow-up pages, and for how long.
+PAGE_CACHE_SIZE = int(os.getenv("RankedListCacheSize", "512"))
+PAGE_CACHE_TTL_SECONDS = float(os.getenv("RankedListTTLSeconds", "120"))
+# Prefix of cursor tokens naming the fallback snapshot (by digest) instead of a cached list;
+# ranked-list cache tokens never contain a "."
+FALLBACK_TOKEN = "fallback."
+# Score the catalogue in this many worker processes, each owning an article id range (0/1 = in-process).
+CATALOGUE_SHARDS = int(os.getenv("CatalogueShards", "0"))
+# Content and CF queries arriving within this window are scored as one batch (0 = no batching).
+BATCH_WINDOW_MS = float(os.getenv("MicroBatchWindowMs", "0"))
+BATCH_MAX_SIZE = int(os.getenv("MicroBatchMaxSize", "32"))
+
+
+class Deadline:
+    """
+    Absolute point in time by which a request must be answered.
+    Based on time.monotonic(), so it stays valid across worker processes.
+    """
+
+    def __init__(self, budget_ms: float):
+        self.budget_ms = budget_ms
+        self.expires_at = time.monotonic() + budget_ms / 1000
+
+    @classmethod
+    def from_budget(cls, budget_ms: float | None = None) -> "Deadline | None":
+        budget_ms = BUDGET_MS if budget_ms is None else budget_ms
+        return cls(budget_ms) if budget_ms > 0 else None
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+def blend_weights(history_size: int) -> dict:
+    """
+    Blend weights of each score source for a user with `history_size` clicks.
+    CF weight grows with history (sigmoid centered on ~8 clicks); co-visitation
+    only needs the recent clicks, so it is flat from the first one. Sources
+    without a column in the blend are dropped and the rest renormalized.
+    """
+    if history_size > 0:
+        cf_weight = 1 / (1 + np.exp(-0.3*(history_size - 8)))  # grows after ~8 clicks
+    else :
+        cf_weight = 0.0
+
+    cb_weight = min(cf_weight + 0.2, 0.5)
+    fresh_pop = max(1 - cf_weight, 0.2)
+
+    cv_weight = COVISITATION_WEIGHT if history_size > 0 else 0.0
+
+    w = np.array([fresh_pop/2, fresh_pop/2, cb_weight, cf_weight, cv_weight])
+    w = w / w.sum()
+    return dict(zip(SCORES + [COVISITATION_SCORE], w))
+
+
+def _matches(etag: str | None, if_none_match) -> bool:
+    """Whether a client holding the entity tags `if_none_match` already has the answer tagged `etag`."""
+    return etag is not None and (etag in if_none_match or "*" in if_none_match)
+
+
+def _records(ranking) -> list:
+    """Record dicts of a ranking (article ids, score names, score rows) from the blend."""
+    article_ids, names, rows = ranking
+    keys = ['article_id'] + names
+    return [dict(zip(keys, [article_id] + row)) for article_id, row in zip(article_ids, rows)]
+
+
 class HybridRecommendationEngine():
-    def __init__(self, n_recs):
+    def __init__(self, n_recs, cache_histories: bool = True, batch_window_ms: float = BATCH_WINDOW_MS):
+        self.n_recs = n_recs
+        self.scores = SCORES
+        # False where clicks are recorded by another process (process executor workers):
+        # the in-process history store would never see them
+        self.cache_histories = cache_histories
+        sharded = CATALOGUE_SHARDS > 1
+        if sharded and not SHARED_ARRAYS_ENABLED:
+            raise ValueError("CatalogueShards requires SharedArraysEnabled: each shard maps the published arrays "
+                             "and copies only its slice.")
+
         logger.debug("Loading popularity and freshness...")
-        self.data = db.get_articles_scores()
+        self._scores_lock = threading.Lock()
+        self._scores_generation = 0
+        self._refresh_running = threading.Lock()
+        self._refresh_retry_at = 0.0
+        self._shards = None
+        with memory.track_startup("article_scores"):
+            self.refresh_scores()
 
-        logger.debug("Loading content-based engine...")
-        self.content_based_engine = ContentBased(embeddings_path=os.getenv("ArticlesEmbeddingsFile"), storage_mode='blob')
+        # Sharded: the shards own the embeddings and item factors, only user factors are read here
+        self.content_based_engine = None
+        if not sharded:
+            logger.debug("Loading content-based engine...")
+            with memory.track_startup("content_based"):
+                self.content_based_engine = ContentBased(embeddings_path=os.getenv("ArticlesEmbeddingsFile"), storage_mode='blob')
 
         logger.debug("Loading collaborative filtering SVD++ engine")
-        self.cf_engine = SVDEngine(model_path=os.getenv("SVDppModelFile"), storage_mode='blob')
-        self.n_recs = n_recs
+        with memory.track_startup("collaborative_filtering"):
+            self.cf_engine = SVDEngine(model_path=os.getenv("SVDppModelFile"), storage_mode='blob', item_side=not sharded)
+
+        self.covisitation_engine = None
+        if os.getenv("CovisitationFile"):
+            logger.debug("Loading co-visitation engine")
+            with memory.track_startup("covisitation"):
+                self.covisitation_engine = Covisitation(model_path=os.getenv("CovisitationFile"), storage_mode='blob')
+
+        self._cb_batcher = self._cf_batcher = None
+        # Only worth it where concurrent requests share this engine (not in one-request-at-a-time workers)
+        if batch_window_ms > 0 and not sharded:
+            self._cb_batcher = MicroBatcher("content_based", self.content_based_engine.similarities_batch,
+                                            batch_window_ms, BATCH_MAX_SIZE)
+            self._cf_batcher = MicroBatcher("collaborative_filtering", self.cf_engine.score_candidates_batch,
+                                            batch_window_ms, BATCH_MAX_SIZE)
+
+        if sharded:
+            logger.debug("Starting catalogue shards...")
+            with self._scores_lock:
+                self._shards = ShardedScorer(self._catalogue[0], CATALOGUE_SHARDS)
+                self._shards.update_scores(*self._catalogue[:2])
+
+        # Shared by all requests; a stage stuck past its deadline only holds one of these threads
+        self._stage_pool = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="recommend-stage")
+        self._pages = RankedListCache(max_entries=PAGE_CACHE_SIZE, ttl_seconds=PAGE_CACHE_TTL_SECONDS)
+        self._model_version = self.__model_version()
+        memory.mark_startup()
+
+    # -------------------------------------------------------------------------
+    # Memory accounting
+    # -------------------------------------------------------------------------
+
+    def memory_footprint(self) -> dict:
+        """Resident size of the article scores, fallback ranking and every sub-engine."""
+        fallback, fallback_json, fallback_items, _ = self._fallback
+        return memory.footprint(
+            scores=self.data,
+            catalogue=memory.footprint(article_ids=self._catalogue[0], **self._catalogue[1]),
+            fallback={"private_bytes": sys.getsizeof(fallback_json) + sum(sys.getsizeof(r) for r in fallback)
+                                       + sum(sys.getsizeof(item) for item in fallback_items),
+                      "shared_bytes": 0, "records": len(fallback_items)},
+            content_based=self.content_based_engine.memory_footprint() if self.content_based_engine else None,
+            collaborative_filtering=self.cf_engine.memory_footprint(),
+            covisitation=self.covisitation_engine.memory_footprint() if self.covisitation_engine else None,
+            shards=self._shards.memory_footprint() if self._shards else None,
+        )
+
+    def batching_stats(self) -> dict:
+        """Micro-batching metrics of the content and CF queries (empty when batching is off)."""
+        return {batcher.name: batcher.stats() for batcher in (self._cb_batcher, self._cf_batcher) if batcher}
+
+    def memory_diagnostics(self, include_objects: bool = False, top: int = 10) -> dict:
+        """Engine and cache footprints plus the process report of function_app_memory."""
+        return {
+            "engine": self.memory_footprint(),
+            "caches": {
+                "user_histories": db.user_histories.memory_footprint(),
+                "ranked_lists": self._pages.memory_footprint(),
+            },
+            **memory.get_memory_summary(include_objects, top),
+        }
+
+    # -------------------------------------------------------------------------
+    # Response validators
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def __model_version():
+        blobs = [os.getenv(k) for k in ("ArticlesEmbeddingsFile", "SVDppModelFile", "CovisitationFile")]
+        try:
+            # Blob ETags: the same on every worker process and instance serving these models
+            return cache_key("models", *[(blob, get_blob_etag(blob)) for blob in blobs if blob])
+        except Exception as e:
+            logger.warning("Model blob ETags unavailable; response ETags are valid in this process only: %s", e)
+            return uuid.uuid4().hex
+
+    def __etag(self, snapshot: str, user_id, *parts, history=None) -> str:
+        """
+        Entity tag of an answer: changes with the loaded models, the
+        `snapshot` it was computed from (article score digest, or ranked-list
+        token), the request (user, page size, cursor) and the user's click
+        history. Computed where the answer is, so it always names that body.
+        """
+        digest = hashlib.blake2b(digest_size=12)
+        request = (user_id, self.n_recs) + parts
+        digest.update(f"{self._model_version}|{snapshot}|{request!r}".encode("utf-8"))
+        if history is not None:
+            digest.update(np.ascontiguousarray(history, dtype=np.int32).tobytes())
+        return f'"{digest.hexdigest()}"'
+
+    # -------------------------------------------------------------------------
+    # Article scores and anonymous fallback
+    # -------------------------------------------------------------------------
+
+    def refresh_scores(self, data: pd.DataFrame | None = None):
+        """
+        Reload freshness/popularity scores and precompute the ranking served to
+        anonymous and history-less users (records and compact JSON, plus
+        PAGE_DEPTH serialized records for paged requests).
+        Concurrent reloads are coalesced: whoever waited on a refresh that
+        completed meanwhile reuses its result instead of reading the scores
+        again. Scores passed as `data` are always swapped in.
+        """
+        generation = self._scores_generation
+        with self._scores_lock:
+            if data is None:
+                if self._scores_generation != generation:
+                    return
+                data = db.get_articles_scores()
+            data = data.sort_values(by='article_id', ascending=True).reset_index(drop=True)
+            # Sorted article index shared by every score column and seen mask
+            article_ids = data['article_id'].to_numpy(dtype=np.int64)
+            columns = {k: data[k].to_numpy(dtype=np.float64) for k in ('freshness_score', 'popularity_score')}
+            # Content digest of the snapshot (for ETags): identical across processes loading the same scores
+            digest = cache_key("scores", article_ids, *columns.values())
+            ranking = self.__blend(article_ids, columns, blend_weights(0), max(PAGE_DEPTH, self.n_recs))
+            items = record_items(*ranking)
 
-        self.scores = ['freshness_score', 'popularity_score', 'cb_score', 'cf_score']
+            if self._shards is not None:
+                self._shards.update_scores(article_ids, columns)
+            self.data = data
+            self._catalogue = (article_ids, columns, digest)
+            # (records, json, page items, digest) swapped as one snapshot so readers never mix versions
+            self._fallback = (
+                _records(ranking)[:self.n_recs],
+                dumps(items[:self.n_recs]),
+                items,
+                digest,
+            )
+            self._scores_loaded_at = time.monotonic()
+            self._scores_generation += 1
+        logger.info("Article scores refreshed (%d articles).", len(data))
+
+    def __refresh_if_stale(self):
+        """
+        Start a background reload once the scores are older than
+        SCORES_TTL_SECONDS. Never blocks: requests keep the current snapshot
+        until the new one is swapped in.
+        """
+        now = time.monotonic()
+        if (SCORES_TTL_SECONDS > 0 and now - self._scores_loaded_at > SCORES_TTL_SECONDS
+                and now >= self._refresh_retry_at and self._refresh_running.acquire(blocking=False)):
+            threading.Thread(target=self.__refresh_in_background, name="scores-refresh", daemon=True).start()
+
+    def __refresh_in_background(self):
+        try:
+            self.refresh_scores()
+        except Exception as e:
+            # Keep serving the previous snapshot; retry after a pause rather than on every request
+            self._refresh_retry_at = time.monotonic() + min(SCORES_TTL_SECONDS, REFRESH_RETRY_SECONDS)
+            logger.exception("Article score refresh failed; serving the previous snapshot: %s", e)
+        finally:
+            self._refresh_running.release()
+
+    def anonymous_recommendations(self):
+        """Precomputed ranking for users without history (copied, O(n_recs))."""
+        self.__refresh_if_stale()
+        return [dict(rec) for rec in self._fallback[0]]
+
+    def anonymous_recommendations_json(self) -> str:
+        """Serialized form of `anonymous_recommendations`, shared by all callers."""
+        self.__refresh_if_stale()
+        return self._fallback[1]
 
     def __recommend_popular(self, n_recs:int):
         logger.debug(f'Issuing recommendations based on popularity...')
@@ -44,80 +321,267 @@ class HybridRecommendationEngine():
  
     def __recommend_content_based(self, article_id):
         logger.debug(f'Issuing recommendations based on article {article_id}')
-        ct_based_recs = self.content_based_engine.recommend(article_id)
-        if not ct_based_recs:
+        if self._cb_batcher is not None:
+            sims = self._cb_batcher.submit(article_id)
+        else:
+            sims = self.content_based_engine.similarities(article_id)
+        if sims is None:
             return None
-        
-        cb = (
-            pd.DataFrame(ct_based_recs, columns=['article_id', 'cb_score'])
-            .sort_values(by='article_id', ascending=True)
-        )
-        return cb
+        return self.content_based_engine.article_ids, sims
 
-    def __recommend_collaborative_filtering(self, user_id, n_recs=None):
+    def __recommend_collaborative_filtering(self, user_id, candidates):
         logger.debug(f'Issuing recommendations based on collaborative-filtering scores for user {user_id}.')
-        data = self.data
-        seen = db.get_clicked_articles_by_user(user_id)
-        # Exclude articles the user has already seen (index-based)
-        candidates = data.loc[~data['article_id'].isin(seen), 'article_id'].to_list()
-        recs = self.cf_engine.recommend_for_user(user_id=user_id, candidates=candidates, N=n_recs)
-        return recs
-
-    def __get_weights(self, user_id):
+        if self._cf_batcher is not None:
+            return self._cf_batcher.submit((user_id, candidates))
+        return self.cf_engine.score_candidates(user_id, candidates)
+
+    def __recommend_covisitation(self, history):
+        logger.debug('Issuing recommendations based on co-visitation of recent clicks...')
+        ids, scores = self.covisitation_engine.scores(history)
+        if len(ids) == 0:
+            return None
+        return ids, scores
+
+    def __load_user_profile(self, user_id):
+        # One history read (store first, Cosmos on a miss) gives both the seen set and the last click
+        history = db.get_user_history(int(user_id), cached=self.cache_histories)
+        last_clicked = int(history[-1]) if len(history) else None
+        return history, last_clicked
+
+    def __get_weights(self, user_history):
         logger.debug('Calculating weights based on user profile...')
-        keys = self.scores
-        user_history = db.get_clicked_articles_by_user(user_id)
-        history_size = len(user_history)
+        return blend_weights(len(user_history))
+
+    def __blend(self, article_ids, columns, weights, n_recs=None, exclude=None):
+        """
+        Weighted sum of the score columns (aligned to `article_ids`) and the
+        top-n ranking. Missing values count as 0 in the sum; sources without a
+        column are dropped and the remaining weights renormalized. Articles
+        set in the `exclude` mask are never ranked.
+        """
+        weights = normalized_weights(weights, columns)
+        top, overall = weighted_top(columns, weights, n_recs or self.n_recs, exclude)
+
+        # (article ids, score names, score rows): serialized as is, or turned into records by _records
+        names = [k for k in SCORES + [COVISITATION_SCORE] if k in columns]
+        rows = np.column_stack([columns[k][top] for k in names] + [overall[top]]).tolist()
+        return article_ids[top].tolist(), names + ['overall_score'], rows
+
+    # -------------------------------------------------------------------------
+    # Deadline-bound stages
+    # -------------------------------------------------------------------------
 
-        if history_size > 0:
-            cf_weight = 1 / (1 + np.exp(-0.3*(history_size - 8)))  # grows after ~8 clicks
-        else :
-            cf_weight = 0.0
+    def __submit(self, name, fn, *args):
+        # Stages keep the request's tracing context on the pool thread
+        ctx = contextvars.copy_context()
+        return self._stage_pool.submit(ctx.run, self.__timed, name, fn, *args)
 
-        cb_weight = min(cf_weight + 0.2, 0.5)
-        fresh_pop = max(1 - cf_weight, 0.2)
+    @staticmethod
+    def __timed(name, fn, *args):
+        with span(f"recommend.{name}"):
+            return fn(*args)
 
-        w = np.array([fresh_pop/2, fresh_pop/2, cb_weight, cf_weight])
-        w = w / w.sum()
-        return dict(zip(keys, w))
+    @staticmethod
+    def __collect(name, future, deadline, report):
+        """
+        Wait for a stage within the remaining budget. A stage that times out
+        or fails is dropped; its future is left to finish in the background.
+        """
+        try:
+            result = future.result(timeout=deadline.remaining() if deadline else None)
+            report["ran"].append(name)
+            return result
+        except FutureTimeoutError:
+            logger.warning("Stage '%s' missed the request deadline; dropped from the blend.", name)
+        except Exception as e:
+            logger.exception("Stage '%s' failed; dropped from the blend: %s", name, e)
+        future.cancel()
+        report["dropped"].append(name)
+        return None
 
-    def recommend(self, user_id: int | None = None):
+    # -------------------------------------------------------------------------
+    # Recommendation Logic
+    # -------------------------------------------------------------------------
+
+    def recommend(self, user_id: int | None = None, deadline: "Deadline | None" = None):
         logger.debug(f"Passed arguments: user_id={user_id}")
-        recs = self.data.copy().sort_values(by='article_id', ascending=True)
-        
-        article_id = db.get_last_clicked_by_user(int(user_id)) if user_id else None # Default value in cases of no user provided or user has no history
-        content_based = self.__recommend_content_based(article_id) if article_id else None
-
-        if content_based is not None:
-            recs = recs.merge(content_based, how='left', on='article_id')
-
-        if user_id and db.get_last_clicked_by_user(user_id):
-            cf = pd.DataFrame(
-                self.__recommend_collaborative_filtering(user_id, None),
-                columns=['article_id', 'cf_score']
-            ).sort_values(by='article_id', ascending=True)
-            recs = recs.merge(cf, how='left', on='article_id')
-        else:
-            logger.debug("No user_id was passed.")
+        with trace("recommend"), memory.track_request("recommend"):
+            ranking, fallback, _, _ = self.__recommend(user_id, deadline)
+        if ranking is None:
+            return [dict(rec) for rec in fallback[0]]
+        return _records(ranking)
 
-        recs.fillna(0.0)
+    def recommend_json(self, user_id: int | None = None, deadline: "Deadline | None" = None, if_none_match=()):
+        """
+        Same as `recommend`, as compact JSON written from the score arrays;
+        fallback answers reuse the precomputed JSON.
 
-        weights = self.__get_weights(user_id)
-        weights = {k: v for k, v in weights.items() if k in recs.columns}
-        w = np.array(list(weights.values()))
+        Args:
+            user_id (Optional[int]): User to recommend for (None = anonymous).
+            deadline (Optional[Deadline]): Budget of the scoring pass.
+            if_none_match (Sequence[str]): Entity tags the client already holds.
 
-        if w.sum() > 0:
-            w = w / w.sum()
-            weights = dict(zip(weights.keys(), w))
+        Returns:
+            Tuple[Optional[str], dict, Optional[str]]: JSON body (None when the
+            client holds the current answer: nothing is scored), stage report
+            {"ran": [...], "dropped": [...]} and the ETag of the answer (None
+            when the user's history could not be read).
+        """
+        logger.debug(f"Passed arguments: user_id={user_id}")
+        with trace("recommend"), memory.track_request("recommend"):
+            ranking, fallback, report, etag = self.__recommend(user_id, deadline, if_none_match=if_none_match)
+        if _matches(etag, if_none_match):
+            return None, report, etag
+        body = fallback[1] if ranking is None else dumps(record_items(*ranking))
+        return body, report, etag
 
-        recs['overall_score'] = (
-            recs[list(weights.keys())]
-            .mul(pd.Series(weights))
-            .sum(axis=1)
-        )
+    def recommend_page_json(self, user_id: int | None = None, limit: int | None = None, cursor: str | None = None,
+                            deadline: "Deadline | None" = None, if_none_match=()):
+        """
+        One page of a ranked list of up to PAGE_DEPTH recommendations.
+
+        The first page scores the user once and keeps the serialized list in
+        the ranked-list cache; the cursor returned with each page points into
+        that list, so later pages are slices. Pages of the fallback ranking
+        (anonymous and history-less users) are cursors into the fallback
+        snapshot and take no cache entry. A cursor whose list expired (or was
+        cached by another worker process) recomputes the list and keeps its
+        offset.
+
+        Args:
+            user_id (Optional[int]): User to recommend for (None = anonymous).
+            limit (Optional[int]): Page size (default n_recs, at most PAGE_DEPTH).
+            cursor (Optional[str]): Cursor of a previous page (None = first page).
+            deadline (Optional[Deadline]): Budget of the scoring pass, when one runs.
+            if_none_match (Sequence[str]): Entity tags the client already holds.
+
+        Returns:
+            Tuple[Optional[str], Optional[str], dict, Optional[str]]: JSON list
+            of records (None when the client holds the current page), cursor
+            of the next page (None on the last one), the stage report and the
+            ETag of the page.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        parts = (limit, cursor)
+        limit = max(1, min(limit or self.n_recs, PAGE_DEPTH))
+        token, offset = decode_cursor(cursor) if cursor else (None, 0)
+
+        with trace("recommend"), memory.track_request("recommend"):
+            items = None
+            if token and token.startswith(FALLBACK_TOKEN):
+                fallback = self._fallback
+                if token == FALLBACK_TOKEN + fallback[3]:
+                    items = fallback[2]
+            elif token:
+                items = self._pages.get(token, user_id)
+            if items is not None:
+                report = {"ran": ["page_cache"], "dropped": []}
+                # The cached list is the whole answer: its token names it
+                etag = self.__etag(token, user_id, *parts)
+            else:
+                ranking, fallback, report, etag = self.__recommend(user_id, deadline, PAGE_DEPTH, parts, if_none_match)
+                if _matches(etag, if_none_match):
+                    return None, None, report, etag
+                if ranking is None:
+                    # Same list for every such user: name the snapshot rather than caching a copy
+                    items, token = fallback[2], FALLBACK_TOKEN + fallback[3]
+                else:
+                    items = record_items(*ranking)
+                    token = self._pages.put(user_id, items)
+
+        if _matches(etag, if_none_match):
+            return None, None, report, etag
+        page = items[offset:offset + limit]
+        next_cursor = encode_cursor(token, offset + limit) if offset + limit < len(items) else None
+        return dumps(page), next_cursor, report, etag
+
+    def __profile(self, user_id, deadline, report):
+        profile = None
+        if user_id:
+            profile = self.__collect(
+                "user_lookup", self.__submit("user_lookup", self.__load_user_profile, user_id), deadline, report
+            )
+        return profile if profile else ([], None)
+
+    def __recommend(self, user_id, deadline, n_recs=None, parts=(), if_none_match=()):
+        """
+        Rank the articles for a user.
+
+        Returns:
+            Tuple[Optional[tuple], tuple, dict, Optional[str]]: The ranking
+            (None = serve the fallback snapshot, or nothing when the client
+            holds the current answer), the fallback snapshot, the stage report
+            and the ETag of the answer (None when the history lookup was dropped).
+        """
+        report = {"ran": [], "dropped": []}
+        history, article_id = self.__profile(user_id, deadline, report)
+        self.__refresh_if_stale()
+        # Each snapshot is read once, so the ETag names the one the answer is built from
+        catalogue, fallback = self._catalogue, self._fallback
+        etag = None
+        if "user_lookup" not in report["dropped"]:
+            etag = self.__etag(catalogue[2] if article_id else fallback[3], user_id, *parts, history=history)
+
+        if not article_id or _matches(etag, if_none_match):
+            # Without history only freshness and popularity are blended: same answer for everyone
+            logger.debug("No user history or answer unchanged; nothing to score.")
+            return None, fallback, report, etag
+
+        return self.__blend_user(user_id, history, article_id, catalogue, deadline, report, n_recs), fallback, report, etag
+
+    def __blend_user(self, user_id, history, article_id, catalogue, deadline, report, n_recs=None):
+        if self._shards is not None:
+            return self.__blend_sharded(user_id, history, article_id, catalogue, deadline, report, n_recs)
+        article_ids, columns, _ = catalogue
+        # Built once per request and applied to every source before the top-n
+        seen = seen_mask(article_ids, history)
+
+        # Content and CF stages run concurrently, each bounded by what is left of the budget
+        cb_future = self.__submit("content_based", self.__recommend_content_based, article_id)
+        cf_future = self.__submit("collaborative_filtering", self.__recommend_collaborative_filtering,
+                                  user_id, article_ids[~seen])
+        cv_future = None
+        if self.covisitation_engine is not None:
+            cv_future = self.__submit("covisitation", self.__recommend_covisitation, history)
+        content_based = self.__collect("content_based", cb_future, deadline, report)
+        cf = self.__collect("collaborative_filtering", cf_future, deadline, report)
+        cv = self.__collect("covisitation", cv_future, deadline, report) if cv_future is not None else None
+
+        with span("recommend.blend"):
+            columns = dict(columns)
+            if content_based is not None:
+                columns['cb_score'] = align(article_ids, *content_based)
+            if cf is not None:
+                columns['cf_score'] = align(article_ids, *cf)
+            if cv is not None:
+                # Articles co-clicked with nothing recent score 0 rather than NaN
+                columns[COVISITATION_SCORE] = align(article_ids, *cv, fill=0.0)
+
+            # Dropped stages have no column: __blend renormalizes the remaining weights
+            weights = self.__get_weights(history)
+            return self.__blend(article_ids, columns, weights, n_recs, exclude=seen)
+
+    def __blend_sharded(self, user_id, history, article_id, catalogue, deadline, report, n_recs=None):
+        # Content and CF scores are computed by the shards: only the user's factors are read here
+        cv_future = None
+        if self.covisitation_engine is not None:
+            cv_future = self.__submit("covisitation", self.__recommend_covisitation, history)
+        user = self.cf_engine.user_vector(user_id)
+        cv = self.__collect("covisitation", cv_future, deadline, report) if cv_future is not None else None
 
-        return (
-            recs.sort_values(by="overall_score", ascending=False)
-                .head(self.n_recs)
-                .to_dict(orient="records")
-        )
\ No newline at end of file
+        weights = self.__get_weights(history)
+        if cv is None:
+            weights.pop(COVISITATION_SCORE)
+        with span("recommend.shards"):
+            ranking, dropped = self._shards.rank(np.asarray(history), article_id, user, cv, weights,
+                                                 n_recs or self.n_recs, deadline)
+        report["ran"].append("shards")
+        report["dropped"].extend(dropped)
+        if dropped and not ranking[0]:
+            # No shard answered in time: blend freshness and popularity here, like dropped stages
+            article_ids, columns, _ = catalogue
+            seen = seen_mask(article_ids, history)
+            return self.__blend(article_ids, columns, weights, n_recs, exclude=seen)
+        return ranking
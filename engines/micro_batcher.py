@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Any, Callable, List, Sequence
+
+from function_app_logging import get_logger
+from function_app_tracing import LatencyHistogram
+logger = get_logger("micro_batcher")
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-query calls into one batched call.
+
+    `submit` queues a query and blocks until its result is ready. A
+    dispatcher thread waits up to `window_ms` after the oldest queued query
+    (or until `max_batch` queries are queued), then answers the whole batch
+    with a single `batch_fn(queries)` call, which returns one result per
+    query in order. A failing batch fails every caller in it.
+
+    Batch sizes, queueing delays (submit to batch start) and batch run times
+    are kept for `stats`.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], Sequence[Any]], window_ms: float = 2.0,
+                 max_batch: int = 32):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+
+        self._queue = []  # (query, future, enqueued_at)
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._sizes = Counter()
+        self._queue_delay = LatencyHistogram()
+        self._batch_time = LatencyHistogram()
+        self._thread = threading.Thread(target=self.__dispatch, name=f"batch-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, query, timeout: float | None = None):
+        """Result of `query`, computed as part of the next batch."""
+        future = Future()
+        with self._cond:
+            self._queue.append((query, future, time.perf_counter()))
+            if len(self._queue) == 1 or len(self._queue) >= self.max_batch:
+                self._cond.notify()
+        return future.result(timeout=timeout)
+
+    def __next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # The window opens with the oldest query, so none waits more than window_ms to start
+            closes_at = self._queue[0][2] + self.window
+            while len(self._queue) < self.max_batch:
+                remaining = closes_at - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+        return batch
+
+    def __dispatch(self):
+        while True:
+            batch = self.__next_batch()
+            started = time.perf_counter()
+            try:
+                results = self.batch_fn([query for query, _, _ in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"{len(results)} results for a batch of {len(batch)} queries")
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.exception("Batch of %d '%s' queries failed: %s", len(batch), self.name, e)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._stats_lock:
+                self._sizes[len(batch)] += 1
+                self._batch_time.record((time.perf_counter() - started) * 1000)
+                for _, _, enqueued_at in batch:
+                    self._queue_delay.record((started - enqueued_at) * 1000)
+
+    def stats(self) -> dict:
+        """Batch size distribution, queueing delay and batch run time percentiles."""
+        with self._stats_lock:
+            sizes = dict(self._sizes)
+            queue_delay, batch_time = self._queue_delay.summary(), self._batch_time.summary()
+        batches = sum(sizes.values())
+        requests = sum(size * count for size, count in sizes.items())
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "batch_sizes": {str(size): sizes[size] for size in sorted(sizes)},
+            "queue_delay": queue_delay,
+            "batch_time": batch_time,
+        }
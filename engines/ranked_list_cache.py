@@ -0,0 +1,102 @@
+import base64
+import json
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+
+def encode_cursor(token: str, offset: int) -> str:
+    """Opaque cursor of the page starting at `offset` of the ranked list `token`."""
+    raw = json.dumps({"t": token, "o": offset}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Token and offset of a cursor made by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        token, offset = str(data["t"]), int(data["o"])
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if offset < 0:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return token, offset
+
+
+class RankedListCache:
+    """
+    In-process cache of ranked recommendation lists, so the pages of one
+    scroll session slice a single scoring pass.
+
+    Lists are stored as per-record JSON strings under a random token, with
+    the user they were computed for. Entries expire `ttl_seconds` after they
+    were computed (rankings go stale as clicks arrive) and the least recently
+    used ones are evicted beyond `max_entries`. Each worker process has its
+    own cache: a page served by another process recomputes the list.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 120.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # token -> (user_id, items, created_at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, user_id: Optional[int], items: List[str]) -> str:
+        """Store a ranked list (serialized records, best first) and return its token."""
+        token = secrets.token_urlsafe(12)
+        with self._lock:
+            self._entries[token] = (user_id, items, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return token
+
+    def get(self, token: str, user_id: Optional[int]) -> Optional[List[str]]:
+        """
+        Ranked list stored under `token` for `user_id`, or None if it is
+        unknown, expired or was computed for another user.
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] != user_id or (
+                self.ttl_seconds > 0 and time.monotonic() - entry[2] > self.ttl_seconds
+            ):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def memory_footprint(self) -> dict:
+        """Size of the cached lists (same shape as function_app_memory.footprint)."""
+        with self._lock:
+            entries = list(self._entries.values())
+        # Lists may share their items: count each string once
+        seen, size = set(), sys.getsizeof(self._entries)
+        for _, items, _ in entries:
+            size += sys.getsizeof(items)
+            for item in items:
+                if id(item) not in seen:
+                    seen.add(id(item))
+                    size += sys.getsizeof(item)
+        return {
+            "private_bytes": size,
+            "shared_bytes": 0,
+            "entries": len(entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
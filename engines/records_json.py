@@ -0,0 +1,37 @@
+import math
+from typing import List, Sequence
+
+
+def _number(value: float) -> str:
+    # Same spelling as json.dumps: NaN marks a score the source did not compute
+    if math.isfinite(value):
+        return repr(value)
+    if math.isnan(value):
+        return "NaN"
+    return "Infinity" if value > 0 else "-Infinity"
+
+
+def record_items(article_ids: Sequence[int], names: Sequence[str], rows: Sequence[Sequence[float]]) -> List[str]:
+    """
+    Compact JSON object of each ranked record, written straight from the
+    blended arrays (no intermediate dicts). Same text as
+    json.dumps({"article_id": id, **dict(zip(names, row))}, separators=(",", ":")).
+
+    Args:
+        article_ids (Sequence[int]): Article id of each record.
+        names (Sequence[str]): Score keys, in output order.
+        rows (Sequence[Sequence[float]]): Score values of each record, in `names` order.
+
+    Returns:
+        List[str]: One serialized record per article.
+    """
+    keys = [f',"{name}":' for name in names]
+    return [
+        '{"article_id":%d%s}' % (article_id, "".join(key + _number(value) for key, value in zip(keys, row)))
+        for article_id, row in zip(article_ids, rows)
+    ]
+
+
+def dumps(items: Sequence[str]) -> str:
+    """JSON array of records serialized by `record_items`."""
+    return "[" + ",".join(items) + "]"
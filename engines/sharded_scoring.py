@@ -0,0 +1,299 @@
+import itertools
+import multiprocessing as mp
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from engines.blend import align, normalized_weights, seen_mask, weighted_top
+from engines.content_based_engine import ContentBasedRecommendationEngine as ContentBased
+from engines.svd_engine import SVDRecommendationEngine as SVDEngine, estimate_ratings
+from function_app_logging import get_logger
+from function_app_memory import footprint
+logger = get_logger("sharded_scoring")
+
+# Phase-one CF estimates kept per shard until the request's second phase arrives.
+PENDING_REQUESTS = 64
+
+
+def load_engines():
+    """
+    Content-based and SVD++ engines from the blobs configured for the hybrid
+    engine. With SharedArraysEnabled their arrays map the published files,
+    so a shard copying its slice never has the rest resident.
+    """
+    return (
+        ContentBased(embeddings_path=os.getenv("ArticlesEmbeddingsFile"), storage_mode='blob'),
+        SVDEngine(model_path=os.getenv("SVDppModelFile"), storage_mode='blob'),
+    )
+
+
+def _positions(sorted_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Index of each of `ids` in `sorted_ids`; -1 where absent."""
+    if len(sorted_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == ids, pos, -1)
+
+
+# -------------------------------------------------------------------------
+# Shard (runs in its own worker process)
+# -------------------------------------------------------------------------
+class CatalogueShard:
+    """
+    The articles with ids in [low, high): their normalized embeddings and
+    CF item biases/factors, copied out of the full engines so the process
+    keeps only its slice, and their freshness/popularity scores.
+
+    A request runs in two phases. `prepare` estimates the CF ratings of the
+    slice's unseen articles and returns their min and max, so the
+    coordinator can min-max normalize over the whole catalogue as
+    SVDRecommendationEngine.score_candidates does, plus the query embedding
+    when the last clicked article is in the slice; `top` blends every source
+    and returns the slice's local top-n.
+    """
+
+    def __init__(self, low: int, high: int, content_based: ContentBased, cf_engine: SVDEngine):
+        self.low = low
+        self.high = high
+
+        ids = np.asarray(content_based.article_ids, dtype=np.int64)
+        rows = np.flatnonzero((ids >= low) & (ids < high))
+        rows = rows[np.argsort(ids[rows], kind="stable")]
+        self.embedding_ids = ids[rows]
+        self.embeddings = np.ascontiguousarray(content_based.embeddings[rows])
+
+        items = np.asarray(cf_engine.item_ids, dtype=np.int64)
+        inner = np.flatnonzero((items >= low) & (items < high))
+        inner = inner[np.argsort(items[inner], kind="stable")]
+        self.item_ids = items[inner]
+        self.item_bias = np.ascontiguousarray(cf_engine.item_bias[inner])
+        self.item_factors = np.ascontiguousarray(cf_engine.item_factors[inner])
+        self.global_mean = cf_engine.global_mean
+        self.rating_scale = cf_engine.rating_scale
+
+        self.update_scores(np.empty(0, dtype=np.int64), {})
+        self._pending = OrderedDict()  # request token -> (seen, known, estimates)
+        logger.info("Shard [%s, %s) ready: %d embeddings, %d CF items.", low, high,
+                    len(self.embedding_ids), len(self.item_ids))
+
+    def update_scores(self, article_ids: np.ndarray, columns: Dict[str, np.ndarray]):
+        """Swap in the slice's catalogue (sorted article ids) and its freshness/popularity columns."""
+        # One tuple so a request never mixes two snapshots
+        self._catalogue = (
+            article_ids,
+            columns,
+            _positions(self.embedding_ids, article_ids),
+            _positions(self.item_ids, article_ids),
+        )
+
+    def memory_footprint(self) -> dict:
+        article_ids, columns, _, _ = self._catalogue
+        return footprint(
+            embeddings=self.embeddings, embedding_ids=self.embedding_ids,
+            item_factors=self.item_factors, item_bias=self.item_bias, item_ids=self.item_ids,
+            article_ids=article_ids, **columns,
+        )
+
+    def __estimates(self, history, user):
+        article_ids, _, _, cf_pos = self._catalogue
+        seen = seen_mask(article_ids, history)
+        known = (cf_pos >= 0) & ~seen
+        inner = cf_pos[known]
+        return seen, known, estimate_ratings(self.global_mean, self.rating_scale, self.item_bias[inner],
+                                             self.item_factors[inner], user)
+
+    def query_vector(self, article_id: Optional[int]) -> Optional[np.ndarray]:
+        """Unit embedding of an article of the slice (None if it is not indexed here), as ContentBased.query_vector."""
+        if article_id is None:
+            return None
+        pos = _positions(self.embedding_ids, np.array([article_id], dtype=np.int64))[0]
+        if pos < 0:
+            return None
+        q = self.embeddings[pos]
+        return q / np.linalg.norm(q)
+
+    def prepare(self, token: int, history, article_id: Optional[int], user):
+        """
+        First phase of a request.
+
+        Returns:
+            Tuple[Optional[Tuple[float, float]], Optional[np.ndarray]]: Min and
+            max CF estimate over the slice's unseen known articles (None if
+            there are none) and the query embedding of `article_id` (None
+            unless it belongs to this slice).
+        """
+        seen, known, est = self.__estimates(history, user)
+        self._pending[token] = (seen, known, est)
+        while len(self._pending) > PENDING_REQUESTS:
+            self._pending.popitem(last=False)
+        cf_range = (float(est.min()), float(est.max())) if len(est) else None
+        return cf_range, self.query_vector(article_id)
+
+    def top(self, token: int, history, names: List[str], weights: Dict[str, float], n: int,
+            query: Optional[np.ndarray], article_id: Optional[int], user, cf_range, cv) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Blend the slice's score columns and return its top-n unseen articles.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Article ids and score rows (`names` then overall_score).
+        """
+        article_ids, scores, emb_pos, _ = self._catalogue
+        pending = self._pending.pop(token, None)
+        seen, known, est = pending if pending is not None else self.__estimates(history, user)
+
+        columns = dict(scores)
+        if "cb_score" in names:
+            cb = np.full(len(article_ids), np.nan)
+            has = emb_pos >= 0
+            cb[has] = ((self.embeddings @ query + 1) / 2)[emb_pos[has]]
+            cb[has & (article_ids == article_id)] = -1.0  # the article itself, as in ContentBased.similarities
+            columns["cb_score"] = cb
+        if "cf_score" in names:
+            cf = np.full(len(article_ids), np.nan)
+            if cf_range is not None:
+                low, high = cf_range
+                cf[known] = (est - low) / (high - low) if high > low else 0.0
+            columns["cf_score"] = cf
+        for name in names:
+            if name not in columns:
+                # Co-visitation: articles co-clicked with nothing recent score 0
+                columns[name] = align(article_ids, *cv, fill=0.0)
+
+        top, overall = weighted_top(columns, weights, n, seen)
+        return article_ids[top], np.column_stack([columns[k][top] for k in names] + [overall[top]])
+
+
+_shard = None
+
+
+def _init_shard(low, high, loader):
+    global _shard
+    content_based, cf_engine = loader()
+    _shard = CatalogueShard(low, high, content_based, cf_engine)
+
+
+def _call_shard(method, *args):
+    return getattr(_shard, method)(*args)
+
+
+# -------------------------------------------------------------------------
+# Coordinator
+# -------------------------------------------------------------------------
+class ShardedScorer:
+    """
+    Scatter-gather scoring over catalogue shards, one worker process each.
+
+    The catalogue is split into `n_shards` contiguous article id ranges of
+    about the same size; the last range is open-ended, so articles added
+    later land in it. Each worker loads the engines through `loader` (a
+    picklable callable returning the content-based and SVD++ engines) and
+    keeps only its slice. The embeddings and item factors are meant to be
+    shared arrays (SharedArraysEnabled): workers map the published files,
+    so only their slice is ever resident, and the coordinator needs
+    neither (query embeddings come from the shards, user factors from an
+    SVD++ engine loaded without its item side).
+
+    A request is scattered to every shard twice (CF range and query
+    embedding, then local top-n) and the local top-n lists are merged.
+    Shards that miss the deadline are left out of the answer and reported.
+    """
+
+    def __init__(self, article_ids: np.ndarray, n_shards: int, loader=load_engines):
+        chunks = [chunk for chunk in np.array_split(np.asarray(article_ids, dtype=np.int64), n_shards) if len(chunk)]
+        cuts = [int(chunk[0]) for chunk in chunks[1:]]
+        info = np.iinfo(np.int64)
+        self.bounds = list(zip([info.min] + cuts, cuts + [info.max]))
+        context = mp.get_context("spawn")
+        self.pools = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_shard, initargs=(low, high, loader))
+            for low, high in self.bounds
+        ]
+        self._tokens = itertools.count()
+        logger.info("Catalogue split into %d shards.", len(self.pools))
+
+    def close(self):
+        for pool in self.pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def update_scores(self, article_ids: np.ndarray, columns: Dict[str, np.ndarray]):
+        """Send each shard its slice of the catalogue and score columns (blocks until all have it)."""
+        futures = []
+        for (low, high), pool in zip(self.bounds, self.pools):
+            inside = (article_ids >= low) & (article_ids < high)
+            futures.append(pool.submit(_call_shard, "update_scores", article_ids[inside],
+                                       {k: v[inside] for k, v in columns.items()}))
+        for future in futures:
+            future.result()
+
+    def memory_footprint(self) -> dict:
+        """Footprint of every shard (private to the shard processes, not this one)."""
+        futures = [pool.submit(_call_shard, "memory_footprint") for pool in self.pools]
+        return footprint(**{f"shard_{i}": future.result() for i, future in enumerate(futures)})
+
+    def __gather(self, futures, deadline, dropped):
+        results = {}
+        for i, future in futures.items():
+            try:
+                results[i] = future.result(timeout=deadline.remaining() if deadline else None)
+            except FutureTimeoutError:
+                logger.warning("Shard %d missed the request deadline; left out of the answer.", i)
+                future.cancel()
+                dropped.append(f"shard_{i}")
+            except Exception as e:
+                logger.exception("Shard %d failed; left out of the answer: %s", i, e)
+                dropped.append(f"shard_{i}")
+        return results
+
+    def rank(self, history, article_id: Optional[int], user, cv, weights: Dict[str, float], n: int,
+             deadline=None):
+        """
+        Top-n unseen articles over all shards.
+
+        Args:
+            history: Clicked article ids (seen set and CF candidates).
+            article_id (Optional[int]): Last clicked article (content query, scored -1 itself).
+            user: (b_u, p_u) of SVDRecommendationEngine.user_vector, None for the baseline.
+            cv: Co-visitation (ids, scores) (needed with cv_score).
+            weights (Dict[str, float]): Weight of each score column, in output order.
+                cb_score is dropped when no shard indexes `article_id` and
+                the rest renormalized.
+            n (int): Number of articles to return.
+            deadline (Optional[Deadline]): Budget shared by both phases.
+
+        Returns:
+            Tuple[tuple, List[str]]: Ranking (article ids, score names, score rows)
+            and the shards that were left out.
+        """
+        token = next(self._tokens)
+        dropped = []
+        live = dict(enumerate(self.pools))
+
+        prepared = self.__gather(
+            {i: pool.submit(_call_shard, "prepare", token, history, article_id, user) for i, pool in live.items()},
+            deadline, dropped,
+        )
+        live = {i: live[i] for i in prepared}
+        found = [r for r, _ in prepared.values() if r is not None]
+        cf_range = (min(r[0] for r in found), max(r[1] for r in found)) if found else None
+        query = next((q for _, q in prepared.values() if q is not None), None)
+
+        names = [k for k in weights if k != "cb_score" or query is not None]
+        weights = normalized_weights(weights, names)
+
+        results = self.__gather(
+            {i: pool.submit(_call_shard, "top", token, history, names, weights, n, query, article_id, user,
+                            cf_range, cv)
+             for i, pool in live.items()},
+            deadline, dropped,
+        )
+        if results:
+            ids = np.concatenate([ids for ids, _ in results.values()])
+            rows = np.vstack([rows for _, rows in results.values()])
+        else:
+            ids, rows = np.empty(0, dtype=np.int64), np.empty((0, len(names) + 1))
+        # Ties keep article order, as in the single-process blend
+        order = np.lexsort((ids, -rows[:, -1]))[:n]
+        return (ids[order].tolist(), names + ["overall_score"], rows[order].tolist()), dropped
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: builds may race, publish stays atomic
+    fcntl = None
+
+from function_app_logging import get_logger
+logger = get_logger("shared_arrays")
+
+SHARED_ARRAYS_ENABLED = os.getenv("SharedArraysEnabled", "true").lower() == "true"
+SHARED_ARRAY_DIR = os.getenv("SharedArrayDir", os.path.join(tempfile.gettempdir(), "bookrec-shared-arrays"))
+
+MANIFEST = "manifest.json"
+
+
+def cache_key(name: str, *parts) -> str:
+    """
+    Build a directory-safe key: `name` plus a digest of everything the
+    arrays depend on (blob name, blob ETag, article ids...).
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode("utf-8"))
+    return f"{name}-{digest.hexdigest()[:16]}"
+
+
+def load_or_publish(key: str, build: Callable[[], Dict[str, np.ndarray]], prune: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Return the arrays published under `key` as read-only memory maps.
+
+    The first process to ask for a key runs `build()` and writes the arrays
+    as .npy files; every other process (and every later call) maps the same
+    files, so the OS page cache holds a single copy shared by all Function
+    worker processes on the instance. Publishing a key deletes the older
+    versions of the same name, unless `prune` is False.
+
+    Args:
+        key (str): Key from `cache_key`; changes whenever the source artifact does.
+        build (Callable): Returns a dict of name -> numpy array (numeric dtypes only).
+        prune (bool): False for one-off keys (e.g. per run) that other runs may still be using;
+                      the caller then `discard`s its key.
+
+    Returns:
+        Dict[str, np.ndarray]: Read-only arrays backed by the shared files.
+    """
+    directory = os.path.join(SHARED_ARRAY_DIR, key)
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        return _attach(directory)
+
+    os.makedirs(SHARED_ARRAY_DIR, exist_ok=True)
+    with _exclusive(os.path.join(SHARED_ARRAY_DIR, key + ".lock")):
+        # Another worker may have published while we waited on the lock
+        if not os.path.exists(os.path.join(directory, MANIFEST)):
+            _publish(directory, build())
+            if prune:
+                _prune_stale(key)
+    return _attach(directory)
+
+
+def attach(key: str) -> Dict[str, np.ndarray]:
+    """
+    Map arrays already published under `key` (e.g. by a parent process).
+    Raises FileNotFoundError if nothing was published.
+    """
+    directory = os.path.join(SHARED_ARRAY_DIR, key)
+    if not os.path.exists(os.path.join(directory, MANIFEST)):
+        raise FileNotFoundError(f"No shared arrays published under '{key}'.")
+    return _attach(directory)
+
+
+def discard(key: str):
+    """Delete arrays published under `key` (processes still mapping them keep their pages)."""
+    shutil.rmtree(os.path.join(SHARED_ARRAY_DIR, key), ignore_errors=True)
+    try:
+        os.remove(os.path.join(SHARED_ARRAY_DIR, key + ".lock"))
+    except OSError:
+        pass
+
+
+def _publish(directory, arrays):
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".", dir=SHARED_ARRAY_DIR)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), np.ascontiguousarray(array), allow_pickle=False)
+        with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+            json.dump(sorted(arrays), f)
+        os.replace(tmp_dir, directory)
+        logger.info("Published shared arrays '%s' (%.1f MB).", os.path.basename(directory),
+                    sum(a.nbytes for a in arrays.values()) / 1e6)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.exists(os.path.join(directory, MANIFEST)):
+            raise
+
+
+def _attach(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        names = json.load(f)
+    return {name: np.asarray(np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")) for name in names}
+
+
+def _prune_stale(key):
+    # Older versions of the same artifact; processes still mapping them keep their pages.
+    prefix = key.rsplit("-", 1)[0] + "-"
+    for entry in os.listdir(SHARED_ARRAY_DIR):
+        if entry.startswith(prefix) and entry != key and "." not in entry:
+            path = os.path.join(SHARED_ARRAY_DIR, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _exclusive(lock_path):
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
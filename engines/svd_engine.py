@@ -1,48 +1,228 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
-from azure_helpers.blob_utils import load_model_from_blob_storage
+from azure_helpers.blob_utils import get_blob_etag, load_model_from_blob_storage
+from engines.shared_arrays import SHARED_ARRAYS_ENABLED, cache_key, load_or_publish
 from function_app_logging import get_logger
+from function_app_memory import footprint
 logger = get_logger("svdpp_engine")
 
+
+def estimate_ratings(global_mean: float, rating_scale, item_bias: np.ndarray, item_factors: np.ndarray,
+                     user: Optional[Tuple[float, np.ndarray]] = None) -> np.ndarray:
+    """
+    est = global_mean + b_i (+ b_u + q_i . p_u for a known user), clipped to
+    the rating scale, for the items whose biases and factors are given.
+    """
+    est = global_mean + item_bias
+    if user is not None:
+        est = est + user[0] + item_factors @ user[1]
+    return np.clip(est, *rating_scale)
+
+
+def factors_from_surprise(model, trainset=None) -> Dict[str, np.ndarray]:
+    """
+    Flatten a fitted surprise SVD/SVD++ model into dense arrays.
+
+    The SVD++ implicit-feedback term |I(u)|^-1/2 * sum(y_j) only depends on the
+    training set, so it is folded into the user factors once here:
+    est(u, i) = global_mean + b_u + b_i + q_i . user_factors[u]
+
+    Returns:
+        Dict[str, np.ndarray]: global_mean, rating_scale, user_ids, item_ids,
+                               user_bias, item_bias, user_factors, item_factors.
+    """
+    trainset = trainset if trainset is not None else model.trainset
+    biased = getattr(model, "biased", True)
+
+    user_factors = np.array(model.pu, dtype=np.float64, copy=True)
+    if hasattr(model, "yj"):
+        for u, ratings in trainset.ur.items():
+            items = [j for j, _ in ratings]
+            if items:
+                user_factors[u] += model.yj[items].sum(axis=0) / np.sqrt(len(items))
+
+    return {
+        "global_mean": np.array([trainset.global_mean if biased else 0.0]),
+        "rating_scale": np.array(trainset.rating_scale, dtype=np.float64),
+        "user_ids": np.array([trainset.to_raw_uid(u) for u in range(trainset.n_users)], dtype=np.int64),
+        "item_ids": np.array([trainset.to_raw_iid(i) for i in range(trainset.n_items)], dtype=np.int64),
+        "user_bias": np.asarray(model.bu if biased else np.zeros(trainset.n_users), dtype=np.float64),
+        "item_bias": np.asarray(model.bi if biased else np.zeros(trainset.n_items), dtype=np.float64),
+        "user_factors": user_factors,
+        "item_factors": np.asarray(model.qi, dtype=np.float64),
+    }
+
+
+def factors_from_artifact(artifact: dict) -> Dict[str, np.ndarray]:
+    """
+    Return dense factors from a model artifact: either the "factors" dict
+    written by array-based trainers, or derived from a surprise "model".
+    """
+    if artifact.get("factors") is not None:
+        return artifact["factors"]
+    model = artifact["model"]
+    trainset = artifact.get("trainset")
+    if trainset is None:
+        logger.warning("Model artifact missing trainset; using the model's own trainset.")
+    return factors_from_surprise(model, trainset)
+
+
 class SVDRecommendationEngine:
     """
     SVD++ collaborative filtering engine for personalized article recommendations.
+    Scores candidates with vectorized dot products over the model's factor matrices.
     """
 
-    def __init__(self, model_path, storage_mode='blob'):
+    def __init__(self, model_path, storage_mode='blob', item_side: bool = True):
         """
-        Initialize the model. If a trained model exists, it is loaded;
-        otherwise, a new model is trained and saved.
+        Initialize the model from a trained artifact (surprise SVD++ or dense factors).
+        With `item_side=False` only the user biases and factors are kept
+        (`user_vector` only), for processes whose items are scored elsewhere.
         """
         logger.info("Initializing SVDRecommendationEngine... Loading model.")
-        self.model, self.trainset = self._load_model(model_path, storage_mode)
-
+        factors = self._load_factors(model_path, storage_mode)
+        if not item_side:
+            # Empty copies rather than views: nothing keeps the item matrices alive
+            factors = {**factors, **{k: np.empty((0,) + factors[k].shape[1:], dtype=factors[k].dtype)
+                                     for k in ("item_ids", "item_bias", "item_factors")}}
+        self._set_factors(factors)
 
-    def _load_model(self, file_path, storage_mode='blob'):
+    def _load_factors(self, file_path, storage_mode='blob'):
         """
-        Load a trained SVD++ model and its training mappings from a pickle file.
+        Load the factor matrices of a trained model. When shared arrays are
+        enabled, the artifact is unpickled by the first worker process only;
+        the others map the published matrices.
         """
-        if storage_mode == 'blob':
+        if storage_mode != 'blob':
+            raise ValueError(f"Unsupported storage mode: {storage_mode}")
+
+        def build():
             try:
-                artifact = load_model_from_blob_storage(blob_name=file_path)
-                model = artifact["model"]
-                trainset = artifact.get("trainset")
-
-                if trainset is None:
-                    logger.warning("Model artifact missing trainset; predictions may be limited.")
-                return model, trainset
-            
+                return factors_from_artifact(load_model_from_blob_storage(blob_name=file_path))
             except Exception as e:
                 logger.exception("Error loading SVD++ model from (%s) %s: %s", storage_mode, file_path, e)
                 raise
-        else:
-            raise
+
+        if SHARED_ARRAYS_ENABLED:
+            try:
+                return load_or_publish(cache_key("svd_factors", file_path, get_blob_etag(file_path)), build)
+            except OSError as e:
+                logger.warning("Shared factors unavailable, loading privately: %s", e)
+        return build()
+
+    def _set_factors(self, factors):
+        self.global_mean = float(factors["global_mean"][0])
+        self.rating_scale = tuple(float(x) for x in factors["rating_scale"])
+        self.user_ids = factors["user_ids"]
+        self.item_ids = factors["item_ids"]
+        self.user_bias = factors["user_bias"]
+        self.item_bias = factors["item_bias"]
+        self.user_factors = factors["user_factors"]
+        self.item_factors = factors["item_factors"]
+
+        # Sorted views for vectorized raw id -> inner index lookups
+        self._user_order = np.argsort(self.user_ids, kind="stable")
+        self._item_order = np.argsort(self.item_ids, kind="stable")
+        self._sorted_user_ids = self.user_ids[self._user_order]
+        self._sorted_item_ids = self.item_ids[self._item_order]
+        logger.info("Loaded factors for %d users and %d items.", len(self.user_ids), len(self.item_ids))
+
+    def memory_footprint(self) -> dict:
+        """Resident size of the factor matrices and id lookups (see function_app_memory.footprint)."""
+        return footprint(
+            user_factors=self.user_factors, item_factors=self.item_factors,
+            user_bias=self.user_bias, item_bias=self.item_bias,
+            user_ids=self.user_ids, item_ids=self.item_ids,
+            user_order=self._user_order, item_order=self._item_order,
+            sorted_user_ids=self._sorted_user_ids, sorted_item_ids=self._sorted_item_ids,
+        )
+
+    def to_inner_uid(self, user_id: int) -> Optional[int]:
+        """Inner index of a raw user id, or None if the user is unknown."""
+        pos = np.searchsorted(self._sorted_user_ids, user_id)
+        if pos < len(self._sorted_user_ids) and self._sorted_user_ids[pos] == user_id:
+            return int(self._user_order[pos])
+        return None
+
+    def to_inner_iids(self, item_ids) -> np.ndarray:
+        """Inner indices of raw item ids; -1 where the item is unknown."""
+        item_ids = np.asarray(item_ids, dtype=np.int64)
+        if len(self._sorted_item_ids) == 0:
+            return np.full(len(item_ids), -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_item_ids, item_ids)
+        pos = np.minimum(pos, len(self._sorted_item_ids) - 1)
+        found = self._sorted_item_ids[pos] == item_ids
+        return np.where(found, self._item_order[pos], -1)
+
+    def user_vector(self, user_id: int) -> Optional[Tuple[float, np.ndarray]]:
+        """Bias and factors (b_u, p_u) of a user, or None if the user is unknown."""
+        u = self.to_inner_uid(user_id)
+        if u is None:
+            return None
+        return float(self.user_bias[u]), np.asarray(self.user_factors[u])
+
+    def estimate(self, user_id: int, inner_iids: np.ndarray) -> np.ndarray:
+        """
+        Raw rating estimates for known inner item ids, clipped to the rating
+        scale. Unknown users get the baseline global_mean + b_i.
+        """
+        return estimate_ratings(self.global_mean, self.rating_scale, self.item_bias[inner_iids],
+                                self.item_factors[inner_iids], self.user_vector(user_id))
+
     # -------------------------------------------------------------------------
     # Recommendation Logic
     # -------------------------------------------------------------------------
 
+    def score_candidates(self, user_id: int, candidates) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Min-max normalized estimates of the known candidates.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Known candidate ids (input order) and their scores in [0, 1].
+        """
+        candidates = np.asarray(candidates, dtype=np.int64)
+        inner = self.to_inner_iids(candidates)
+        known = inner >= 0
+        if not known.any():
+            return candidates[:0], np.empty(0)
+        logger.debug(f'Found {int(known.sum())} candidates ({int((~known).sum())} not in training set).')
+
+        scores = self.estimate(user_id, inner[known])
+        min_s, max_s = scores.min(), scores.max()
+        norm_scores = (scores - min_s) / (max_s - min_s) if max_s > min_s else np.zeros_like(scores)
+        return candidates[known], norm_scores
+
+    def score_candidates_batch(self, requests: List[Tuple[int, np.ndarray]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        `score_candidates` of several (user_id, candidates) requests, with the
+        item factors multiplied by all the known users' factors at once
+        (engines.micro_batcher).
+        """
+        users = [self.user_vector(user_id) for user_id, _ in requests]
+        known_users = [i for i, user in enumerate(users) if user is not None]
+        # items x known users: one pass over the item factors for the whole batch
+        dots = self.item_factors @ np.stack([users[i][1] for i in known_users]).T if known_users else None
+        column = {i: c for c, i in enumerate(known_users)}
+
+        results = []
+        for i, (_, candidates) in enumerate(requests):
+            candidates = np.asarray(candidates, dtype=np.int64)
+            inner = self.to_inner_iids(candidates)
+            known = inner >= 0
+            if not known.any():
+                results.append((candidates[:0], np.empty(0)))
+                continue
+            est = self.global_mean + self.item_bias[inner[known]]
+            if users[i] is not None:
+                est = est + users[i][0] + dots[inner[known], column[i]]
+            scores = np.clip(est, *self.rating_scale)
+            min_s, max_s = scores.min(), scores.max()
+            norm_scores = (scores - min_s) / (max_s - min_s) if max_s > min_s else np.zeros_like(scores)
+            results.append((candidates[known], norm_scores))
+        return results
+
     def recommend_for_user(self, user_id: int, candidates: List[int], N: Optional[int] = None):
         """
         Generate SVD++ predictions for a user across a list of candidate articles.
@@ -55,43 +235,20 @@ class SVDRecommendationEngine:
         Returns:
             List[Tuple[int, float]]: (item_id, normalized_score) sorted descending.
         """
-        if not candidates:
+        if candidates is None or len(candidates) == 0:
             logger.info("No candidate items provided for user %s.", user_id)
             return []
 
-        if not self.model or not hasattr(self.model, "predict"):
-            logger.error("SVD++ model not initialized.")
-            return []
-        
-       #  print("Types before inferences - User:", type(user_id), "- Article:", {type(candidates[0])})
-        known_candidates = []
-        for iid in candidates:
-            try:
-                _ = self.model.trainset.to_inner_iid(iid)  # verify presence
-                known_candidates.append(iid)
-            except ValueError:
-                logger.error("Candidate item %s not in training set; skipping.", iid)
-
-        if not known_candidates:
-            logger.info(f'No known candidate items for user {user_id}')
-            return []
-        else:
-            logger.debug(f'Found {len(known_candidates)} candidates.')
         try:
-            preds = [
-                (iid, self.model.predict(user_id, iid).est)
-                for iid in known_candidates
-            ]
-            scores = np.array([score for _, score in preds])
-            if scores.size == 0:
+            ids, norm_scores = self.score_candidates(user_id, candidates)
+            if len(ids) == 0:
+                logger.info(f'No known candidate items for user {user_id}')
                 return []
-            # Normalize scores to [0, 1]
-            min_s, max_s = scores.min(), scores.max()
-            norm_scores = (scores - min_s) / (max_s - min_s) if max_s > min_s else np.zeros_like(scores)
 
-            results = list(zip([iid for iid, _ in preds], norm_scores))
-            results.sort(key=lambda x: x[1], reverse=True)
-            return results[:N] if N else results
+            order = np.argsort(-norm_scores, kind="stable")
+            if N:
+                order = order[:N]
+            return list(zip(ids[order].tolist(), norm_scores[order].tolist()))
 
         except Exception as e:
-            logger.exception("Error generating SVD++ recommendations for user %s: %s", user_id, e)
\ No newline at end of file
+            logger.exception("Error generating SVD++ recommendations for user %s: %s", user_id, e)
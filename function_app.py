@@ -2,11 +2,15 @@ import os, sys
 sys.path.insert(0, os.path.dirname(__file__))
 
 import json
+from functools import partial
 import azure.functions as func
 from azure.cosmos.exceptions import CosmosHttpResponseError
 from opencensus.ext.azure.log_exporter import AzureLogHandler
 
 from function_app_logging import get_logger
+from function_app_tracing import get_latency_snapshot, get_latency_summary, merge_latency_snapshots
+# Imported before the engines so MemoryTracingEnabled also traces their startup
+import function_app_memory
 logger = get_logger('function-app')
 logger.debug("Initializing FunctionApp instance...")
 
@@ -19,7 +23,8 @@ except Exception as e:
 
 # Import dependencies
 try:
-    from engines.hybrid_engine import HybridRecommendationEngine
+    from engines.hybrid_engine import BATCH_WINDOW_MS, CATALOGUE_SHARDS, Deadline, HybridRecommendationEngine
+    from engines.ranked_list_cache import decode_cursor
     logger.debug("HybridRecommendationEngine module imported successfully.")
 except Exception as e:
     logger.exception(f"Failed to import HybridRecommendationEngine: {e}")
@@ -32,23 +37,101 @@ except Exception as e:
     logger.exception(f"Failed to import azure_helper.data_loading: {e}")
     raise
 
+try:
+    from function_app_executor import EXECUTOR_KIND, EngineExecutor, run_io
+    logger.debug("function_app_executor module imported successfully.")
+except Exception as e:
+    logger.exception(f"Failed to import function_app_executor: {e}")
+    raise
+
 # Initialize engine
 try:
-    engine = HybridRecommendationEngine(n_recs=5)
+    executor_kind = EXECUTOR_KIND
+    if CATALOGUE_SHARDS > 1:
+        # The shard processes already score in parallel: one engine, hence one set of shards, per host process
+        if executor_kind == "process":
+            logger.warning("CatalogueShards is set: running the engine executor in thread mode.")
+            executor_kind = "thread"
+        if int(os.getenv("FUNCTIONS_WORKER_PROCESS_COUNT", "1")) > 1:
+            logger.warning("CatalogueShards is set: every Functions worker process starts its own shards.")
+    engine_factory = partial(HybridRecommendationEngine, n_recs=5)
+    if executor_kind == "process":
+        # Clicks are recorded in this process: worker processes read histories from Cosmos.
+        # Each worker scores one request at a time, so micro-batches would never form there
+        if BATCH_WINDOW_MS > 0:
+            logger.warning("MicroBatchWindowMs is ignored by the process executor.")
+        engine_factory = partial(engine_factory, cache_histories=False, batch_window_ms=0)
+    engine = engine_factory()
     logger.info("HybridRecommendationEngine initialized.")
 except Exception as e:
     logger.exception("Failed to initialize HybridRecommendationEngine: {e}")
     raise
 
+# Seconds clients may reuse a recommendation response before revalidating it with its ETag
+CACHE_MAX_AGE = int(os.getenv("RecommendationCacheMaxAge", "0"))
+
+# CPU-bound scoring runs on a bounded pool so the worker keeps serving other requests
+try:
+    executor = EngineExecutor(engine, engine_factory, kind=executor_kind)
+except Exception as e:
+    logger.exception(f"Failed to initialize engine executor: {e}")
+    raise
+
 
 @app.route(route="ping")
 def ping(req: func.HttpRequest) -> func.HttpResponse:
     return func.HttpResponse("Ping received.")
 
 
+@app.route(route="diagnostics/latency", methods=["get"])
+async def diagnostics_latency(req: func.HttpRequest) -> func.HttpResponse:
+    if executor.kind == "process":
+        # Requests are scored in the worker processes: pool their spans with this process's
+        workers = await executor.call_all(get_latency_snapshot)
+        report = merge_latency_snapshots([get_latency_snapshot(), *workers.values()])
+        report["workers"] = len(workers)
+    else:
+        report = get_latency_summary()
+    # Per process id: the engines of the worker processes in process mode (where batching is off)
+    report["micro_batching"] = await executor.call_all("batching_stats")
+    return func.HttpResponse(
+        json.dumps(report, indent=2),
+        mimetype="application/json",
+        status_code=200
+    )
+
+
+@app.route(route="diagnostics/memory", methods=["get"])
+async def diagnostics_memory(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        include_objects = req.params.get("objects", "false").lower() == "true"
+        top = int(req.params.get("top", "10"))
+    except ValueError:
+        return func.HttpResponse("top must be an integer", status_code=400)
+
+    # Walking traces and objects is slow: keep it off the event loop
+    report = await run_io(engine.memory_diagnostics, include_objects, top)
+    if executor.kind == "process":
+        # Request traffic is served by worker processes, each with its own engine
+        report["worker"] = await executor.call("memory_diagnostics", include_objects, top)
+    return func.HttpResponse(
+        json.dumps(report, indent=2),
+        mimetype="application/json",
+        status_code=200
+    )
+
+
+def _client_etags(req: func.HttpRequest) -> tuple:
+    """Entity tags of the request's If-None-Match, weak prefixes dropped (weak comparison, as for GET)."""
+    header = req.headers.get("If-None-Match")
+    if not header:
+        return ()
+    return tuple(tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
 logger.debug("Initializing route recommendations.")
 @app.route(route="recommendations", methods=["get"])
-def recommendations(req: func.HttpRequest) -> func.HttpResponse:
+async def recommendations(req: func.HttpRequest) -> func.HttpResponse:
     logger.info(f'Recommendations HTTP trigger was called.')
     try:
         # Try query parameters first
@@ -63,32 +146,105 @@ def recommendations(req: func.HttpRequest) -> func.HttpResponse:
                 pass  # ignore JSON parse errors
         # Convert to int if provided
         user_id = int(user_id) if user_id is not None else None
+        budget_ms = req.params.get("budget_ms")
+        # The budget starts now, so time spent waiting for the executor counts against it
+        deadline = Deadline.from_budget(float(budget_ms) if budget_ms else None)
+        # Paging: `limit` and/or the X-Next-Cursor value of the previous page
+        limit = req.params.get("limit")
+        limit = int(limit) if limit else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be a positive integer")
+        cursor = req.params.get("cursor") or None
+        if cursor:
+            decode_cursor(cursor)
         logger.debug(f"user_id={user_id}")
-
-        try:
-            recs = engine.recommend(user_id) # type: ignore
-            return func.HttpResponse(
-                json.dumps(recs, ensure_ascii=False, indent=2),
-                mimetype="application/json",
-                status_code=200
-            )
-        except:
-            return func.HttpResponse(
-                "Invalid type for passed arguments. Please provide integers.",
-                status_code=200
-            )
     except Exception as e:
-        logger.exception("Error generating recommendations")
+        logger.exception("Invalid recommendations request")
         return func.HttpResponse(
             json.dumps({"error": str(e)}),
             mimetype="application/json",
             status_code=400
         )
+
+    # The ETag is computed by the engine that renders the body, from the same
+    # history and score snapshot; a client holding the current answer gets a
+    # 304 without any scoring
+    cache_control = f"{'private' if user_id else 'public'}, max-age={CACHE_MAX_AGE}"
+    if_none_match = _client_etags(req)
+    etag = None
+    headers = {}
+    try:
+        if limit or cursor:
+            body, next_cursor, report, etag = await executor.call("recommend_page_json", user_id, limit, cursor,
+                                                                  deadline, if_none_match)
+            if report["ran"]:
+                headers["X-Recommendation-Stages"] = ",".join(report["ran"])
+            if report["dropped"]:
+                headers["X-Recommendation-Dropped"] = ",".join(report["dropped"])
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+        elif not user_id:
+            # Anonymous traffic: precomputed ranking, no executor round trip
+            body, report, etag = engine.recommend_json(None, deadline, if_none_match)
+        else:
+            body, report, etag = await executor.call("recommend_json", user_id, deadline, if_none_match)
+            headers["X-Recommendation-Stages"] = ",".join(report["ran"])
+            if report["dropped"]:
+                headers["X-Recommendation-Dropped"] = ",".join(report["dropped"])
+    except Exception:
+        # Degrade to the popularity/freshness ranking rather than failing the request
+        logger.exception("Error generating recommendations; serving fallback ranking")
+        body = engine.anonymous_recommendations_json()
+        headers["X-Recommendation-Degraded"] = "error"
+
+    if body is None:
+        return func.HttpResponse(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+    if etag is None or "X-Recommendation-Dropped" in headers or "X-Recommendation-Degraded" in headers:
+        # Partial answers are not the entity the ETag names: never reuse them
+        headers["Cache-Control"] = "no-store"
+    else:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = cache_control
+
+    return func.HttpResponse(
+        body,
+        headers=headers,
+        mimetype="application/json",
+        status_code=200
+    )
 logger.info("Route '/recommendations' registered.")
 
+logger.debug("Initializing route clicks.")
+@app.route(route="clicks", methods=["post"])
+async def clicks(req: func.HttpRequest) -> func.HttpResponse:
+    logger.debug(f'clicks HTTP trigger was called.')
+    try:
+        req_body = req.get_json()
+        user_id = int(req_body["user_id"])
+        article_id = int(req_body["article_id"])
+        session_id = req_body.get("session_id")
+        click_timestamp = req_body.get("click_timestamp")
+        session_id = int(session_id) if session_id is not None else None
+        click_timestamp = int(click_timestamp) if click_timestamp is not None else None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return func.HttpResponse(
+            "Expected a JSON body with integer user_id and article_id "
+            "(optional session_id, click_timestamp in epoch ms).",
+            status_code=400
+        )
+
+    try:
+        item = await run_io(db.record_click, user_id, article_id, session_id, click_timestamp)
+        return func.HttpResponse(json.dumps(item), mimetype="application/json", status_code=201)
+    except Exception as e:
+        logger.error(f"Error recording click: {e}")
+        return func.HttpResponse("Internal server error", status_code=500)
+logger.info("Route '/clicks' registered.")
+
 logger.debug("Initializing route random_users")
 @app.route(route="random_users", methods=["get"])
-def random_users(req: func.HttpRequest) -> func.HttpResponse:
+async def random_users(req: func.HttpRequest) -> func.HttpResponse:
     logger.debug(f'random_users HTTP trigger was called.')
     try:
         # Try query parameters first
@@ -99,7 +255,7 @@ def random_users(req: func.HttpRequest) -> func.HttpResponse:
         if n_users is not None and not isinstance(n_users, int):
             return func.HttpResponse("Invalid n_users parameter", status_code=400)
 
-        users = db.get_random_users(n_users) if n_users else db.get_random_users(10)
+        users = await run_io(db.get_random_users, n_users if n_users else 10)
         return func.HttpResponse(json.dumps(users), mimetype="application/json")
 
     except ValueError:
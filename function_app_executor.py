@@ -0,0 +1,123 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+
+from function_app_logging import get_logger
+logger = get_logger("function-app-executor")
+
+# "thread": share the module-level engine (NumPy/BLAS release the GIL).
+# "process": one engine per worker process, fully parallel Python code.
+EXECUTOR_KIND = os.getenv("RecommendationExecutor", "thread").lower()
+MAX_WORKERS = int(os.getenv("RecommendationWorkers", str(os.cpu_count() or 1)))
+# Requests allowed in flight (running or queued on the pool) before callers wait.
+MAX_CONCURRENT = int(os.getenv("MaxConcurrentRecommendations", str(2 * MAX_WORKERS)))
+# Seconds a worker waits for the others during `call_all` before answering anyway.
+BROADCAST_TIMEOUT = 2.0
+
+# Engine owned by a worker process, and the barrier shared by all workers (process mode only).
+_worker_engine = None
+_worker_barrier = None
+
+
+def _init_worker(engine_factory, barrier=None):
+    global _worker_engine, _worker_barrier
+    _worker_barrier = barrier
+    _worker_engine = engine_factory()
+
+
+def _call_worker_engine(method, *args):
+    return getattr(_worker_engine, method)(*args)
+
+
+def _call_every_worker(target, *args):
+    result = _call_worker_engine(target, *args) if isinstance(target, str) else target(*args)
+    # Held until every worker has its call, so no worker takes two of them
+    try:
+        _worker_barrier.wait(BROADCAST_TIMEOUT)
+    except threading.BrokenBarrierError:
+        pass
+    return os.getpid(), result
+
+
+class EngineExecutor:
+    """
+    Runs CPU-bound engine calls off the event loop on a bounded pool.
+
+    In thread mode, calls go to `engine` directly and carry the caller's
+    context (tracing spans included). In process mode, each worker builds
+    its own engine from `engine_factory`, which must be picklable, and
+    tracing histograms are recorded in the worker processes.
+    """
+
+    def __init__(self, engine, engine_factory=None, kind: str = EXECUTOR_KIND,
+                 max_workers: int = MAX_WORKERS, max_concurrent: int = MAX_CONCURRENT):
+        self.engine = engine
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_concurrent = max(1, max_concurrent)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        if kind == "process":
+            if engine_factory is None:
+                raise ValueError("Process executor requires an engine_factory.")
+            context = mp.get_context("spawn")
+            self._barrier = context.Barrier(self.max_workers)
+            self._broadcast_lock = asyncio.Lock()
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(engine_factory, self._barrier)
+            )
+        elif kind == "thread":
+            self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="recommend")
+        else:
+            raise ValueError(f"Unknown executor kind: {kind}")
+        logger.info("Engine executor ready (%s, workers=%d, max_concurrent=%d).",
+                    self.kind, self.max_workers, self.max_concurrent)
+
+    async def call(self, method: str, *args):
+        """
+        Await `engine.<method>(*args)` on the pool, waiting for a free slot
+        when `max_concurrent` calls are already in flight.
+        """
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            if self.kind == "process":
+                return await loop.run_in_executor(self.pool, _call_worker_engine, method, *args)
+            ctx = contextvars.copy_context()
+            return await loop.run_in_executor(self.pool, ctx.run, getattr(self.engine, method), *args)
+
+    async def call_all(self, target, *args) -> dict:
+        """
+        Run `target` once in every worker process: an engine method name, or
+        a picklable module-level function (e.g. per-process diagnostics).
+        Workers wait for each other, up to BROADCAST_TIMEOUT seconds, so each
+        takes exactly one call; a worker busy for longer may be missing.
+        Diagnostics only: it bypasses `max_concurrent`.
+
+        Returns:
+            Dict[int, Any]: Result by worker pid (this process only, in thread mode).
+        """
+        if self.kind != "process":
+            result = await self.call(target, *args) if isinstance(target, str) else target(*args)
+            return {os.getpid(): result}
+        async with self._broadcast_lock:
+            if self._barrier.broken:
+                self._barrier.reset()
+            loop = asyncio.get_running_loop()
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self.pool, _call_every_worker, target, *args) for _ in range(self.max_workers)
+            ])
+        return dict(results)
+
+
+async def run_io(fn, *args):
+    """
+    Await a blocking I/O call (Cosmos, Blob) on the default thread pool,
+    leaving the event loop free for other requests.
+    """
+    return await asyncio.to_thread(fn, *args)
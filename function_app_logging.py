@@ -1,8 +1,26 @@
 from azure_helpers.blob_logger import AzureBlobLogHandler
 import os, sys, logging
 
+# One queue-backed blob handler (and writer thread) shared by every logger.
+_blob_handler = None
 
-def get_logger(name, blob_conn_str=os.environ["AzureBlobStorageConnectionString"]):
+
+def _get_blob_handler(blob_conn_str):
+    global _blob_handler
+    if _blob_handler is None:
+        _blob_handler = AzureBlobLogHandler(
+            conn_str=blob_conn_str,
+            container_name="azure-bookrec-models-blob",
+            blob_prefix="app",
+            queue_size=int(os.getenv("BlobLogQueueSize", "10000")),
+            batch_size=int(os.getenv("BlobLogBatchSize", "500")),
+            flush_interval=float(os.getenv("BlobLogFlushSeconds", "2.0")),
+        )
+        _blob_handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
+    return _blob_handler
+
+
+def get_logger(name, blob_conn_str=None):
     logger = logging.getLogger(name=name)
     logger.setLevel(logging.INFO)
 
@@ -11,15 +29,15 @@ def get_logger(name, blob_conn_str=os.environ["AzureBlobStorageConnectionString"
     console.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
     logger.addHandler(console)
 
-    # Blob handler
-    blob_conn = blob_conn_str   # same storage as function
-    handler = AzureBlobLogHandler(
-        conn_str=blob_conn,
-        container_name="azure-bookrec-models-blob",
-        blob_prefix="app"
-    )
-    handler.setFormatter(logging.Formatter("%(asctime)s | %(levelname)s | %(message)s"))
-    logger.addHandler(handler)
+    # Without a storage connection string (offline tools, benchmarks) log to the console only
+    blob_conn_str = blob_conn_str or os.getenv("AzureBlobStorageConnectionString")
+    if not blob_conn_str:
+        return logger
+
+    # Blob handler (same storage as function), batched off the request thread
+    handler = _get_blob_handler(blob_conn_str)
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
 
     logger.info("Blob logging initialized.")
     return logger
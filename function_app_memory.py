@@ -0,0 +1,259 @@
+import gc
+import mmap
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# Trace Python allocations (startup per component, per request) with tracemalloc.
+# Adds CPU and memory overhead: turn on while investigating, not permanently.
+TRACEMALLOC_ENABLED = os.getenv("MemoryTracingEnabled", "false").lower() == "true"
+# Stack frames kept per traced allocation (more frames, more overhead).
+TRACEMALLOC_FRAMES = int(os.getenv("MemoryTracingFrames", "1"))
+
+if TRACEMALLOC_ENABLED and not tracemalloc.is_tracing():
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+_startup = {}  # component -> bytes allocated while it loaded
+_startup_snapshot = None
+_requests = {}  # name -> _Allocations
+_lock = threading.Lock()
+
+
+# -------------------------------------------------------------------------
+# Footprints
+# -------------------------------------------------------------------------
+def _is_mapped(array) -> bool:
+    # Views of a memory map (engines.shared_arrays returns plain ndarrays) reach it through .base
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def array_footprint(array: np.ndarray) -> dict:
+    """
+    Size of an array. Memory-mapped arrays (engines.shared_arrays) and their
+    views are reported as shared: they live in the page cache, once per instance.
+    """
+    return {
+        "bytes": int(array.nbytes),
+        "shape": list(array.shape),
+        "dtype": str(array.dtype),
+        "shared": _is_mapped(array),
+    }
+
+
+def frame_footprint(df: pd.DataFrame) -> dict:
+    """Deep size of a DataFrame (object columns included)."""
+    return {"bytes": int(df.memory_usage(deep=True).sum()), "rows": len(df), "columns": df.shape[1]}
+
+
+def mapping_footprint(mapping: dict) -> dict:
+    """Size of a dict with its keys and values (shallow per entry)."""
+    size = sys.getsizeof(mapping) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in mapping.items())
+    return {"bytes": int(size), "entries": len(mapping)}
+
+
+def footprint(**parts) -> dict:
+    """
+    Combine named arrays, DataFrames, dicts (see mapping_footprint) or nested
+    footprints into one report with private and shared byte totals.
+    None parts are skipped.
+    """
+    components, private, shared = {}, 0, 0
+    for name, value in parts.items():
+        if value is None:
+            continue
+        if isinstance(value, np.ndarray):
+            entry = array_footprint(value)
+        elif isinstance(value, pd.DataFrame):
+            entry = frame_footprint(value)
+        elif isinstance(value, dict) and "private_bytes" in value:
+            entry = value
+        elif isinstance(value, dict):
+            entry = mapping_footprint(value)
+        else:
+            entry = {"bytes": sys.getsizeof(value)}
+        components[name] = entry
+
+        if "private_bytes" in entry:
+            private += entry["private_bytes"]
+            shared += entry["shared_bytes"]
+        elif entry.get("shared"):
+            shared += entry["bytes"]
+        else:
+            private += entry["bytes"]
+    return {"private_bytes": private, "shared_bytes": shared, "components": components}
+
+
+# -------------------------------------------------------------------------
+# tracemalloc: startup and per-request allocations
+# -------------------------------------------------------------------------
+class _Allocations:
+    """Per-request allocation stats of one name: net retained bytes and peak above the start."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_net = 0
+        self.max_net = 0
+        self.total_peak = 0
+        self.max_peak = 0
+
+    def record(self, net: int, peak: int):
+        self.count += 1
+        self.total_net += net
+        self.max_net = max(self.max_net, net)
+        self.total_peak += peak
+        self.max_peak = max(self.max_peak, peak)
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_net_bytes": self.total_net // max(self.count, 1),
+            "max_net_bytes": self.max_net,
+            "mean_peak_bytes": self.total_peak // max(self.count, 1),
+            "max_peak_bytes": self.max_peak,
+        }
+
+
+class _Track:
+    __slots__ = ("name", "on_exit", "start")
+
+    def __init__(self, name, on_exit):
+        self.name = name
+        self.on_exit = on_exit
+
+    def __enter__(self):
+        self.start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc):
+        current, peak = tracemalloc.get_traced_memory()
+        self.on_exit(self.name, current - self.start, max(peak - self.start, 0))
+        return False
+
+
+class _NoopTrack:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTrack()
+
+
+def _record_startup(name, net, peak):
+    with _lock:
+        _startup[name] = {"net_bytes": net, "peak_bytes": peak}
+
+
+def _record_request(name, net, peak):
+    with _lock:
+        _requests.setdefault(name, _Allocations()).record(net, peak)
+
+
+def track_startup(name: str):
+    """Record what loading component `name` allocated. A no-op unless MemoryTracingEnabled."""
+    return _Track(name, _record_startup) if tracemalloc.is_tracing() else _NOOP
+
+
+def track_request(name: str):
+    """
+    Record the allocations of one request. tracemalloc counters are
+    process-wide: concurrent requests blur each other's figures, so profile
+    at low concurrency. A no-op unless MemoryTracingEnabled.
+    """
+    return _Track(name, _record_request) if tracemalloc.is_tracing() else _NOOP
+
+
+def mark_startup():
+    """Snapshot allocations once engines are loaded; later reports show growth since."""
+    global _startup_snapshot
+    if tracemalloc.is_tracing():
+        _startup_snapshot = tracemalloc.take_snapshot()
+
+
+def top_allocations(limit: int = 10) -> list:
+    """
+    Largest allocation sites by source line: growth since `mark_startup`
+    when a startup snapshot exists, current totals otherwise.
+    """
+    if not tracemalloc.is_tracing():
+        return []
+    exclude = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    snapshot = tracemalloc.take_snapshot().filter_traces(exclude)
+    if _startup_snapshot is not None:
+        stats = snapshot.compare_to(_startup_snapshot.filter_traces(exclude), "lineno")
+    else:
+        stats = snapshot.statistics("lineno")
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "bytes": stat.size,
+            "bytes_diff": getattr(stat, "size_diff", None),
+            "count": stat.count,
+        }
+        for stat in stats[:limit]
+    ]
+
+
+# -------------------------------------------------------------------------
+# Process
+# -------------------------------------------------------------------------
+def process_memory() -> dict:
+    """Resident set size now and at its peak, in bytes (from /proc where available)."""
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return {
+            "rss_bytes": int(fields["VmRSS"].split()[0]) * 1024,
+            "peak_rss_bytes": int(fields["VmHWM"].split()[0]) * 1024,
+        }
+    except (OSError, KeyError, ValueError):
+        try:
+            import resource
+            # Kilobytes on Linux, bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return {"peak_rss_bytes": peak if sys.platform == "darwin" else peak * 1024}
+        except ImportError:
+            return {}
+
+
+def object_counts(limit: int = 15) -> list:
+    """Most common live object types tracked by the garbage collector (slow: walks every object)."""
+    counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+    return [{"type": name, "count": count} for name, count in counts.most_common(limit)]
+
+
+def get_memory_summary(include_objects: bool = False, top: int = 10) -> dict:
+    """
+    Process-level memory report: RSS, tracemalloc totals, startup allocations
+    per component, per-request allocation stats and top allocation sites.
+    """
+    summary = {"pid": os.getpid(), "process": process_memory(), "tracemalloc": {"enabled": tracemalloc.is_tracing()}}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        with _lock:
+            startup = dict(_startup)
+            requests = {name: stats.summary() for name, stats in sorted(_requests.items())}
+        summary["tracemalloc"].update({
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "startup": startup,
+            "requests": requests,
+            "top_allocations": top_allocations(top),
+        })
+    if include_objects:
+        summary["objects"] = object_counts()
+    return summary
@@ -0,0 +1,217 @@
+import contextvars
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Fraction of requests whose stages are timed (0 disables tracing entirely).
+SAMPLE_RATE = float(os.getenv("TracingSampleRate", "0"))
+# Number of most recent samples kept per span for percentile estimates.
+WINDOW_SIZE = int(os.getenv("TracingWindowSize", "1024"))
+# Forward span durations to Application Insights through opencensus.
+EXPORT_ENABLED = os.getenv("TracingExportEnabled", "false").lower() == "true"
+
+_sampled = contextvars.ContextVar("trace_sampled", default=False)
+_histograms = {}
+_histograms_lock = threading.Lock()
+_exporter = None
+
+
+class LatencyHistogram:
+    """
+    Rolling latency window for a single span name.
+    Keeps the last `window` durations (ms) plus lifetime count and total.
+    Safe to record into from several threads.
+    """
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def merged(cls, snapshots) -> "LatencyHistogram":
+        """Histogram holding the windows and totals of several `snapshot`s (e.g. one per process)."""
+        snapshots = list(snapshots)
+        hist = cls(window=max(1, sum(len(samples) for samples, _, _ in snapshots)))
+        for samples, count, total_ms in snapshots:
+            hist.samples.extend(samples)
+            hist.count += count
+            hist.total_ms += total_ms
+        return hist
+
+    def record(self, duration_ms: float):
+        with self._lock:
+            self.samples.append(duration_ms)
+            self.count += 1
+            self.total_ms += duration_ms
+
+    def snapshot(self) -> tuple:
+        """(window samples, count, total ms), picklable: merged across processes by `merged`."""
+        with self._lock:
+            return list(self.samples), self.count, self.total_ms
+
+    def summary(self) -> dict:
+        with self._lock:
+            window = np.fromiter(self.samples, dtype=float, count=len(self.samples))
+            count, total_ms = self.count, self.total_ms
+        if window.size == 0:
+            return {"count": count}
+        p50, p95, p99 = np.percentile(window, [50, 95, 99])
+        return {
+            "count": count,
+            "mean_ms": round(total_ms / count, 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(window.max()), 3),
+        }
+
+
+def record(name: str, duration_ms: float):
+    """
+    Add one duration to the histogram of `name` and export it if enabled.
+    """
+    hist = _histograms.get(name)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(name, LatencyHistogram())
+    hist.record(duration_ms)
+    if EXPORT_ENABLED:
+        _export(name, duration_ms)
+
+
+def _export(name, duration_ms):
+    global _exporter
+    if _exporter is None:
+        from opencensus.ext.azure.log_exporter import AzureLogHandler
+        _exporter = logging.getLogger("tracing")
+        _exporter.propagate = False
+        _exporter.setLevel(logging.INFO)
+        # Reads APPLICATIONINSIGHTS_CONNECTION_STRING; batches exports in its own worker.
+        _exporter.addHandler(AzureLogHandler())
+    _exporter.info(
+        "span %s", name,
+        extra={"custom_dimensions": {"span": name, "duration_ms": duration_ms}}
+    )
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Trace(_Span):
+    """Root span: makes the sampling decision for everything nested in it."""
+    __slots__ = ("token",)
+
+    def __enter__(self):
+        self.token = _sampled.set(True)
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        _sampled.reset(self.token)
+        return False
+
+
+def trace(name: str):
+    """
+    Start a sampled request trace. Spans opened inside it (same thread or
+    copied context) are timed only if this request was sampled.
+    """
+    if SAMPLE_RATE > 0 and (SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE):
+        return _Trace(name)
+    return _NOOP
+
+
+def span(name: str):
+    """
+    Time a stage of the current request. A no-op outside a sampled trace.
+    """
+    return _Span(name) if _sampled.get() else _NOOP
+
+
+def traced(name: str):
+    """Decorator form of `span`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _sampled.get():
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_latency_summary() -> dict:
+    """
+    Percentile summary of every recorded span, keyed by span name.
+    """
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {
+        "sample_rate": SAMPLE_RATE,
+        "spans": {name: hist.summary() for name, hist in sorted(items)},
+    }
+
+
+def get_latency_snapshot() -> dict:
+    """
+    Raw window of every recorded span (see LatencyHistogram.snapshot), for
+    merging with other processes' in `merge_latency_snapshots`.
+    """
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {name: hist.snapshot() for name, hist in items}
+
+
+def merge_latency_snapshots(snapshots) -> dict:
+    """
+    Same report as `get_latency_summary`, over the spans of several
+    processes: windows are pooled before the percentiles are taken.
+    """
+    spans = {}
+    for snapshot in snapshots:
+        for name, hist in snapshot.items():
+            spans.setdefault(name, []).append(hist)
+    return {
+        "sample_rate": SAMPLE_RATE,
+        "spans": {name: LatencyHistogram.merged(hists).summary() for name, hists in sorted(spans.items())},
+    }
+
+
+def reset_latency():
+    """Drop every recorded span (e.g. after a warm-up)."""
+    with _histograms_lock:
+        _histograms.clear()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# Modules are imported from the repository root, as function_app does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def environment(request, tmp_path, monkeypatch):
+    """
+    Small stand-in dataset and models installed in place of Cosmos DB and
+    blob storage, yielding (cosmos, blobs). Shared arrays are off unless the
+    test parametrizes the fixture indirectly with True.
+    """
+    from benchmarks.standins import build_environment, install, uninstall
+    import engines.content_based_engine as content_based_engine
+    import engines.covisitation_engine as covisitation_engine
+    import engines.hybrid_engine as hybrid_engine
+    import engines.shared_arrays as shared_arrays
+    import engines.svd_engine as svd_engine
+
+    shared = getattr(request, "param", False)
+    if shared:
+        # Spawned processes (shards) read the shared-array settings from the environment
+        monkeypatch.setenv("SharedArraysEnabled", "true")
+        monkeypatch.setenv("SharedArrayDir", str(tmp_path))
+        monkeypatch.setattr(shared_arrays, "SHARED_ARRAY_DIR", str(tmp_path))
+    for module in (content_based_engine, covisitation_engine, svd_engine, hybrid_engine):
+        monkeypatch.setattr(module, "SHARED_ARRAYS_ENABLED", shared)
+    cosmos, blobs = build_environment(n_articles=1_500, n_users=300, n_clicks=6_000, dim=16, n_factors=8)
+    install(cosmos, blobs)
+    yield cosmos, blobs
+    uninstall()
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from engines.batch_scoring import build_scoring_arrays, score_users
+
+
+def test_users_with_few_unseen_articles_get_padded_rows():
+    n_articles = 6
+    scores = pd.DataFrame({"article_id": np.arange(n_articles),
+                           "freshness_score": np.linspace(0, 1, n_articles),
+                           "popularity_score": np.linspace(1, 0, n_articles)})
+    # User 1 has clicked all but two articles, user 2 a single one
+    clicks = pd.DataFrame({"user_id": [1, 1, 1, 1, 2],
+                           "click_article_id": [0, 1, 2, 3, 5],
+                           "click_timestamp": [1, 2, 3, 4, 5]})
+    rng = np.random.default_rng(0)
+    factors = {
+        "global_mean": np.array([3.0]), "rating_scale": np.array([1.0, 5.0]),
+        "user_ids": np.array([1, 2]), "item_ids": np.arange(n_articles),
+        "user_bias": np.zeros(2), "item_bias": np.zeros(n_articles),
+        "user_factors": rng.normal(size=(2, 3)), "item_factors": rng.normal(size=(n_articles, 3)),
+    }
+    arrays = build_scoring_arrays(scores, clicks, rng.normal(size=(n_articles, 4)), factors)
+
+    ids, values = score_users(arrays, 0, 2, k=4)
+
+    assert sorted(ids[0, :2].tolist()) == [4, 5]
+    assert ids[0, 2:].tolist() == [-1, -1] and np.isnan(values[0, 2:]).all()
+    assert 5 not in ids[1] and np.isfinite(values[1]).all()
+
+
+def test_batch_ranking_matches_served_blend_with_covisitation(environment, monkeypatch):
+    import azure_helpers.data_loading as db
+    from engines.covisitation_engine import build_covisitation, serving_arrays
+    from engines.hybrid_engine import HybridRecommendationEngine
+
+    cosmos, blobs = environment
+    clicks = cosmos.get_all_clicks()
+    blobs.put("covisitation.pkl", {"covisitation": build_covisitation(clicks)})
+    monkeypatch.setenv("CovisitationFile", "covisitation.pkl")
+    engine = HybridRecommendationEngine(n_recs=10)
+
+    arrays = build_scoring_arrays(
+        db.get_articles_scores(), clicks, blobs.load_model_from_blob_storage("articles_embeddings.pkl"),
+        blobs.load_model_from_blob_storage("svdpp_model.pkl")["factors"],
+        serving_arrays(blobs.load_model_from_blob_storage("covisitation.pkl")["covisitation"]),
+    )
+    ids, values = score_users(arrays, 0, 40, k=10)
+
+    for row, user_id in enumerate(arrays["user_ids"][:40].tolist()):
+        if not user_id:
+            continue  # served as anonymous
+        served = engine.recommend(user_id)
+        assert "cv_score" in served[0]
+        assert ids[row].tolist() == [r["article_id"] for r in served]
+        np.testing.assert_allclose(values[row], [r["overall_score"] for r in served], rtol=1e-4)
@@ -0,0 +1,25 @@
+import asyncio
+import os
+
+from function_app_executor import EngineExecutor
+
+
+def test_call_all_reaches_every_worker_process():
+    async def run():
+        executor = EngineExecutor(engine=None, engine_factory=dict, kind="process", max_workers=3)
+        try:
+            return await executor.call_all(os.getpid), await executor.call_all("__len__")
+        finally:
+            executor.pool.shutdown()
+
+    pids, lengths = asyncio.run(run())
+    assert len(pids) == 3 and all(pid == result for pid, result in pids.items())
+    assert set(lengths) == set(pids) and set(lengths.values()) == {0}
+
+
+def test_call_all_in_thread_mode_runs_here():
+    async def run():
+        executor = EngineExecutor(engine=[1, 2], kind="thread", max_workers=2)
+        return await executor.call_all("__len__")
+
+    assert asyncio.run(run()) == {os.getpid(): 2}
@@ -0,0 +1,38 @@
+import threading
+
+from function_app_tracing import LatencyHistogram, merge_latency_snapshots
+
+
+def test_concurrent_records_are_all_counted():
+    hist = LatencyHistogram(window=100)
+
+    def worker():
+        for i in range(20_000):
+            hist.record(float(i % 10))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert hist.count == 8 * 20_000
+    assert hist.total_ms == 8 * 2_000 * sum(range(10))
+    assert len(hist.samples) == 100
+
+
+def test_merged_snapshots_pool_every_process():
+    fast, slow = LatencyHistogram(), LatencyHistogram()
+    for _ in range(90):
+        fast.record(1.0)
+    for _ in range(10):
+        slow.record(100.0)
+
+    report = merge_latency_snapshots([{"recommend": fast.snapshot()}, {"recommend": slow.snapshot(),
+                                                                       "cosmos": slow.snapshot()}])
+
+    merged = report["spans"]["recommend"]
+    assert merged["count"] == 100
+    assert merged["mean_ms"] == 10.9
+    assert merged["p50_ms"] == 1.0 and merged["max_ms"] == 100.0
+    assert report["spans"]["cosmos"]["count"] == 10
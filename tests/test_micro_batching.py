@@ -0,0 +1,37 @@
+import threading
+
+import numpy as np
+
+from engines.hybrid_engine import HybridRecommendationEngine
+
+
+def test_batched_ranking_matches_unbatched(environment):
+    cosmos, _ = environment
+    users = cosmos.get_users()[:24]
+    unbatched = HybridRecommendationEngine(n_recs=10)
+    batched = HybridRecommendationEngine(n_recs=10, batch_window_ms=20)
+    expected = {user_id: unbatched.recommend(user_id) for user_id in users}
+
+    # Released together so their content and CF queries land in the same windows
+    start, ranked = threading.Barrier(len(users)), {}
+
+    def request(user_id):
+        start.wait()
+        ranked[user_id] = batched.recommend(user_id)
+
+    threads = [threading.Thread(target=request, args=(user_id,)) for user_id in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for user_id in users:
+        assert [r["article_id"] for r in ranked[user_id]] == [r["article_id"] for r in expected[user_id]]
+        for a, b in zip(expected[user_id], ranked[user_id]):
+            assert list(a) == list(b)
+            np.testing.assert_allclose(list(b.values()), list(a.values()), rtol=1e-6, atol=1e-9)
+
+    stats = batched.batching_stats()
+    assert stats["content_based"]["mean_batch_size"] > 1
+    assert stats["collaborative_filtering"]["requests"] == stats["content_based"]["requests"]
+    assert unbatched.batching_stats() == {}
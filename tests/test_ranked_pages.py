@@ -0,0 +1,72 @@
+import json
+import time
+
+import engines.hybrid_engine as hybrid_engine
+
+
+def _ids(body):
+    return [record["article_id"] for record in json.loads(body)]
+
+
+def _users(cosmos):
+    # A user id of 0 is served as anonymous
+    return [user_id for user_id in cosmos.get_users() if user_id]
+
+
+def _pages(engine, user_id, limit, n_pages):
+    ids, reports, cursor = [], [], None
+    for _ in range(n_pages):
+        body, cursor, report, _ = engine.recommend_page_json(user_id, limit, cursor)
+        ids.append(_ids(body))
+        reports.append(report)
+    return ids, reports, cursor
+
+
+def test_pages_slice_one_scoring_pass(environment):
+    cosmos, _ = environment
+    engine = hybrid_engine.HybridRecommendationEngine(n_recs=5)
+    user_id = _users(cosmos)[0]
+
+    pages, reports, _ = _pages(engine, user_id, 4, 3)
+    body, _, _, _ = engine.recommend_page_json(user_id, 12)
+
+    assert sum(pages, []) == _ids(body)
+    assert "page_cache" not in reports[0]["ran"]
+    assert all(report["ran"] == ["page_cache"] for report in reports[1:])
+
+
+def test_expired_cursor_recomputes_the_list_at_its_offset(environment, monkeypatch):
+    cosmos, _ = environment
+    monkeypatch.setattr(hybrid_engine, "PAGE_CACHE_TTL_SECONDS", 0.05)
+    engine = hybrid_engine.HybridRecommendationEngine(n_recs=5)
+    user_id = _users(cosmos)[0]
+
+    _, cursor, _, _ = engine.recommend_page_json(user_id, 4)
+    time.sleep(0.1)
+    body, _, report, _ = engine.recommend_page_json(user_id, 4, cursor)
+
+    assert "page_cache" not in report["ran"]
+    assert _ids(body) == _ids(engine.recommend_page_json(user_id, 8)[0])[4:]
+
+
+def test_cursor_of_another_user_is_not_served(environment):
+    cosmos, _ = environment
+    engine = hybrid_engine.HybridRecommendationEngine(n_recs=5)
+    owner, other = _users(cosmos)[:2]
+
+    _, cursor, _, _ = engine.recommend_page_json(owner, 4)
+    body, _, report, _ = engine.recommend_page_json(other, 4, cursor)
+
+    assert "page_cache" not in report["ran"]
+    assert _ids(body) == _ids(engine.recommend_page_json(other, 8)[0])[4:]
+
+
+def test_anonymous_pages_take_no_cache_entries(environment):
+    engine = hybrid_engine.HybridRecommendationEngine(n_recs=5)
+
+    for _ in range(3):
+        pages, reports, _ = _pages(engine, None, 4, 3)
+
+    assert len(engine._pages) == 0
+    assert sum(pages, []) == _ids(engine.recommend_page_json(None, 12)[0])
+    assert all(report["ran"] == ["page_cache"] for report in reports[1:])
@@ -0,0 +1,45 @@
+from functools import partial
+
+import numpy as np
+import pytest
+
+from benchmarks.standins import StandinLoader
+import engines.hybrid_engine as hybrid_engine
+from engines.sharded_scoring import ShardedScorer
+
+
+@pytest.mark.parametrize("environment", [True], indirect=True)
+def test_sharded_ranking_matches_single_process(environment, monkeypatch):
+    cosmos, blobs = environment
+    single = hybrid_engine.HybridRecommendationEngine(n_recs=10)
+
+    # Same dataset and factors in the shard processes, without retraining
+    loader = StandinLoader(
+        clicks=cosmos.get_all_clicks(), articles=cosmos.articles,
+        embeddings=blobs.load_model_from_blob_storage("articles_embeddings.pkl"),
+        factors=blobs.load_model_from_blob_storage("svdpp_model.pkl")["factors"],
+    )
+    monkeypatch.setattr(hybrid_engine, "CATALOGUE_SHARDS", 3)
+    monkeypatch.setattr(hybrid_engine, "ShardedScorer", partial(ShardedScorer, loader=loader))
+    sharded = hybrid_engine.HybridRecommendationEngine(n_recs=10)
+    try:
+        # The coordinator keeps neither the embeddings nor the item factors
+        assert sharded.content_based_engine is None
+        assert len(sharded.cf_engine.item_factors) == 0
+
+        for user_id in cosmos.get_users()[:30]:
+            expected, ranked = single.recommend(user_id), sharded.recommend(user_id)
+            assert [r["article_id"] for r in ranked] == [r["article_id"] for r in expected]
+            for a, b in zip(expected, ranked):
+                assert list(a) == list(b)
+                np.testing.assert_allclose(list(b.values()), list(a.values()), rtol=1e-9)
+    finally:
+        sharded._shards.close()
+
+
+@pytest.mark.parametrize("environment", [True], indirect=True)
+def test_sharding_requires_shared_arrays(environment, monkeypatch):
+    monkeypatch.setattr(hybrid_engine, "CATALOGUE_SHARDS", 2)
+    monkeypatch.setattr(hybrid_engine, "SHARED_ARRAYS_ENABLED", False)
+    with pytest.raises(ValueError):
+        hybrid_engine.HybridRecommendationEngine(n_recs=5)
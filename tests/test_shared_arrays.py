@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import engines.shared_arrays as shared_arrays
+from function_app_memory import footprint
+
+
+@pytest.fixture(autouse=True)
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_arrays, "SHARED_ARRAY_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_published_arrays_are_reported_shared():
+    source = {"factors": np.arange(12, dtype=np.float32).reshape(4, 3), "ids": np.arange(4)}
+    key = shared_arrays.cache_key("test", "blob", "etag-1")
+
+    published = shared_arrays.load_or_publish(key, lambda: source)
+    attached = shared_arrays.attach(key)
+
+    for arrays in (published, attached):
+        np.testing.assert_array_equal(arrays["factors"], source["factors"])
+        report = footprint(**arrays)
+        assert report["private_bytes"] == 0
+        assert report["shared_bytes"] == sum(a.nbytes for a in source.values())
+    # Row views of a mapped array stay in the shared pages
+    assert footprint(rows=attached["factors"][1:3])["shared_bytes"] > 0
+
+
+def test_built_arrays_are_reported_private():
+    report = footprint(factors=np.ones((4, 3)), rows=np.ones((4, 3))[[0, 2]])
+    assert report["shared_bytes"] == 0
+    assert report["private_bytes"] == (4 * 3 + 2 * 3) * 8
+
+
+def test_publishing_prunes_older_versions_unless_disabled():
+    old, new = shared_arrays.cache_key("test", "etag-1"), shared_arrays.cache_key("test", "etag-2")
+    shared_arrays.load_or_publish(old, lambda: {"ids": np.arange(3)})
+    shared_arrays.load_or_publish(new, lambda: {"ids": np.arange(4)})
+    with pytest.raises(FileNotFoundError):
+        shared_arrays.attach(old)
+
+    # One-off keys of concurrent runs share a name: neither may delete the other
+    first, second = shared_arrays.cache_key("run", 1), shared_arrays.cache_key("run", 2)
+    shared_arrays.load_or_publish(first, lambda: {"ids": np.arange(3)}, prune=False)
+    shared_arrays.load_or_publish(second, lambda: {"ids": np.arange(4)}, prune=False)
+    assert len(shared_arrays.attach(first)["ids"]) == 3
+    assert len(shared_arrays.attach(second)["ids"]) == 4
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+
+from azure_helpers.user_history_store import UserHistoryStore
+
+
+def test_clicks_in_order_are_appended():
+    store = UserHistoryStore()
+    store.put(1, [10, 11])
+    now = int(time.time() * 1000)
+
+    assert store.append(1, 12, now + 1)
+    assert store.append(1, 13, now + 1)
+    np.testing.assert_array_equal(store.get(1), [10, 11, 12, 13])
+
+
+def test_late_click_drops_the_cached_history():
+    store = UserHistoryStore()
+    store.put(1, [10, 11])
+    now = int(time.time() * 1000)
+    store.append(1, 12, now + 1000)
+
+    # Older than the newest cached click: it belongs before it, which only Cosmos DB knows
+    assert not store.append(1, 13, now)
+    assert store.get(1) is None
+    assert store.nbytes == 0
+
+
+def test_click_older_than_the_load_drops_the_cached_history():
+    store = UserHistoryStore()
+    store.put(1, [10, 11])
+
+    assert not store.append(1, 12, int(time.time() * 1000) - 60_000)
+    assert store.get(1) is None
+
+
+def test_click_during_a_read_keeps_the_read_out_of_the_store():
+    store = UserHistoryStore()
+    read_at = store.begin_load(1)
+    # Recorded after Cosmos DB answered, before the answer is stored
+    assert not store.append(1, 12)
+
+    history = store.put(1, [10, 11], read_at)
+    np.testing.assert_array_equal(history, [10, 11])
+    assert store.get(1) is None
+
+    # The next read is stored again
+    store.put(1, [10, 11, 12], store.begin_load(1))
+    np.testing.assert_array_equal(store.get(1), [10, 11, 12])
+
+
+def test_click_during_one_of_overlapping_reads_keeps_both_out():
+    store = UserHistoryStore()
+    first, second = store.begin_load(1), store.begin_load(1)
+    store.append(1, 12)
+
+    store.put(1, [10, 11], first)
+    store.put(1, [10, 11], second)
+    assert store.get(1) is None
+
+
+def test_failed_read_does_not_keep_later_reads_out():
+    store = UserHistoryStore()
+    store.begin_load(1)
+    store.cancel_load(1)
+
+    store.put(1, [10, 11], store.begin_load(1))
+    np.testing.assert_array_equal(store.get(1), [10, 11])
@@ -0,0 +1,250 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from azure_helpers.data_loading import (
+    get_interactions, get_user_article_affinity_ratings, list_click_files, read_click_files
+)
+from build_train_als import build_and_train_als_model, predict, train_als
+from build_train_svd import build_and_train_model, fit_svdpp
+from engines.shared_arrays import attach, cache_key, discard, load_or_publish
+from engines.svd_engine import factors_from_surprise
+
+
+# -------------------------------------------------------------------------
+# Search spaces
+# -------------------------------------------------------------------------
+SEARCH_SPACES = {
+    "svdpp": {
+        "n_factors": [20, 50, 100],
+        "n_epochs": [10, 20],
+        "lr_all": [0.002, 0.004, 0.007],
+        "reg_all": [0.02, 0.04, 0.1],
+    },
+    "als": {
+        "n_factors": [32, 64, 100],
+        "n_epochs": [10, 15],
+        "reg": [0.02, 0.05, 0.1, 0.3],
+    },
+}
+
+
+def grid_configs(space: dict) -> list:
+    """Every combination of a {param: [values]} space."""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def random_configs(space: dict, n_iter: int, random_state: int = 42) -> list:
+    """`n_iter` distinct combinations drawn at random (the whole grid if smaller)."""
+    configs = grid_configs(space)
+    if n_iter >= len(configs):
+        return configs
+    rng = np.random.default_rng(random_state)
+    return [configs[i] for i in sorted(rng.choice(len(configs), n_iter, replace=False))]
+
+
+# -------------------------------------------------------------------------
+# Worker side
+# -------------------------------------------------------------------------
+_arrays = None
+
+
+def _init_worker(key):
+    global _arrays
+    # Workers map the published ratings instead of receiving a pickled copy
+    _arrays = attach(key)
+
+
+def _evaluate_task(task):
+    return evaluate_fold(_arrays, *task)
+
+
+def _fit(trainer: str, train_df: pd.DataFrame, params: dict) -> dict:
+    if trainer == "als":
+        return train_als(train_df, **params)
+    model, trainset = fit_svdpp(train_df, **params)
+    return factors_from_surprise(model, trainset)
+
+
+def evaluate_fold(arrays, trainer: str, config_id: int, params: dict, fold: int):
+    """
+    Fit `trainer` with `params` on every fold but `fold` and score RMSE on it.
+
+    Returns:
+        Tuple[int, int, float, float]: config_id, fold, rmse, fit seconds.
+    """
+    ratings = pd.DataFrame({
+        "user_id": arrays["user_ids"],
+        "item_id": arrays["item_ids"],
+        "rating": arrays["ratings"],
+    })
+    is_test = arrays["folds"] == fold
+    train_df, test_df = ratings[~is_test], ratings[is_test]
+
+    started = time.perf_counter()
+    factors = _fit(trainer, train_df, params)
+    seconds = time.perf_counter() - started
+
+    est = predict(factors, test_df["user_id"], test_df["item_id"])
+    rmse = float(np.sqrt(np.mean((est - test_df["rating"].to_numpy()) ** 2)))
+    return config_id, fold, rmse, seconds
+
+
+# -------------------------------------------------------------------------
+# Search
+# -------------------------------------------------------------------------
+def _load_ratings(clicks_directory, clicks_file):
+    if clicks_directory:
+        clicks = read_click_files(list_click_files(clicks_directory))
+    else:
+        clicks = read_click_files([clicks_file])
+    return get_user_article_affinity_ratings(interactions_df=get_interactions(clicks, copy=False))
+
+
+def tune_cf_model(trainer: str = "als", space: dict | None = None, n_iter: int | None = None, n_folds: int = 3,
+                  keep_fraction: float = 0.5, n_jobs: int | None = None, save_model_path: str | None = None,
+                  clicks_directory: str | None = os.getenv("ClicksDirectory"),
+                  clicks_file: str = 'dataset/clicks_sample.csv', ratings_df: pd.DataFrame | None = None,
+                  blob_name: str | None = None, random_state: int = 42):
+    """
+    Cross-validated hyperparameter search for a CF trainer ("svdpp" or "als").
+
+    Configurations are first scored on a single fold; only the best
+    `keep_fraction` of them go on to the remaining folds (early stop of weak
+    configurations). Fits run on a process pool whose workers map the
+    ratings from shared arrays. The best configuration is then refitted on
+    the same ratings, with the same trainer, and saved when
+    `save_model_path` is given.
+
+    Args:
+        trainer (str): "svdpp" or "als".
+        space (Optional[dict]): {param: [values]}; SEARCH_SPACES[trainer] by default.
+        n_iter (Optional[int]): Random search over that many configurations (grid if None).
+        n_folds (int): Cross-validation folds.
+        keep_fraction (float): Share of configurations kept after the first fold.
+        n_jobs (Optional[int]): Worker processes (default: all cores; 1 = in-process).
+        save_model_path (Optional[str]): Where to write the best model artifact.
+        clicks_directory (Optional[str]): Click CSV directory (env ClicksDirectory).
+        clicks_file (str): Single click CSV used when no directory is set.
+        ratings_df (Optional[pd.DataFrame]): Precomputed [user_id, item_id, rating] triplets.
+        blob_name (Optional[str]): Blob to upload the best artifact to (None to skip).
+        random_state (int): Seed for folds and random search.
+
+    Returns:
+        List[dict]: One row per configuration (params, fold_rmse, mean_rmse,
+        fit_seconds, pruned), best first.
+    """
+    if trainer not in SEARCH_SPACES:
+        raise ValueError(f"Unknown trainer: {trainer}")
+    if n_folds < 2:
+        raise ValueError("n_folds must be at least 2.")
+    try:
+        started = time.perf_counter()
+        space = space or SEARCH_SPACES[trainer]
+        configs = grid_configs(space) if n_iter is None else random_configs(space, n_iter, random_state)
+        n_jobs = n_jobs or os.cpu_count() or 1
+
+        if ratings_df is None:
+            ratings_df = _load_ratings(clicks_directory, clicks_file)
+        if ratings_df.empty:
+            raise ValueError("No training data available for tuning.")
+
+        def build():
+            rng = np.random.default_rng(random_state)
+            return {
+                "user_ids": ratings_df["user_id"].to_numpy(dtype=np.int64),
+                "item_ids": ratings_df["item_id"].to_numpy(dtype=np.int64),
+                "ratings": ratings_df["rating"].to_numpy(dtype=np.float32),
+                "folds": rng.integers(0, n_folds, len(ratings_df)).astype(np.int8),
+            }
+
+        key = cache_key("tuning", time.time_ns(), os.getpid())
+        # Per-run key: a concurrent search must not prune it
+        arrays = load_or_publish(key, build, prune=False)
+        logging.info("Tuning %s: %d configurations, %d folds, %d ratings, %d jobs.",
+                     trainer, len(configs), n_folds, len(arrays["ratings"]), n_jobs)
+
+        fold_rmse = {i: {} for i in range(len(configs))}
+        fit_seconds = {i: 0.0 for i in range(len(configs))}
+        pool = None
+        try:
+            if n_jobs > 1:
+                pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp.get_context("spawn"),
+                                           initializer=_init_worker, initargs=(key,))
+
+            def run(tasks):
+                if pool is None:
+                    results = (evaluate_fold(arrays, *task) for task in tasks)
+                else:
+                    results = pool.map(_evaluate_task, tasks)
+                for config_id, fold, rmse, seconds in results:
+                    fold_rmse[config_id][fold] = rmse
+                    fit_seconds[config_id] += seconds
+                    logging.info("config %d fold %d: rmse=%.4f (%.1fs) %s",
+                                 config_id, fold, rmse, seconds, configs[config_id])
+
+            # Round 1: every configuration on the first fold
+            run([(trainer, i, params, 0) for i, params in enumerate(configs)])
+
+            # Round 2: the surviving configurations on the other folds
+            ranked = sorted(fold_rmse, key=lambda i: fold_rmse[i][0])
+            survivors = ranked[:max(1, int(np.ceil(len(ranked) * keep_fraction)))]
+            run([(trainer, i, configs[i], fold) for i in survivors for fold in range(1, n_folds)])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            del arrays
+            discard(key)
+
+        results = [{
+            "params": configs[i],
+            "fold_rmse": [round(fold_rmse[i][f], 5) for f in sorted(fold_rmse[i])],
+            "mean_rmse": float(np.mean(list(fold_rmse[i].values()))),
+            "fit_seconds": round(fit_seconds[i], 3),
+            "pruned": i not in survivors,
+        } for i in range(len(configs))]
+        results.sort(key=lambda r: (r["pruned"], r["mean_rmse"]))
+        best = results[0]
+        logging.info("Best %s configuration: %s (rmse=%.4f) after %.1fs.",
+                     trainer, best["params"], best["mean_rmse"], time.perf_counter() - started)
+
+        if save_model_path:
+            # Refit on the ratings the search scored, not a fresh read of the click files
+            if trainer == "als":
+                build_and_train_als_model(save_model_path, blob_name=blob_name, ratings_df=ratings_df,
+                                          **best["params"])
+            else:
+                build_and_train_model(save_model_path, params=best["params"], blob_name=blob_name,
+                                      ratings_df=ratings_df)
+        return results
+
+    except Exception as e:
+        logging.exception("Error tuning %s model: %s", trainer, e)
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validated hyperparameter search for the CF model.")
+    parser.add_argument("--trainer", choices=list(SEARCH_SPACES), default="als")
+    parser.add_argument("--space", type=json.loads, default=None, help='JSON, e.g. {"reg": [0.05, 0.1]}')
+    parser.add_argument("--n-iter", type=int, default=None)
+    parser.add_argument("--folds", type=int, default=3)
+    parser.add_argument("--keep", type=float, default=0.5)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Save the best model artifact here.")
+    parser.add_argument("--upload", default=None, help="Blob name to upload the best artifact to.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for row in tune_cf_model(args.trainer, args.space, args.n_iter, args.folds, args.keep, args.jobs,
+                             args.output, blob_name=args.upload):
+        print(json.dumps(row))